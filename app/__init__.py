@@ -1,12 +1,13 @@
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask, current_app, request
+from flask import Flask, current_app, request, g
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import os
 import sys
+import click
 
 # Import extensions
 from .extensions import mongo, mongodb, bcrypt, login_manager, jwt, oauth
@@ -32,6 +33,21 @@ def create_app(config_name='default'):
     # AI Services Configuration
     app.config['GROQ_API_KEY'] = os.getenv('GROQ_API_KEY')
     
+    # Cycle statistics backend: 'python', 'pipeline' (MongoDB aggregation) or 'online' (running aggregates, opt-in)
+    app.config['CYCLE_STATS_BACKEND'] = os.getenv('CYCLE_STATS_BACKEND', 'python')
+    
+    # Symptom log storage: 'documents' (cycle_symptoms) or 'buckets' (symptom_buckets)
+    app.config['SYMPTOM_STORAGE'] = os.getenv('SYMPTOM_STORAGE', 'documents')
+    
+    # Load and warm up MedBERT in create_app (gunicorn --preload: once, before the workers fork)
+    app.config['MEDBERT_WARMUP'] = os.getenv('MEDBERT_WARMUP', '').lower() in ('1', 'true', 'yes')
+    
+    # Embed cycle notes on save in a background thread ('background') or within the request ('inline')
+    app.config['MEDBERT_EMBED_ON_SAVE'] = os.getenv('MEDBERT_EMBED_ON_SAVE', 'background')
+    
+    # Memory-mapped note similarity indexes (see NoteIndex)
+    app.config['NOTE_INDEX_DIR'] = os.getenv('NOTE_INDEX_DIR', os.path.join(app.instance_path, 'note_index'))
+    
     # File upload configuration
     app.config['UPLOAD_FOLDER'] = os.path.join('app', 'static', 'uploads')
     app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
@@ -137,6 +153,31 @@ def create_app(config_name='default'):
     app.register_blueprint(nearby_bp, url_prefix='/nearby')
     app.register_blueprint(shop_bp, url_prefix='/shop')
     
+    # Register CLI commands
+    from .cli import register_commands
+    register_commands(app)
+    
+    # CLI commands (other than the dev server) load the model themselves if they need it
+    cli_context = click.get_current_context(silent=True)
+    if app.config['MEDBERT_WARMUP'] and (cli_context is None or cli_context.info_name == 'run'):
+        from app.services import ml
+        medbert = ml.warm_up()
+        if medbert['status'] == 'warm':
+            app.logger.info(f"MedBERT warm in {medbert['seconds']}s")
+        else:
+            app.logger.error(f"MedBERT warm-up failed: {medbert['error']}")
+    
+    # Report cycle-model round-trips per request while developing
+    @app.after_request
+    def report_cycle_queries(response):
+        if app.debug:
+            from app.models.cycle_stats import CycleStatsCache
+            queries = g.get('cycle_queries', 0)
+            response.headers['X-Cycle-Queries'] = str(queries)
+            app.logger.debug(f"{request.method} {request.path}: {queries} cycle queries, "
+                             f"stats cache {CycleStatsCache.get_counters()}")
+        return response
+
     # Add template global
     @app.context_processor
     def inject_config():
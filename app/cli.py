@@ -0,0 +1,692 @@
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from bson.objectid import ObjectId
+from flask.cli import AppGroup
+
+from app.models.menstrual_cycle import MenstrualCycle
+from app.models.cycle_aggregates import CycleAggregates
+from app.models.cycle_prediction import CyclePrediction
+from app.models.cycle_abnormalities import CycleAbnormalities
+from app.models.symptom_rollup import SymptomRollup
+from app.models.symptom_bucket import SymptomBucket
+from app.models.embedding_cache import EmbeddingCache
+from app.models.cycle_embedding import CycleEmbedding
+from app.models.note_index import NoteIndex, top_k, normalize_rows
+from app.extensions import mongo
+from app.services.calendar_builder import CalendarBuilder
+from app.services import cycle_batch, ml, ml_worker
+from app.services.ml import HEAVY_MODULES
+
+cycles_cli = AppGroup('cycles', help='Menstrual cycle maintenance and benchmarks.')
+ml_cli = AppGroup('ml', help='MedBERT and model tooling.')
+
+
+def _timed(func, repeat):
+    """Run func repeat times and return (result, per-call timings in ms)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, sorted(timings)
+
+
+def _summary(timings):
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return f"median {timings[len(timings) // 2]:.2f} ms, p95 {p95:.2f} ms"
+
+
+@cycles_cli.command('bench-stats')
+@click.argument('user_id')
+@click.option('--months', default=12, show_default=True, help='Look-back window.')
+@click.option('--repeat', default=20, show_default=True, help='Runs per backend.')
+def bench_stats(user_id, months, repeat):
+    """Time the statistics backends and check Python and pipeline agree.
+
+    The online backend is timed too; it covers the whole history, so its
+    values are not expected to match the windowed backends.
+    """
+    results = {}
+    for backend in ('online', 'python', 'pipeline'):
+        stats, timings = _timed(
+            lambda: MenstrualCycle._compute_cycle_statistics(user_id, months, backend=backend),
+            repeat
+        )
+        results[backend] = stats
+        click.echo(f"{backend:>8}: {_summary(timings)}")
+
+    fields = ('total_cycles', 'avg_cycle_length', 'min_cycle_length',
+              'max_cycle_length', 'avg_period_length', 'cycle_regularity')
+    python_stats, pipeline_stats = results['python'] or {}, results['pipeline'] or {}
+    mismatches = [f for f in fields if python_stats.get(f) != pipeline_stats.get(f)]
+    if mismatches:
+        click.echo(f"Backends disagree on: {', '.join(mismatches)}")
+    else:
+        click.echo('Python and pipeline backends return the same statistics.')
+
+
+def _synthetic_calendar_user(years, logs_per_day, seed=7):
+    """In-memory cycles, predictions and symptom logs of a long-term user"""
+    rng = random.Random(seed)
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    start = today - timedelta(days=365 * years)
+
+    cycles = []
+    while start < today:
+        period = rng.randint(3, 7)
+        cycles.append({'start_date': start, 'end_date': start + timedelta(days=period - 1),
+                       'flow_intensity': rng.choice(['light', 'moderate', 'heavy'])})
+        start += timedelta(days=rng.randint(24, 35))
+
+    predictions = []
+    for _ in range(6):
+        end = start + timedelta(days=4)
+        ovulation = start + timedelta(days=14)
+        predictions.append({
+            'menstrual_phase': (start, end),
+            'follicular_phase': (end + timedelta(days=1), ovulation - timedelta(days=1)),
+            'ovulatory_phase': (ovulation, ovulation + timedelta(days=1)),
+            'luteal_phase': (ovulation + timedelta(days=2), start + timedelta(days=27))
+        })
+        start += timedelta(days=28)
+
+    symptoms = []
+    day = today - timedelta(days=365 * years)
+    while day <= today:
+        for _ in range(logs_per_day):
+            symptoms.append({'date': day + timedelta(hours=rng.randint(0, 23)),
+                             'symptoms': [rng.choice(['cramps', 'fatigue', 'headache'])]})
+        day += timedelta(days=1)
+    return cycles, predictions, symptoms
+
+
+def _legacy_calendar_days(year, month, cycles, predicted_cycles, symptoms, today):
+    """The per-day scan get_calendar_data used before CalendarBuilder"""
+    _, num_days = monthrange(year, month)
+    calendar_days = [{'day': '', 'date': None, 'is_today': False, 'cycle': None, 'symptoms': []}
+                     for _ in range(datetime(year, month, 1).weekday())]
+    for day in range(1, num_days + 1):
+        current_date = datetime(year, month, day)
+        cycle_data = None
+        for cycle in cycles:
+            if cycle['start_date'].date() <= current_date.date() and (cycle.get('end_date') is None or cycle['end_date'].date() >= current_date.date()):
+                cycle_data = {'is_period': True, 'flow': cycle.get('flow_intensity', 'moderate')}
+                break
+        if not cycle_data:
+            for prediction in predicted_cycles:
+                for phase_name, (start, end) in prediction.items():
+                    if start.date() <= current_date.date() <= end.date():
+                        cycle_data = {'predicted_phase': phase_name.split('_')[0].capitalize(), 'is_predicted': True}
+                        break
+                if cycle_data:
+                    break
+        day_symptoms = [s for s in symptoms if s['date'].date() == current_date.date()]
+        calendar_days.append({'day': day, 'date': current_date, 'is_today': current_date.date() == today.date(),
+                              'cycle': cycle_data, 'symptoms': day_symptoms})
+    return calendar_days
+
+
+@cycles_cli.command('bench-calendar')
+@click.option('--years', default=10, show_default=True, help='Length of the synthetic history.')
+@click.option('--logs-per-day', default=3, show_default=True, help='Symptom logs per day.')
+@click.option('--repeat', default=5, show_default=True, help='Runs per implementation.')
+def bench_calendar(years, logs_per_day, repeat):
+    """Compare the per-day calendar scan with CalendarBuilder on synthetic data."""
+    cycles, predictions, symptoms = _synthetic_calendar_user(years, logs_per_day)
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    year = today.year
+
+    def in_range(first_day, last_day):
+        # What the date-range queries would have returned
+        month_cycles = [c for c in cycles
+                        if c['start_date'] <= last_day and (c['end_date'] is None or c['end_date'] >= first_day)]
+        month_symptoms = [s for s in symptoms if first_day <= s['date'] <= last_day]
+        return month_cycles, month_symptoms
+
+    # Query results are prepared up front so only the calendar build is timed
+    month_inputs = []
+    for month in range(1, 13):
+        first_day = datetime(year, month, 1)
+        month_inputs.append((month, *in_range(first_day, first_day + timedelta(days=monthrange(year, month)[1]))))
+    builder = CalendarBuilder.for_months(year, 1, 12)
+    first_day, last_day = builder.range_bounds()
+    year_cycles, year_symptoms = in_range(first_day, last_day + timedelta(days=1))
+
+    def legacy_year():
+        return [_legacy_calendar_days(year, month, month_cycles, predictions, month_symptoms, today)
+                for month, month_cycles, month_symptoms in month_inputs]
+
+    def builder_year():
+        builder = CalendarBuilder.for_months(year, 1, 12)
+        builder.add_cycles(year_cycles).add_predictions(predictions).add_symptoms(year_symptoms)
+        return [builder.month(year, month, today)['days'] for month in range(1, 13)]
+
+    click.echo(f"{len(cycles)} cycles, {len(symptoms)} symptom logs over {years} years")
+    legacy, legacy_timings = _timed(legacy_year, repeat)
+    built, builder_timings = _timed(builder_year, repeat)
+    click.echo(f"  legacy (12 month scans): {_summary(legacy_timings)}")
+    click.echo(f"  builder (one year pass): {_summary(builder_timings)}")
+    click.echo('Outputs match.' if legacy == built else 'Outputs differ!')
+
+
+@cycles_cli.command('nightly-stats')
+@click.option('--workers', default=None, type=int, help='Worker processes (default: CPU count, 0 = in-process).')
+@click.option('--chunk-rows', default=50000, show_default=True, help='Cycles per worker chunk.')
+@click.option('--batch-size', default=10000, show_default=True, help='MongoDB cursor batch size.')
+def nightly_stats(workers, chunk_rows, batch_size):
+    """Compute statistics for every user into cycle_analytics."""
+    started = time.perf_counter()
+    users, cycles = cycle_batch.run(mongo.db, workers=workers, chunk_rows=chunk_rows, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    rate = users / elapsed if elapsed else 0
+    click.echo(f"Processed {users} users ({cycles} cycles) in {elapsed:.1f}s: {rate:.0f} users/s")
+
+
+@cycles_cli.command('backfill-effective-end')
+def backfill_effective_end():
+    """Add effective_end to cycles saved before the interval index existed.
+
+    Run once when deploying the interval index: date-range queries match on
+    effective_end, so cycles without it are missing from the calendars.
+    """
+    updated = MenstrualCycle.backfill_effective_end()
+    click.echo(f"Set effective_end on {updated} cycles")
+
+
+def _plan_stages(plan):
+    """Flatten an explain plan tree into its stages, root first"""
+    stages = [plan]
+    for child in plan.get('inputStages', []) + ([plan['inputStage']] if 'inputStage' in plan else []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+@cycles_cli.command('dedupe-calendar-predictions')
+def dedupe_calendar_predictions():
+    """Remove duplicate calendar predictions, then create their unique index.
+
+    Run once on databases written before the index existed.
+    """
+    removed = CyclePrediction.remove_duplicate_calendar_phases()
+    click.echo(f"Removed {removed} duplicate calendar predictions")
+    if not CyclePrediction.create_calendar_key_index():
+        raise click.ClickException('unique calendar prediction index could not be created')
+    click.echo("Unique calendar prediction index in place")
+
+
+@cycles_cli.command('explain-date-range')
+@click.argument('user_id')
+@click.option('--days', default=42, show_default=True, help='Length of the range, ending today.')
+def explain_date_range(user_id, days):
+    """Check get_cycles_in_date_range is answered by the interval index.
+
+    Exits non-zero unless the winning plan is an index scan whose fetch
+    needs no further filtering, i.e. both range bounds are index bounds.
+    """
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    explain = mongo.db[MenstrualCycle.COLLECTION].find(
+        MenstrualCycle._date_range_query(user_id, start, end)
+    ).sort('start_date', 1).explain()
+
+    winning_plan = explain['queryPlanner']['winningPlan']
+    stages = _plan_stages(winning_plan.get('queryPlan', winning_plan))
+    names = [stage['stage'] for stage in stages]
+    click.echo(f"Plan: {' -> '.join(names)}")
+    for stage in stages:
+        if stage['stage'] == 'IXSCAN':
+            click.echo(f"Index {stage['indexName']}, bounds {stage.get('indexBounds')}")
+
+    stats = explain.get('executionStats')
+    if stats:
+        click.echo(f"Keys examined {stats['totalKeysExamined']}, documents examined "
+                   f"{stats['totalDocsExamined']}, returned {stats['nReturned']}")
+
+    problems = []
+    if 'COLLSCAN' in names or 'IXSCAN' not in names:
+        problems.append('query is not served by an index scan')
+    if 'SORT' in names:
+        problems.append('results are sorted in memory')
+    if any(stage['stage'] == 'FETCH' and stage.get('filter') for stage in stages):
+        problems.append('documents are filtered after the fetch')
+    if problems:
+        raise click.ClickException('; '.join(problems))
+    click.echo('OK: IXSCAN only, both bounds served by the index.')
+
+
+@cycles_cli.command('analyze-history')
+@click.option('--user-id', default=None, help='Only analyse this user (default: everyone).')
+def analyze_history(user_id):
+    """Store cycle lengths and abnormality flags on every cycle."""
+    started = time.perf_counter()
+    if user_id:
+        users, updated = 1, CycleAbnormalities.analyze_user(user_id)
+    else:
+        users, updated = CycleAbnormalities.analyze_all()
+    click.echo(f"Analysed {users} users, updated {updated} cycles in {time.perf_counter() - started:.1f}s")
+
+
+@cycles_cli.command('rebuild-aggregates')
+@click.option('--user-id', default=None, help='Only rebuild this user (default: everyone).')
+def rebuild_aggregates(user_id):
+    """Recompute the running cycle length aggregates from the stored cycles."""
+    started = time.perf_counter()
+    result = CycleAggregates.rebuild(user_id)
+    users = 1 if user_id else result
+    click.echo(f"Rebuilt cycle aggregates for {users} users in {time.perf_counter() - started:.1f}s")
+
+
+@cycles_cli.command('rebuild-rollups')
+@click.option('--user-id', default=None, help='Only rebuild this user (default: everyone).')
+def rebuild_rollups(user_id):
+    """Recompute monthly symptom rollups from the symptom logs."""
+    started = time.perf_counter()
+    logs = SymptomRollup.rebuild(user_id)
+    click.echo(f"Rolled up {logs} symptom logs in {time.perf_counter() - started:.1f}s")
+
+
+def _collection_size(name):
+    """(documents, storage bytes) of a collection; bytes is None if collStats is unavailable"""
+    try:
+        stats = mongo.db.command('collStats', name)
+        return stats.get('count', 0), stats.get('size', 0)
+    except Exception:
+        return mongo.db[name].estimated_document_count(), None
+
+
+@cycles_cli.command('migrate-symptom-buckets')
+@click.option('--user-id', default=None, help='Only migrate this user (default: everyone).')
+@click.option('--sample', default=20, show_default=True, help='Users to time a one-year read for.')
+@click.option('--repeat', default=5, show_default=True, help='Timed reads per user and storage.')
+def migrate_symptom_buckets(user_id, sample, repeat):
+    """Copy cycle_symptoms into monthly symptom_buckets and report the savings.
+
+    cycle_symptoms is left in place; set SYMPTOM_STORAGE=buckets to switch
+    reads and writes over once the migration has run. Refuses to run after
+    the switch.
+    """
+    started = time.perf_counter()
+    try:
+        logs, buckets = SymptomBucket.migrate(user_id)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Migrated {logs} logs into {buckets} buckets in {time.perf_counter() - started:.1f}s")
+
+    for name in ('cycle_symptoms', SymptomBucket.COLLECTION):
+        count, size = _collection_size(name)
+        size_text = f"{size / 1024:.1f} KiB" if size is not None else 'size unavailable'
+        click.echo(f"{name:>16}: {count} documents, {size_text}")
+
+    user_ids = [user_id] if user_id else mongo.db[SymptomBucket.COLLECTION].distinct('user_id')[:sample]
+    end = datetime.utcnow()
+    start = end - timedelta(days=365)
+    document_timings, bucket_timings = [], []
+    for uid in user_ids:
+        key = SymptomBucket._user_key(uid)
+        _, timings = _timed(lambda: list(mongo.db['cycle_symptoms'].find(
+            {'user_id': key, 'date': {'$gte': start, '$lte': end}}).sort('date', 1)), repeat)
+        document_timings.extend(timings)
+        _, timings = _timed(lambda: SymptomBucket.find_logs(key, start, end), repeat)
+        bucket_timings.extend(timings)
+
+    if user_ids:
+        click.echo(f"One-year read over {len(user_ids)} users")
+        click.echo(f"{'documents':>16}: {_summary(sorted(document_timings))}")
+        click.echo(f"{'buckets':>16}: {_summary(sorted(bucket_timings))}")
+
+
+_IMPORT_CHECK = (
+    "import sys\n"
+    "from app import create_app\n"
+    "create_app()\n"
+    "print(','.join(m for m in {heavy!r} if m in sys.modules))\n"
+)
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+@ml_cli.command('import-check')
+@click.option('--budget-ms', default=3000, show_default=True, help='Maximum cumulative import time.')
+@click.option('--top', default=10, show_default=True, help='Slowest top-level imports to list.')
+def import_check(budget_ms, top):
+    """Check create_app stays within its import budget without loading the ML stack.
+
+    Runs create_app in a fresh interpreter under ``-X importtime`` and fails
+    if torch, transformers or scikit-learn got imported, or if the total
+    import time is over the budget.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _IMPORT_CHECK.format(heavy=HEAVY_MODULES)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f"create_app failed:\n{result.stderr[-2000:]}")
+
+    # Top-level imports are the lines with a single space of indentation
+    top_level = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            top_level.append((int(match.group(2)) / 1000, match.group(4)))
+    total_ms = sum(ms for ms, _ in top_level)
+
+    click.echo(f"Imports: {total_ms:.0f} ms cumulative (budget {budget_ms} ms)")
+    for ms, name in sorted(top_level, reverse=True)[:top]:
+        click.echo(f"  {ms:8.1f} ms  {name}")
+
+    problems = []
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    if loaded:
+        problems.append(f"create_app imported {', '.join(loaded)}")
+    if total_ms > budget_ms:
+        problems.append(f"import time {total_ms:.0f} ms is over the {budget_ms} ms budget")
+    if problems:
+        raise click.ClickException('; '.join(problems))
+    click.echo(f"OK: none of {', '.join(HEAVY_MODULES)} imported at startup.")
+
+
+def _embed_cycles(cycles):
+    """Store embeddings for cycles (with notes) that have none yet; returns how many"""
+    existing = CycleEmbedding.get_many([c['_id'] for c in cycles])
+    cycles = [c for c in cycles if c['_id'] not in existing]
+    embeddings = EmbeddingCache.get_or_compute_many([c['notes'] for c in cycles])
+    for cycle in cycles:
+        CycleEmbedding.store(cycle['_id'], cycle['user_id'], embeddings[cycle['notes']])
+    return len(cycles)
+
+
+@ml_cli.command('backfill-embeddings')
+@click.option('--user-id', default=None, help='Only this user.')
+@click.option('--batch-size', default=64, show_default=True, help='Notes embedded per call.')
+def backfill_embeddings(user_id, batch_size):
+    """Embed the notes of cycles saved before embeddings were computed on save."""
+    query = {'notes': {'$nin': [None, '']}}
+    if user_id:
+        query['user_id'] = ObjectId(user_id)
+    started = time.perf_counter()
+    checked = stored = 0
+    batch = []
+    for cycle in mongo.db[MenstrualCycle.COLLECTION].find(query, {'user_id': 1, 'notes': 1}):
+        batch.append(cycle)
+        checked += 1
+        if len(batch) == batch_size:
+            stored += _embed_cycles(batch)
+            batch = []
+    if batch:
+        stored += _embed_cycles(batch)
+    counters = EmbeddingCache.get_counters()
+    click.echo(f"Checked {checked} cycles, stored {stored} embeddings "
+               f"({counters['computed']} computed) in {time.perf_counter() - started:.1f}s")
+
+
+@ml_cli.command('strip-medbert-notes')
+def strip_medbert_notes():
+    """Move stringified MedBERT embeddings out of cycle notes into cycle_embeddings."""
+    before = _collection_size(MenstrualCycle.COLLECTION)
+    started = time.perf_counter()
+    cleaned, kept = CycleEmbedding.strip_notes()
+    click.echo(f"Cleaned the notes of {cleaned} cycles, kept {kept} embeddings "
+               f"in {time.perf_counter() - started:.1f}s")
+    after = _collection_size(MenstrualCycle.COLLECTION)
+    if before[1] is not None and after[1] is not None:
+        click.echo(f"{MenstrualCycle.COLLECTION}: {before[1] / 1024:.0f} KiB -> {after[1] / 1024:.0f} KiB")
+
+
+@ml_cli.command('rebuild-note-index')
+@click.option('--user-id', default=None, help='Only this user.')
+@click.option('--cohort', is_flag=True, help='Also build the index across all users.')
+def rebuild_note_index(user_id, cohort):
+    """Rewrite the note similarity indexes from cycle_embeddings."""
+    started = time.perf_counter()
+    user_ids = [ObjectId(user_id)] if user_id else mongo.db[CycleEmbedding.COLLECTION].distinct('user_id')
+    vectors = sum(NoteIndex.for_user(u).rebuild({'user_id': u}) for u in user_ids)
+    click.echo(f"Indexed {vectors} notes of {len(user_ids)} users")
+    if cohort:
+        click.echo(f"Cohort index: {NoteIndex.for_cohort('all').rebuild({})} notes")
+    click.echo(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+@ml_cli.command('bench-similarity')
+@click.option('--sizes', default='10000,1000000', show_default=True, help='Comma-separated vector counts.')
+@click.option('--dims', default=768, show_default=True)
+@click.option('--k', default=10, show_default=True)
+@click.option('--queries', default=50, show_default=True, help='Timed queries per size.')
+def bench_similarity(sizes, dims, k, queries):
+    """Time top-k cosine search over memory-mapped float32 matrices of random vectors."""
+    rng = np.random.default_rng(7)
+    directory = tempfile.mkdtemp()
+    for size in (int(value) for value in sizes.split(',')):
+        path = os.path.join(directory, f'bench_{size}.npy')
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(size, dims))
+        for start in range(0, size, 100_000):
+            stop = min(start + 100_000, size)
+            matrix[start:stop] = normalize_rows(rng.standard_normal((stop - start, dims), dtype=np.float32))
+        matrix.flush()
+        del matrix
+
+        matrix = np.load(path, mmap_mode='r')
+        probes = normalize_rows(rng.standard_normal((queries + 1, dims), dtype=np.float32))
+        started = time.perf_counter()
+        top_k(matrix, probes[0], k)
+        first_ms = (time.perf_counter() - started) * 1000
+        timings = []
+        for probe in probes[1:]:
+            started = time.perf_counter()
+            top_k(matrix, probe, k)
+            timings.append((time.perf_counter() - started) * 1000)
+        click.echo(f"{size:>9} x {dims}: {matrix.nbytes / 2 ** 20:6.0f} MiB, first query {first_ms:.1f} ms, "
+                   f"then {_summary(sorted(timings))}")
+        del matrix
+        os.remove(path)
+    os.rmdir(directory)
+
+
+_NOTE_WORDS = ('cramps', 'headache', 'bloating', 'fatigue', 'heavy', 'flow', 'mild', 'severe',
+               'nausea', 'back', 'pain', 'mood', 'swings', 'slept', 'badly', 'spotting', 'today',
+               'after', 'exercise', 'ibuprofen', 'helped', 'tender', 'breasts', 'acne')
+
+
+def _synthetic_notes(count, seed=7):
+    """Cycle notes of 3 to 120 words"""
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(_NOTE_WORDS) for _ in range(rng.randint(3, 120)))
+            for _ in range(count)]
+
+
+def _run_concurrently(func, texts, concurrency):
+    """Call func on every text from concurrent threads.
+
+    Returns (results, sorted per-call latencies in ms, texts per second).
+    """
+    def timed_call(text):
+        started = time.perf_counter()
+        result = func(text)
+        return result, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(timed_call, texts))
+    elapsed = time.perf_counter() - started
+    return [r for r, _ in outcomes], sorted(ms for _, ms in outcomes), len(texts) / elapsed
+
+
+@ml_cli.command('bench-batching')
+@click.option('--texts', 'count', default=128, show_default=True, help='Synthetic notes to embed.')
+@click.option('--concurrency', default=8, show_default=True, help='Concurrent callers.')
+@click.option('--max-batch', default=ml.MEDBERT_MAX_BATCH, show_default=True)
+@click.option('--max-wait-ms', default=ml.MEDBERT_MAX_WAIT_MS, show_default=True)
+def bench_batching(count, concurrency, max_batch, max_wait_ms):
+    """Compare single-text MedBERT calls with batched and micro-batched ones on CPU."""
+    texts = _synthetic_notes(count)
+    ml.medbert_embedding(texts[0])  # load the model and warm up outside the timings
+
+    single, single_ms, single_rate = _run_concurrently(ml.medbert_embedding, texts, concurrency)
+    click.echo(f"  single text: {single_rate:6.1f} texts/s, {_summary(single_ms)}")
+
+    batcher = ml.MicroBatcher(lambda batch: ml.medbert_embeddings(batch, max_batch), max_batch, max_wait_ms)
+    batched, batched_ms, batched_rate = _run_concurrently(batcher, texts, concurrency)
+    click.echo(f"micro-batched: {batched_rate:6.1f} texts/s, {_summary(batched_ms)} "
+               f"({batcher.batches} batches, {batcher.items / max(batcher.batches, 1):.1f} texts each)")
+
+    started = time.perf_counter()
+    offline = ml.medbert_embeddings(texts, max_batch)
+    click.echo(f"  one call of {count}: {count / (time.perf_counter() - started):6.1f} texts/s")
+
+    difference = max(abs(a - b)
+                     for reference, *others in zip(single, batched, offline)
+                     for other in others for a, b in zip(reference, other))
+    click.echo(f"Largest difference from the single-text embeddings: {difference:.2e}")
+
+
+_OWN_MODEL = (
+    "from app.services import ml, ml_worker\n"
+    "ml.medbert_embedding('warm up')\n"
+    "print(ml_worker.max_rss_kb())\n"
+)
+_WORKER_CLIENT = (
+    "from app.services import ml_worker\n"
+    "ml_worker.EmbeddingClient({socket_path!r}).embed('warm up')\n"
+    "print(ml_worker.max_rss_kb())\n"
+)
+
+
+def _peak_rss_of(snippet, processes):
+    """Run snippet in that many concurrent interpreters; returns their peak RSS in KiB"""
+    children = [subprocess.Popen([sys.executable, '-c', snippet], cwd=ml_worker._PROJECT_ROOT,
+                                 stdout=subprocess.PIPE, text=True)
+                for _ in range(processes)]
+    sizes = []
+    for child in children:
+        output, _ = child.communicate()
+        if child.returncode != 0:
+            raise click.ClickException(f"Child process exited with code {child.returncode}")
+        sizes.append(int(output.split()[-1]))
+    return sizes
+
+
+@ml_cli.command('bench-memory')
+@click.option('--processes', default=4, show_default=True, help='Simulated web worker processes.')
+def bench_memory(processes):
+    """Compare peak RSS of per-process MedBERT copies with one shared inference worker."""
+    own = _peak_rss_of(_OWN_MODEL, processes)
+    click.echo(f"{processes} processes with their own model: {sum(own) / 1024:8.0f} MiB "
+               f"({max(own) / 1024:.0f} MiB each at most)")
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'medbert.sock')
+    worker = ml_worker.start_worker(socket_path)
+    try:
+        clients = _peak_rss_of(_WORKER_CLIENT.format(socket_path=socket_path), processes)
+        worker_kb = ml_worker.EmbeddingClient(socket_path).ping()['max_rss_kb']
+    finally:
+        worker.terminate()
+        worker.wait()
+    shared = worker_kb + sum(clients)
+    click.echo(f"{processes} clients and one shared worker:  {shared / 1024:8.0f} MiB "
+               f"(worker {worker_kb / 1024:.0f} MiB, clients {max(clients) / 1024:.0f} MiB each at most)")
+    click.echo(f"Saved {(sum(own) - shared) / 1024:.0f} MiB")
+
+
+def _state_dict_mib(model):
+    """Serialized size of a model's weights in MiB"""
+    buffer = io.BytesIO()
+    ml.torch().save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+@ml_cli.command('bench-quantized')
+@click.option('--texts', 'count', default=64, show_default=True, help='Synthetic notes to embed.')
+@click.option('--threads', default=ml.MEDBERT_THREADS, show_default=True, help='torch threads; 0 keeps the default.')
+@click.option('--repeat', default=3, show_default=True, help='Timed passes per model.')
+def bench_quantized(count, threads, repeat):
+    """Compare fp32 and int8 dynamic-quantized MedBERT: latency, size and cosine similarity."""
+    torch = ml.torch()
+    if threads:
+        torch.set_num_threads(threads)
+    click.echo(f"torch threads: {torch.get_num_threads()}")
+    texts = _synthetic_notes(count)
+
+    results = {}
+    for precision in ('fp32', 'int8'):
+        medbert = ml.load_medbert(precision)
+        ml.medbert_embedding(texts[0], medbert)  # warm up outside the timings
+        single_ms = []
+        for text in texts:
+            single_ms.extend(_timed(lambda: ml.medbert_embedding(text, medbert), repeat)[1])
+        embeddings, batch_ms = _timed(lambda: ml.medbert_embeddings(texts, medbert=medbert), repeat)
+        results[precision] = np.array(embeddings)
+        click.echo(f"{precision}: {_state_dict_mib(medbert[1]):6.0f} MiB weights, single text "
+                   f"{_summary(sorted(single_ms))}, {count} texts batched median {batch_ms[len(batch_ms) // 2]:.0f} ms")
+
+    fp32, int8 = results['fp32'], results['int8']
+    cosine = (fp32 * int8).sum(axis=1) / (np.linalg.norm(fp32, axis=1) * np.linalg.norm(int8, axis=1))
+    click.echo(f"Cosine similarity int8 vs fp32: mean {cosine.mean():.4f}, min {cosine.min():.4f}")
+
+
+_COLD_START = (
+    "import json, time\n"
+    "from app.services import ml\n"
+    "started = time.perf_counter()\n"
+    "ml.medbert_embedding('first request')\n"
+    "first = time.perf_counter() - started\n"
+    "started = time.perf_counter()\n"
+    "ml.medbert_embedding('second request')\n"
+    "print(json.dumps({'first': first, 'second': time.perf_counter() - started}))\n"
+)
+# Warm up, then fork like gunicorn --preload and time the requests in the child
+_WARM_START = (
+    "import json, os, time\n"
+    "from app.services import ml\n"
+    "ml.MEDBERT_WORKER_SOCKET = None\n"
+    "ml.warm_up()\n"
+    "read_end, write_end = os.pipe()\n"
+    "if os.fork() == 0:\n"
+    "    started = time.perf_counter()\n"
+    "    ml.medbert_embedding('first request')\n"
+    "    first = time.perf_counter() - started\n"
+    "    started = time.perf_counter()\n"
+    "    ml.medbert_embedding('second request')\n"
+    "    os.write(write_end, json.dumps({'first': first, 'second': time.perf_counter() - started}).encode())\n"
+    "    os._exit(0)\n"
+    "os.close(write_end)\n"
+    "timings = json.loads(os.read(read_end, 4096))\n"
+    "os.wait()\n"
+    "timings['warm_up'] = ml.warm_status()['seconds']\n"
+    "print(json.dumps(timings))\n"
+)
+
+
+def _run_snippet(snippet):
+    result = subprocess.run([sys.executable, '-c', snippet], cwd=ml_worker._PROJECT_ROOT,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise click.ClickException(f"Benchmark process failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@ml_cli.command('bench-warmup')
+def bench_warmup():
+    """Compare the first MedBERT request of a cold process with one forked after warm_up."""
+    cold = _run_snippet(_COLD_START)
+    click.echo(f"cold: first request {cold['first'] * 1000:8.0f} ms, second {cold['second'] * 1000:6.0f} ms")
+    warm = _run_snippet(_WARM_START)
+    click.echo(f"warm: first request {warm['first'] * 1000:8.0f} ms, second {warm['second'] * 1000:6.0f} ms "
+               f"(warm-up in the parent took {warm['warm_up']:.1f}s)")
+
+
+def register_commands(app):
+    """Attach the CLI command groups to the app"""
+    app.cli.add_command(cycles_cli)
+    app.cli.add_command(ml_cli)
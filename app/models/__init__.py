@@ -1,6 +1,17 @@
 from .user import User
 from .chat import ChatMessage
 from .menstrual_cycle import MenstrualCycle, CycleSymptom
+from .cycle_stats import CycleStatsCache
+from .cycle_aggregates import CycleAggregates
+from .cycle_abnormalities import CycleAbnormalities
+from .symptom_matrix import SymptomMatrix
+from .symptom_rollup import SymptomRollup
+from .symptom_bucket import SymptomBucket
+from .cycle_snapshot import CycleSnapshot
+from .embedding_cache import EmbeddingCache
+from .cycle_embedding import CycleEmbedding
+from .note_index import NoteIndex
+from .cycle_prediction import CyclePrediction, CycleAnalytics
 from .menstrual_profile import MenstrualProfile, VoiceLog, DataExport
 from .menstrual_reminder import MenstrualReminder, HealthReport, LifestyleRecommendation
 from .community import Post, Comment, Category
@@ -8,13 +19,20 @@ from .community import Post, Comment, Category
 def init_models():
     """Initialize all models and create indexes"""
     # Import modules to ensure models are registered
-    from . import user, chat, menstrual_cycle, menstrual_profile, menstrual_reminder, community
+    from . import user, chat, menstrual_cycle, cycle_stats, cycle_aggregates, cycle_abnormalities, symptom_matrix, symptom_rollup, symptom_bucket, embedding_cache, cycle_embedding, note_index, cycle_prediction, menstrual_profile, menstrual_reminder, community
 
     # Create indexes for all models
     User.create_indexes()
     ChatMessage.create_indexes()
     MenstrualCycle.create_indexes()
     CycleSymptom.create_indexes()
+    CycleStatsCache.create_indexes()
+    SymptomMatrix.create_indexes()
+    SymptomRollup.create_indexes()
+    SymptomBucket.create_indexes()
+    CycleEmbedding.create_indexes()
+    CyclePrediction.create_indexes()
+    CycleAnalytics.create_indexes()
     MenstrualProfile.create_indexes()
     VoiceLog.create_indexes()
     DataExport.create_indexes()
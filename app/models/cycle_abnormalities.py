@@ -0,0 +1,134 @@
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from app.extensions import mongo
+
+
+class CycleAbnormalities:
+    """Vectorised abnormality analysis of whole cycle histories.
+
+    Applies the rules of MenstrualCycle.analyze_cycle_abnormalities to
+    arrays covering every cycle at once and stores the outcome on each cycle
+    document (``cycle_length``, ``period_length``, ``abnormality_flags``), so
+    history pages read flags instead of re-analysing every cycle per request.
+    """
+    TYPICAL_CYCLE = (21, 35)
+    MAX_LENGTH_VARIATION = 7
+    MAX_PERIOD_LENGTH = 7
+    # Cycle lengths that count towards the user's average, as in CycleAggregates
+    CYCLE_RANGE = (15, 60)
+
+    # Flag code -> (type, icon); descriptions are built by describe()
+    FLAGS = {
+        'irregular_length': ('Irregular Length', 'fas fa-ruler-horizontal'),
+        'length_variation': ('Length Variation', 'fas fa-chart-line'),
+        'long_period': ('Long Period', 'fas fa-tint-slash'),
+        'severe_pain': ('Severe Pain', 'fas fa-bolt')
+    }
+
+    @classmethod
+    def flag_arrays(cls, codes, start_days, end_days, severe_pain):
+        """Lengths, per-user average and flags for cycles sorted by (user, start).
+
+        ``codes`` numbers the users, ``start_days``/``end_days`` are day
+        numbers with NaN for open cycles. Returns (cycle_lengths,
+        period_lengths, user_means, flags) where lengths are NaN when unknown
+        and ``flags`` maps every code in FLAGS to a boolean array.
+        """
+        codes = np.asarray(codes)
+        num_users = int(codes.max()) + 1 if len(codes) else 0
+
+        # Cycle length: days since the previous start of the same user
+        same_user = np.r_[False, codes[1:] == codes[:-1]]
+        cycle_lengths = np.r_[np.nan, np.diff(start_days).astype(float)]
+        cycle_lengths[~same_user] = np.nan
+        period_lengths = np.asarray(end_days, dtype=float) - start_days + 1
+
+        counted = (cycle_lengths >= cls.CYCLE_RANGE[0]) & (cycle_lengths <= cls.CYCLE_RANGE[1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            user_means = (np.bincount(codes, weights=np.where(counted, cycle_lengths, 0.0), minlength=num_users)
+                          / np.bincount(codes, weights=counted, minlength=num_users))
+        average = user_means[codes] if len(codes) else np.zeros(0)
+
+        has_length = ~np.isnan(cycle_lengths)
+        irregular = has_length & ((cycle_lengths < cls.TYPICAL_CYCLE[0]) | (cycle_lengths > cls.TYPICAL_CYCLE[1]))
+        with np.errstate(invalid='ignore'):
+            variation = (has_length & ~irregular & (average > 0)
+                         & (np.abs(cycle_lengths - average) > cls.MAX_LENGTH_VARIATION))
+            long_period = period_lengths > cls.MAX_PERIOD_LENGTH
+
+        flags = {
+            'irregular_length': irregular,
+            'length_variation': variation,
+            'long_period': long_period,
+            'severe_pain': np.asarray(severe_pain, dtype=bool)
+        }
+        return cycle_lengths, period_lengths, user_means, flags
+
+    @classmethod
+    def analyze_user(cls, user_id):
+        """Recompute and store lengths and flags for a user's whole history.
+
+        Only cycles whose stored values changed are written. Returns the
+        number of cycles updated.
+        """
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        cycles = list(mongo.db['menstrual_cycles'].find(
+            {'user_id': user_id, 'start_date': {'$ne': None}},
+            {'start_date': 1, 'end_date': 1, 'pain_level': 1,
+             'cycle_length': 1, 'period_length': 1, 'abnormality_flags': 1}
+        ).sort('start_date', 1))
+        if not cycles:
+            return 0
+
+        start_days = np.array([c['start_date'] for c in cycles], dtype='datetime64[D]').astype(np.int64)
+        ends = np.array([c.get('end_date') for c in cycles], dtype='datetime64[D]')
+        end_days = np.where(np.isnat(ends), np.nan, ends.astype(np.int64).astype(float))
+        severe_pain = np.array([c.get('pain_level') == 'severe' for c in cycles])
+        cycle_lengths, period_lengths, _, flags = cls.flag_arrays(
+            np.zeros(len(cycles), dtype=np.int64), start_days, end_days, severe_pain
+        )
+
+        names = list(cls.FLAGS)
+        flag_matrix = np.column_stack([flags[name] for name in names])
+        operations = []
+        for i, cycle in enumerate(cycles):
+            values = {
+                'cycle_length': None if np.isnan(cycle_lengths[i]) else int(cycle_lengths[i]),
+                'period_length': None if np.isnan(period_lengths[i]) else int(period_lengths[i]),
+                'abnormality_flags': [name for name, flagged in zip(names, flag_matrix[i]) if flagged]
+            }
+            if any(cycle.get(field, ...) != value for field, value in values.items()):
+                operations.append(UpdateOne({'_id': cycle['_id']}, {'$set': values}))
+
+        if operations:
+            mongo.db['menstrual_cycles'].bulk_write(operations, ordered=False)
+        return len(operations)
+
+    @classmethod
+    def describe(cls, cycle, avg_cycle_length=None):
+        """Abnormality entries (type, description, icon) for stored flags"""
+        cycle_length = cycle.get('cycle_length')
+        period_length = cycle.get('period_length')
+        descriptions = {
+            'irregular_length': f'Cycle length of {cycle_length} days is outside the typical range (21-35 days).',
+            'length_variation': (
+                f'Cycle length deviates significantly from your average of {avg_cycle_length} days.'
+                if avg_cycle_length is not None else 'Cycle length deviates significantly from your average.'
+            ),
+            'long_period': f'Period duration of {period_length} days is longer than the typical 7 days.',
+            'severe_pain': 'High level of pain reported during this cycle.'
+        }
+        return [
+            {'type': cls.FLAGS[code][0], 'description': descriptions[code], 'icon': cls.FLAGS[code][1]}
+            for code in cycle.get('abnormality_flags', []) if code in cls.FLAGS
+        ]
+
+    @classmethod
+    def analyze_all(cls):
+        """Analyse every user with cycles; returns (users, cycles updated)"""
+        users = updated = 0
+        for user_id in mongo.db['menstrual_cycles'].distinct('user_id'):
+            updated += cls.analyze_user(user_id)
+            users += 1
+        return users, updated
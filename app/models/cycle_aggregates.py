@@ -0,0 +1,229 @@
+import math
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from app.extensions import mongo
+
+
+class CycleAggregates:
+    """Running cycle and period length statistics kept on the user document.
+
+    ``users.cycleAggregates`` holds Welford accumulators (count, mean, M2,
+    min, max) for cycle lengths (days between consecutive period starts)
+    and period lengths, plus the last start date. They are updated when a
+    cycle is saved, so statistics can be read without loading the history.
+    The same sanity ranges as the statistics backends apply.
+
+    Removing a value (the gap split by a cycle logged between two others)
+    keeps count, mean and M2 exact. If it was the min or max, the user's
+    aggregates are rebuilt from the stored cycles instead.
+    """
+    FIELD = 'cycleAggregates'
+    CYCLE_RANGE = (15, 60)
+    PERIOD_RANGE = (1, 14)
+    MAX_RETRIES = 5
+
+    @staticmethod
+    def _user_key(user_id):
+        return ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+
+    @staticmethod
+    def _empty():
+        return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None}
+
+    @staticmethod
+    def _add(acc, value):
+        """Welford update with one new value"""
+        acc['count'] += 1
+        delta = value - acc['mean']
+        acc['mean'] += delta / acc['count']
+        acc['m2'] += delta * (value - acc['mean'])
+        acc['min'] = value if acc['min'] is None else min(acc['min'], value)
+        acc['max'] = value if acc['max'] is None else max(acc['max'], value)
+
+    @classmethod
+    def _remove(cls, acc, value):
+        """Inverse Welford update.
+
+        Min and max are left as they are; returns True when the removed
+        value was one of them, i.e. they may no longer be exact.
+        """
+        if acc['count'] <= 1:
+            acc.update(cls._empty())
+            return False
+        delta = value - acc['mean']
+        acc['count'] -= 1
+        acc['mean'] -= delta / acc['count']
+        acc['m2'] = max(acc['m2'] - delta * (value - acc['mean']), 0.0)
+        return value in (acc['min'], acc['max'])
+
+    @staticmethod
+    def _as_stored(date):
+        """Truncate to the millisecond precision dates come back from MongoDB with"""
+        return date.replace(microsecond=date.microsecond // 1000 * 1000) if date else date
+
+    @classmethod
+    def _cycle_length(cls, earlier_start, later_start):
+        length = (later_start - earlier_start).days
+        return length if cls.CYCLE_RANGE[0] <= length <= cls.CYCLE_RANGE[1] else None
+
+    @classmethod
+    def _period_length(cls, start_date, end_date):
+        if not start_date or not end_date:
+            return None
+        length = (end_date - start_date).days + 1
+        return length if cls.PERIOD_RANGE[0] <= length <= cls.PERIOD_RANGE[1] else None
+
+    @staticmethod
+    def std(acc):
+        """Population standard deviation of an accumulator"""
+        return math.sqrt(acc['m2'] / acc['count']) if acc and acc['count'] else 0.0
+
+    @classmethod
+    def _stored(cls, user_id):
+        """Stored aggregates of a user, or None if they were never built"""
+        user = mongo.db.users.find_one({'_id': cls._user_key(user_id)}, {cls.FIELD: 1})
+        return (user or {}).get(cls.FIELD)
+
+    @classmethod
+    def get(cls, user_id):
+        """Aggregates of a user, built from the stored cycles on first read"""
+        aggregates = cls._stored(user_id)
+        if aggregates is None:
+            aggregates = cls.rebuild(user_id)
+        return aggregates
+
+    @classmethod
+    def _neighbours(cls, user_id, start_date, exclude_id=None):
+        """Start dates of the cycles right before and after start_date"""
+        query = {'user_id': user_id}
+        if exclude_id is not None:
+            query['_id'] = {'$ne': exclude_id}
+        previous = mongo.db['menstrual_cycles'].find_one(
+            {**query, 'start_date': {'$lt': start_date}}, {'start_date': 1}, sort=[('start_date', -1)])
+        following = mongo.db['menstrual_cycles'].find_one(
+            {**query, 'start_date': {'$gt': start_date}}, {'start_date': 1}, sort=[('start_date', 1)])
+        return (previous or {}).get('start_date'), (following or {}).get('start_date')
+
+    @classmethod
+    def _apply(cls, user_id, change):
+        """Read-modify-write the aggregates, retrying if another write got in first"""
+        for _ in range(cls.MAX_RETRIES):
+            current = cls._stored(user_id)
+            if current is None:
+                return cls.rebuild(user_id)
+            updated = change({
+                'cycle_length': dict(current['cycle_length']),
+                'period_length': dict(current['period_length']),
+                'last_start': current.get('last_start'),
+                'version': current.get('version', 0) + 1,
+                'updated_at': datetime.utcnow()
+            })
+            result = mongo.db.users.update_one(
+                {'_id': user_id, f'{cls.FIELD}.version': current.get('version', 0)},
+                {'$set': {cls.FIELD: updated}}
+            )
+            if result.modified_count:
+                return updated
+        # Too much contention; start again from the stored cycles
+        return cls.rebuild(user_id)
+
+    @classmethod
+    def record_cycle(cls, user_id, cycle):
+        """Add a newly stored cycle (its document must already be saved)"""
+        user_id = cls._user_key(user_id)
+        start_date = cls._as_stored(cycle['start_date'])
+        end_date = cls._as_stored(cycle.get('end_date'))
+        previous_start, next_start = cls._neighbours(user_id, start_date, cycle.get('_id'))
+
+        bounds_changed = []
+
+        def change(aggregates):
+            # Called again on every retry; only the attempt that is written counts
+            bounds_changed.clear()
+            cycle_lengths = aggregates['cycle_length']
+            # A cycle logged between two others splits the gap between them
+            if previous_start and next_start:
+                old_gap = cls._cycle_length(previous_start, next_start)
+                if old_gap is not None:
+                    bounds_changed.append(cls._remove(cycle_lengths, old_gap))
+            for earlier, later in ((previous_start, start_date), (start_date, next_start)):
+                if earlier and later:
+                    length = cls._cycle_length(earlier, later)
+                    if length is not None:
+                        cls._add(cycle_lengths, length)
+
+            period_length = cls._period_length(start_date, end_date)
+            if period_length is not None:
+                cls._add(aggregates['period_length'], period_length)
+            if aggregates['last_start'] is None or start_date > aggregates['last_start']:
+                aggregates['last_start'] = start_date
+            return aggregates
+
+        aggregates = cls._apply(user_id, change)
+        return cls.rebuild(user_id) if any(bounds_changed) else aggregates
+
+    @classmethod
+    def _from_cycles(cls, cycles):
+        """Aggregates of cycles sorted by start date"""
+        aggregates = {
+            'cycle_length': cls._empty(),
+            'period_length': cls._empty(),
+            'last_start': None,
+            'version': 0,
+            'updated_at': datetime.utcnow()
+        }
+        for cycle in cycles:
+            start_date = cycle.get('start_date')
+            if not start_date:
+                continue
+            if aggregates['last_start']:
+                length = cls._cycle_length(aggregates['last_start'], start_date)
+                if length is not None:
+                    cls._add(aggregates['cycle_length'], length)
+            period_length = cls._period_length(start_date, cycle.get('end_date'))
+            if period_length is not None:
+                cls._add(aggregates['period_length'], period_length)
+            aggregates['last_start'] = start_date
+        return aggregates
+
+    @classmethod
+    def rebuild(cls, user_id=None, batch_size=500):
+        """Recompute aggregates from the stored cycles.
+
+        With a user_id returns that user's aggregates, otherwise rebuilds
+        every user with cycles and returns how many were written.
+        """
+        query = {'user_id': cls._user_key(user_id)} if user_id else {}
+        cursor = mongo.db['menstrual_cycles'].find(
+            query, {'user_id': 1, 'start_date': 1, 'end_date': 1}
+        ).sort([('user_id', 1), ('start_date', 1)])
+
+        operations = []
+        written = 0
+        last = None
+
+        def flush(owner, cycles):
+            aggregates = cls._from_cycles(cycles)
+            operations.append(UpdateOne({'_id': owner}, {'$set': {cls.FIELD: aggregates}}))
+            return aggregates
+
+        current_user, cycles = None, []
+        for cycle in cursor:
+            if cycle['user_id'] != current_user:
+                if current_user is not None:
+                    last = flush(current_user, cycles)
+                    written += 1
+                current_user, cycles = cycle['user_id'], []
+            cycles.append(cycle)
+            if len(operations) >= batch_size:
+                mongo.db.users.bulk_write(operations, ordered=False)
+                operations = []
+        if current_user is not None:
+            last = flush(current_user, cycles)
+            written += 1
+        elif user_id:
+            last = flush(cls._user_key(user_id), [])
+        if operations:
+            mongo.db.users.bulk_write(operations, ordered=False)
+        return last if user_id else written
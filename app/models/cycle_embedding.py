@@ -0,0 +1,114 @@
+import json
+import re
+from datetime import datetime
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from app.extensions import mongo
+from app.services import ml
+from app.models.embedding_cache import encode_embedding, decode_embedding
+
+
+class CycleEmbedding:
+    """MedBERT embedding of a cycle's notes, one document per cycle.
+
+    Kept out of ``menstrual_cycles`` so cycle reads never carry embeddings.
+    ``_id`` is the cycle id; the vector is a float16 ``bson.Binary``
+    (1.5 KB for 768 dimensions, instead of ~15 KB as text in the notes).
+    """
+    COLLECTION = 'cycle_embeddings'
+
+    # What older versions of log_cycle appended to the notes: "\nMedBERT: [[...]]"
+    NOTES_SUFFIX = re.compile(r'\s*MedBERT: (\[\[?[-+0-9eE.,\s]*\]?\])\s*$')
+
+    @staticmethod
+    def _object_id(value):
+        return ObjectId(value) if not isinstance(value, ObjectId) else value
+
+    @classmethod
+    def store(cls, cycle_id, user_id, embedding):
+        revision, precision = ml.embedding_labels()
+        mongo.db[cls.COLLECTION].update_one(
+            {'_id': cls._object_id(cycle_id)},
+            {'$set': {
+                'user_id': cls._object_id(user_id),
+                'embedding': encode_embedding(embedding),
+                'dims': len(embedding),
+                'model': ml.MEDBERT_MODEL,
+                'revision': revision,
+                'precision': precision,
+                'updated_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+
+    @classmethod
+    def get_many(cls, cycle_ids, user_id=None):
+        """Dict of cycle id -> embedding (list of floats) for the cycles that have one"""
+        query = {'_id': {'$in': [cls._object_id(c) for c in cycle_ids]}}
+        if user_id is not None:
+            query['user_id'] = cls._object_id(user_id)
+        docs = mongo.db[cls.COLLECTION].find(query, {'embedding': 1})
+        return {doc['_id']: decode_embedding(doc['embedding']) for doc in docs}
+
+    @classmethod
+    def get(cls, cycle_id, user_id=None):
+        return cls.get_many([cycle_id], user_id).get(cls._object_id(cycle_id))
+
+    @classmethod
+    def delete(cls, cycle_id, user_id=None):
+        """Forget a cycle's embedding, e.g. once its notes are cleared.
+
+        With the user_id, the cycle is also removed from the note indexes.
+        """
+        mongo.db[cls.COLLECTION].delete_one({'_id': cls._object_id(cycle_id)})
+        if user_id is not None:
+            from app.models.note_index import NoteIndex
+            NoteIndex.remove_cycle(cycle_id, user_id)
+
+    @classmethod
+    def split_notes(cls, notes):
+        """(notes without a stringified MedBERT suffix, the parsed embedding or None)"""
+        match = cls.NOTES_SUFFIX.search(notes or '')
+        if match is None:
+            return notes, None
+        try:
+            vector = np.array(json.loads(match.group(1)), dtype=np.float32).ravel()
+        except ValueError:
+            vector = None
+        return notes[:match.start()], (vector.tolist() if vector is not None and vector.size else None)
+
+    @classmethod
+    def strip_notes(cls, batch_size=500):
+        """Remove MedBERT suffixes from cycle notes, keeping the parsed embeddings.
+
+        Cycles left without notes lose their embedding instead.
+        Returns (cycles cleaned, embeddings kept).
+        """
+        cycles = mongo.db['menstrual_cycles'].find(
+            {'notes': {'$regex': 'MedBERT: \\['}}, {'user_id': 1, 'notes': 1}
+        )
+        operations = []
+        cleaned = kept = 0
+        for cycle in cycles:
+            notes, embedding = cls.split_notes(cycle['notes'])
+            if notes == cycle['notes']:
+                continue
+            operations.append(UpdateOne({'_id': cycle['_id']}, {'$set': {'notes': notes}}))
+            if not notes.strip():
+                cls.delete(cycle['_id'], cycle['user_id'])
+            elif embedding is not None:
+                cls.store(cycle['_id'], cycle['user_id'], embedding)
+                kept += 1
+            cleaned += 1
+            if len(operations) == batch_size:
+                mongo.db['menstrual_cycles'].bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            mongo.db['menstrual_cycles'].bulk_write(operations, ordered=False)
+        return cleaned, kept
+
+    @staticmethod
+    def create_indexes():
+        mongo.db[CycleEmbedding.COLLECTION].create_index([('user_id', 1)])
+
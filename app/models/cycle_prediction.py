@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
+from pymongo import UpdateOne, UpdateMany, DeleteMany
+from pymongo.errors import OperationFailure
 from app import mongo
 import joblib
 import numpy as np
@@ -59,6 +61,49 @@ class CyclePrediction:
         mongo.db.cycle_predictions.create_index([('user_id', 1), ('prediction_type', 1)])
         mongo.db.cycle_predictions.create_index([('user_id', 1), ('predicted_for_date', 1)])
         mongo.db.cycle_predictions.create_index([('user_id', 1), ('is_active', 1)])
+        mongo.db.cycle_predictions.create_index([('user_id', 1), ('features_used.fingerprint', 1)])
+        mongo.db.cycle_predictions.create_index([('user_id', 1), ('prediction_type', 1), ('created_at', 1)])
+        CyclePrediction.create_calendar_key_index()
+
+    @staticmethod
+    def create_calendar_key_index():
+        """Unique index on the upsert key of store_calendar_predictions.
+
+        Concurrent stores then cannot duplicate a phase. Returns False when
+        duplicates stored before the index existed prevent it; run
+        ``flask cycles dedupe-calendar-predictions`` once to remove them.
+        """
+        try:
+            mongo.db.cycle_predictions.create_index(
+                [('user_id', 1), ('phase', 1), ('predicted_for_date', 1)],
+                unique=True,
+                partialFilterExpression={'prediction_type': 'calendar'}
+            )
+        except OperationFailure as e:
+            print(f"Unique calendar prediction index not created: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def remove_duplicate_calendar_phases():
+        """Keep only the newest calendar prediction per (user, phase, predicted_for_date).
+
+        Returns the number of predictions deleted.
+        """
+        duplicates = mongo.db.cycle_predictions.aggregate([
+            {'$match': {'prediction_type': 'calendar'}},
+            {'$sort': {'prediction_date': -1, '_id': -1}},
+            {'$group': {
+                '_id': {'user_id': '$user_id', 'phase': '$phase', 'predicted_for_date': '$predicted_for_date'},
+                'ids': {'$push': '$_id'},
+                'count': {'$sum': 1}
+            }},
+            {'$match': {'count': {'$gt': 1}}}
+        ])
+        stale_ids = [stale_id for group in duplicates for stale_id in group['ids'][1:]]
+        if stale_ids:
+            mongo.db.cycle_predictions.delete_many({'_id': {'$in': stale_ids}})
+        return len(stale_ids)
 
     @staticmethod
     def get_user_predictions(user_id, prediction_type=None, start_date=None, end_date=None, limit=None):
@@ -114,33 +159,146 @@ class CyclePrediction:
         return mongo.db.cycle_predictions.delete_many(query)
 
     @staticmethod
-    def store_calendar_predictions(user_id, predictions, model_used='random_forest'):
-        """Store calendar predictions in bulk"""
-        prediction_date = datetime.utcnow()
-        
-        # Clear existing calendar predictions for the same period
-        CyclePrediction.clear_old_predictions(user_id, 'calendar', days_old=1)
-        
-        stored_predictions = []
-        for prediction in predictions:
+    def get_cached_calendar_predictions(user_id, fingerprint):
+        """Rebuild stored calendar predictions made from the same inputs.
+
+        Returns the list of per-cycle phase dicts in the shape produced by
+        MenstrualCycle.predict_future_cycles, or None if nothing stored
+        matches the fingerprint.
+        """
+        docs = mongo.db.cycle_predictions.find({
+            'user_id': ObjectId(user_id),
+            'prediction_type': 'calendar',
+            'is_active': True,
+            'features_used.fingerprint': fingerprint
+        }).sort([('prediction_date', -1), ('predicted_for_date', 1)])
+
+        cycles = {}
+        for doc in docs:
+            # Newest first, so a phase stored twice keeps its latest version
+            index = doc.get('features_used', {}).get('cycle_index', 0)
+            cycles.setdefault(index, {}).setdefault(
+                f"{doc['phase']}_phase", (doc['start_date'], doc['end_date'])
+            )
+
+        if not cycles:
+            return None
+        return [cycles[index] for index in sorted(cycles)]
+
+    @staticmethod
+    def _to_bson_datetime(value):
+        """Truncate to millisecond precision, as MongoDB stores datetimes"""
+        if isinstance(value, datetime):
+            return value.replace(microsecond=value.microsecond // 1000 * 1000)
+        return value
+
+    @staticmethod
+    def _calendar_documents(user_id, predictions, model_used, features_used, prediction_date):
+        """One prediction document per phase of every predicted cycle"""
+        documents = []
+        for cycle_index, prediction in enumerate(predictions):
             for phase_name, (start_date, end_date) in prediction.items():
-                phase = phase_name.replace('_phase', '')
-                
-                pred = CyclePrediction({
+                start_date = CyclePrediction._to_bson_datetime(start_date)
+                documents.append({
                     'user_id': user_id,
                     'prediction_type': 'calendar',
                     'prediction_date': prediction_date,
                     'predicted_for_date': start_date,
-                    'phase': phase,
+                    'phase': phase_name.replace('_phase', ''),
                     'start_date': start_date,
-                    'end_date': end_date,
+                    'end_date': CyclePrediction._to_bson_datetime(end_date),
                     'model_used': model_used,
+                    'features_used': dict(features_used or {}, cycle_index=cycle_index),
                     'confidence_score': 0.8 if model_used == 'random_forest' else 0.6
                 })
+        return documents
+
+    @staticmethod
+    def store_calendar_predictions(user_id, predictions, model_used='random_forest', features_used=None,
+                                   bulk=True):
+        """Store calendar predictions in bulk
+
+        ``features_used`` is stored on every phase together with its cycle
+        index, so get_cached_calendar_predictions can rebuild the list.
+
+        In bulk mode the new predictions are diffed against the user's active
+        calendar predictions, keyed on (phase, predicted_for_date), and
+        applied as one bulk_write: phases whose dates, model or confidence
+        changed (or that are new) are upserted, unchanged phases only get the
+        new ``features_used``, and phases that are no longer predicted are
+        deleted. With ``bulk=False`` the user's calendar predictions are
+        replaced and every phase is inserted individually.
+        """
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        prediction_date = CyclePrediction._to_bson_datetime(datetime.utcnow())
+        documents = CyclePrediction._calendar_documents(
+            user_id, predictions, model_used, features_used, prediction_date
+        )
+
+        if not bulk:
+            # Clear existing calendar predictions, they are replaced below
+            CyclePrediction.clear_old_predictions(user_id, 'calendar', days_old=0)
+
+            stored_predictions = []
+            for document in documents:
+                pred = CyclePrediction(document)
                 pred.save()
                 stored_predictions.append(pred)
-                
-        return stored_predictions
+            return stored_predictions
+
+        active = {}
+        stale_ids = []
+        for existing in mongo.db.cycle_predictions.find({
+            'user_id': user_id,
+            'prediction_type': 'calendar',
+            'is_active': True
+        }):
+            key = (existing.get('phase'), existing.get('predicted_for_date'))
+            if key in active:
+                stale_ids.append(existing['_id'])
+            else:
+                active[key] = existing
+
+        # features_used carries the input fingerprint, which differs on every
+        # new input; it is refreshed separately so unchanged phases are not rewritten
+        compared_fields = ('start_date', 'end_date', 'model_used', 'confidence_score')
+        operations = []
+        refreshed = {}
+        for document in documents:
+            existing = active.pop((document['phase'], document['predicted_for_date']), None)
+            if existing and all(existing.get(f) == document[f] for f in compared_fields):
+                features = document['features_used']
+                if existing.get('features_used') != features:
+                    refreshed.setdefault(features['cycle_index'], (features, []))[1].append(existing['_id'])
+                continue
+            operations.append(UpdateOne(
+                {
+                    'user_id': user_id,
+                    'prediction_type': 'calendar',
+                    'phase': document['phase'],
+                    'predicted_for_date': document['predicted_for_date']
+                },
+                {
+                    '$set': dict(document, is_active=True, updated_at=prediction_date),
+                    '$setOnInsert': {'created_at': prediction_date}
+                },
+                upsert=True
+            ))
+
+        for features, ids in refreshed.values():
+            operations.append(UpdateMany(
+                {'_id': {'$in': ids}},
+                {'$set': {'features_used': features, 'prediction_date': prediction_date}}
+            ))
+
+        stale_ids.extend(existing['_id'] for existing in active.values())
+        if stale_ids:
+            operations.append(DeleteMany({'_id': {'$in': stale_ids}}))
+
+        if operations:
+            mongo.db.cycle_predictions.bulk_write(operations, ordered=False)
+
+        return [CyclePrediction(document) for document in documents]
 
 class CycleAnalytics:
     """Model for storing cycle analytics and health insights"""
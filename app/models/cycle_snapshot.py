@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from functools import cached_property
+from bson.objectid import ObjectId
+from flask import g, has_request_context
+from app.models.menstrual_cycle import MenstrualCycle
+from app.models.cycle_aggregates import CycleAggregates
+
+
+class CycleSnapshot:
+    """Current cycle state of a user, derived from a single fetch of their cycles.
+
+    Every value is computed lazily on first access and then reused, so views
+    that need the phase, predictions and statistics together no longer go
+    back to the database for each of them.
+    """
+
+    def __init__(self, user_id, cycles=None, now=None):
+        self.user_id = user_id
+        # Newest first and without notes, like MenstrualCycle.get_user_cycles
+        self.cycles = cycles if cycles is not None else MenstrualCycle.get_user_cycles(user_id, limit=0)
+        self.now = now or datetime.utcnow()
+
+    @classmethod
+    def for_user(cls, user_id):
+        """Snapshot for a user, shared by everything within the same request.
+
+        MenstrualCycle.save drops it, so a view that saves and then reads
+        sees the new cycle.
+        """
+        if not has_request_context():
+            return cls(user_id)
+        key = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        snapshots = g.setdefault('cycle_snapshots', {})
+        if key not in snapshots:
+            snapshots[key] = cls(user_id)
+        return snapshots[key]
+
+    @property
+    def has_cycles(self):
+        return bool(self.cycles)
+
+    def recent_cycles(self, limit=12):
+        return self.cycles[:limit]
+
+    @cached_property
+    def current_cycle(self):
+        """Most recent cycle, finished or not"""
+        return self.cycles[0] if self.cycles else None
+
+    @cached_property
+    def last_completed_cycle(self):
+        return next((c for c in self.cycles if c.get('end_date') is not None), None)
+
+    @cached_property
+    def stats(self):
+        return MenstrualCycle.get_cycle_statistics(self.user_id)
+
+    @cached_property
+    def aggregates(self):
+        """Running cycle and period length aggregates (see CycleAggregates)"""
+        return CycleAggregates.get(self.user_id)
+
+    @cached_property
+    def _phase(self):
+        return MenstrualCycle._phase_from(
+            self.current_cycle,
+            lambda: self.stats,
+            lambda: self.last_completed_cycle,
+            today=self.now
+        )
+
+    @property
+    def current_phase(self):
+        return self._phase[0]
+
+    @property
+    def day_of_cycle(self):
+        return self._phase[1]
+
+    @cached_property
+    def current_cycle_day(self):
+        """Calendar day of the most recent cycle, counting its start as day 1"""
+        if self.current_cycle and self.current_cycle.get('start_date'):
+            return (self.now.date() - self.current_cycle['start_date'].date()).days + 1
+        return None
+
+    @cached_property
+    def next_period(self):
+        """Next period predicted from the average of recent cycle lengths"""
+        return MenstrualCycle._next_period_from(self.cycles)
+
+    @cached_property
+    def fertile_window(self):
+        """(fertile_start, ovulation_day), or (None, None) without enough data"""
+        return MenstrualCycle._fertile_window_from(self.next_period)
+
+    @cached_property
+    def rf_prediction(self):
+        """Next cycle length in days from the Random Forest model, if available"""
+        return MenstrualCycle.predict_next_cycle_rf(self.user_id, cycles=self.cycles)
+
+    @cached_property
+    def predicted_next_period(self):
+        """Next period preferring the Random Forest length over the average"""
+        if self.current_cycle and self.rf_prediction:
+            return self.current_cycle['start_date'] + timedelta(days=self.rf_prediction)
+        return self.next_period
@@ -0,0 +1,151 @@
+import copy
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from app.extensions import mongo
+
+
+class CycleStatsCache:
+    """Two-tier cache for MenstrualCycle.get_cycle_statistics results.
+
+    The shared tier is the ``cycle_stats`` collection (one document per user
+    and look-back window), the local tier is a small in-process LRU. Entries
+    are only valid for the UTC day they were computed on, since the look-back
+    window and the in-progress period length both move with the date.
+    Writes to cycles or symptoms call ``invalidate`` for the user.
+
+    ``invalidate`` also bumps the user's version, kept in the document with
+    ``months`` None. Stats are stored with the version read before they were
+    computed and are only served while it is still current, so stats computed
+    concurrently with a write are never served after it.
+    """
+    COLLECTION = 'cycle_stats'
+
+    # Local tier settings. The TTL bounds how long another worker process can
+    # serve stats that were invalidated by a write it did not see.
+    MAX_ENTRIES = 1024
+    LOCAL_TTL = timedelta(seconds=30)
+
+    _local = OrderedDict()
+    _lock = threading.Lock()
+    _counters = {'local_hits': 0, 'db_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    # Returned by get() on a miss; pass it back to set() with the computed stats
+    Miss = namedtuple('Miss', ['version', 'generation'])
+    _generation = 0
+
+    @staticmethod
+    def _user_key(user_id):
+        return ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+
+    @staticmethod
+    def _today():
+        now = datetime.utcnow()
+        return datetime(now.year, now.month, now.day)
+
+    @classmethod
+    def _count(cls, name):
+        with cls._lock:
+            cls._counters[name] += 1
+
+    @classmethod
+    def get(cls, user_id, months=12):
+        """Return cached stats, or a ``CycleStatsCache.Miss`` on a miss.
+
+        ``None`` is a valid cached value (user has no cycles in the window).
+        """
+        user_id = cls._user_key(user_id)
+        key = (user_id, months)
+        today = cls._today()
+        now = datetime.utcnow()
+
+        with cls._lock:
+            generation = cls._generation
+            entry = cls._local.get(key)
+            if entry is not None:
+                computed_on, cached_at, stats = entry
+                if computed_on == today and now - cached_at <= cls.LOCAL_TTL:
+                    cls._local.move_to_end(key)
+                    cls._counters['local_hits'] += 1
+                    return copy.deepcopy(stats)
+                del cls._local[key]
+
+        docs = {doc['months']: doc for doc in mongo.db[cls.COLLECTION].find(
+            {'user_id': user_id, 'months': {'$in': [months, None]}}
+        )}
+        version = docs.get(None, {}).get('version', 0)
+        doc = docs.get(months)
+        if doc is None or doc.get('computed_on') != today or doc.get('version', 0) != version:
+            cls._count('misses')
+            return cls.Miss(version, generation)
+
+        cls._count('db_hits')
+        cls._store_local(key, today, doc.get('stats'), generation)
+        return doc.get('stats')
+
+    @classmethod
+    def set(cls, user_id, months, stats, miss):
+        """Store stats computed after ``get`` returned ``miss`` in both tiers"""
+        user_id = cls._user_key(user_id)
+        today = cls._today()
+        mongo.db[cls.COLLECTION].update_one(
+            {'user_id': user_id, 'months': months},
+            {'$set': {
+                'stats': stats,
+                'computed_on': today,
+                'version': miss.version,
+                'updated_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+        cls._store_local((user_id, months), today, stats, miss.generation)
+
+    @classmethod
+    def _store_local(cls, key, computed_on, stats, generation):
+        with cls._lock:
+            # An invalidation in this process since the miss may have been for this user
+            if generation != cls._generation:
+                return
+            cls._local[key] = (computed_on, datetime.utcnow(), copy.deepcopy(stats))
+            cls._local.move_to_end(key)
+            while len(cls._local) > cls.MAX_ENTRIES:
+                cls._local.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, user_id):
+        """Drop every cached window for a user after their data changed"""
+        user_id = cls._user_key(user_id)
+        with cls._lock:
+            for key in [k for k in cls._local if k[0] == user_id]:
+                del cls._local[key]
+            cls._generation += 1
+            cls._counters['invalidations'] += 1
+        mongo.db[cls.COLLECTION].update_one(
+            {'user_id': user_id, 'months': None}, {'$inc': {'version': 1}}, upsert=True
+        )
+        mongo.db[cls.COLLECTION].delete_many({'user_id': user_id, 'months': {'$ne': None}})
+
+    @classmethod
+    def get_counters(cls):
+        """Hit/miss counters for this process, with the overall hit rate"""
+        with cls._lock:
+            counters = dict(cls._counters)
+            counters['local_entries'] = len(cls._local)
+        lookups = counters['local_hits'] + counters['db_hits'] + counters['misses']
+        hits = counters['local_hits'] + counters['db_hits']
+        counters['hit_rate'] = round(hits / lookups, 3) if lookups else 0.0
+        return counters
+
+    @classmethod
+    def reset_counters(cls):
+        with cls._lock:
+            for name in cls._counters:
+                cls._counters[name] = 0
+
+    @staticmethod
+    def create_indexes():
+        mongo.db[CycleStatsCache.COLLECTION].create_index(
+            [('user_id', 1), ('months', 1)], unique=True
+        )
+
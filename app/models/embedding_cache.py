@@ -0,0 +1,181 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from bson.binary import Binary
+from app.extensions import mongo
+from app.services import ml
+
+
+def encode_embedding(vector):
+    """Embedding as a little-endian float16 blob (2 bytes per dimension)"""
+    return Binary(np.asarray(vector, dtype='<f2').tobytes())
+
+
+def decode_embedding(value):
+    """List of floats from a float16 blob, or a list stored by older versions"""
+    if isinstance(value, (bytes, Binary)):
+        return np.frombuffer(value, dtype='<f2').astype(np.float32).tolist()
+    return value
+
+
+class EmbeddingCache:
+    """Two-tier cache of MedBERT note embeddings.
+
+    Entries are keyed by the SHA-256 of the normalised text and the model
+    revision (and precision, when quantized), so an embedding is computed
+    once per distinct note and model and never goes stale. The shared tier
+    is the ``medbert_embeddings`` collection (``_id`` is the key, the vector
+    a float16 blob), the local tier is an in-process LRU. Cycles compute
+    their embedding when saved; pages only read it back.
+    """
+    COLLECTION = 'medbert_embeddings'
+
+    MAX_ENTRIES = 2048
+
+    _local = OrderedDict()
+    _lock = threading.Lock()
+    _counters = {'local_hits': 0, 'db_hits': 0, 'misses': 0, 'computed': 0}
+
+    _WHITESPACE = re.compile(r'\s+')
+
+    @classmethod
+    def normalize(cls, text):
+        """Text as it is hashed: NFC, whitespace runs collapsed, trimmed.
+
+        Case is kept, MedBERT's tokenizer is cased.
+        """
+        return cls._WHITESPACE.sub(' ', unicodedata.normalize('NFC', text or '')).strip()
+
+    @classmethod
+    def key(cls, text, revision=None, precision=None):
+        """Cache key of text; revision and precision default to those of the model in use"""
+        if revision is None or precision is None:
+            default_revision, default_precision = ml.embedding_labels()
+            revision = revision or default_revision
+            precision = precision or default_precision
+        # Quantized embeddings differ slightly; fp32 keys keep their original form
+        model = f"{ml.MEDBERT_MODEL}@{revision}"
+        if precision != 'fp32':
+            model += f"/{precision}"
+        payload = f"{model}\x00{cls.normalize(text)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _count(cls, name, amount=1):
+        with cls._lock:
+            cls._counters[name] += amount
+
+    @classmethod
+    def _store_local(cls, key, embedding):
+        with cls._lock:
+            cls._local[key] = embedding
+            cls._local.move_to_end(key)
+            while len(cls._local) > cls.MAX_ENTRIES:
+                cls._local.popitem(last=False)
+
+    @classmethod
+    def lookup_many(cls, texts):
+        """Cached embeddings for texts, without running the model.
+
+        Returns a dict of text -> embedding (list of floats) for the texts
+        that are cached; the collection is queried once for the local misses.
+        """
+        revision, precision = ml.embedding_labels()
+        keys = {text: cls.key(text, revision, precision)
+                for text in texts if cls.normalize(text)}
+        found = {}
+        with cls._lock:
+            for text, key in keys.items():
+                embedding = cls._local.get(key)
+                if embedding is not None:
+                    cls._local.move_to_end(key)
+                    found[text] = embedding
+            cls._counters['local_hits'] += len(found)
+
+        missing = {}
+        for text, key in keys.items():
+            if text not in found:
+                missing.setdefault(key, []).append(text)
+        if missing:
+            docs = mongo.db[cls.COLLECTION].find(
+                {'_id': {'$in': list(missing)}}, {'embedding': 1}
+            )
+            for doc in docs:
+                embedding = decode_embedding(doc['embedding'])
+                for text in missing[doc['_id']]:
+                    found[text] = embedding
+                cls._store_local(doc['_id'], embedding)
+                cls._count('db_hits')
+            cls._count('misses', len(keys) - len(found))
+        return found
+
+    @classmethod
+    def lookup(cls, text):
+        """Cached embedding for text, or None"""
+        return cls.lookup_many([text]).get(text)
+
+    @classmethod
+    def _store(cls, key, embedding, revision, precision):
+        mongo.db[cls.COLLECTION].update_one(
+            {'_id': key},
+            {'$setOnInsert': {
+                'model': ml.MEDBERT_MODEL,
+                'revision': revision,
+                'precision': precision,
+                'embedding': encode_embedding(embedding),
+                'created_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+        cls._store_local(key, embedding)
+        cls._count('computed')
+
+    @classmethod
+    def get_or_compute(cls, text):
+        """Embedding for text, running MedBERT only on a cache miss.
+
+        Misses go through the micro-batcher (in-process or in the shared
+        worker), so concurrent saves share forward passes.
+        """
+        embedding = cls.lookup(text)
+        if embedding is not None:
+            return embedding
+
+        embedding = ml.embed(cls.normalize(text))
+        # Labels read after embedding, so they describe the model (or worker) that answered
+        revision, precision = ml.embedding_labels()
+        cls._store(cls.key(text, revision, precision), embedding, revision, precision)
+        return embedding
+
+    @classmethod
+    def get_or_compute_many(cls, texts):
+        """Embeddings for several texts (dict text -> embedding).
+
+        Misses are embedded in batches.
+        """
+        found = cls.lookup_many(texts)
+        missing = {}
+        for text in texts:
+            if text not in found and cls.normalize(text):
+                missing.setdefault(cls.normalize(text), []).append(text)
+        if missing:
+            normalized = list(missing)
+            embeddings = ml.embed_many(normalized)
+            revision, precision = ml.embedding_labels()
+            for text, embedding in zip(normalized, embeddings):
+                cls._store(cls.key(text, revision, precision), embedding, revision, precision)
+                for original in missing[text]:
+                    found[original] = embedding
+        return found
+
+    @classmethod
+    def get_counters(cls):
+        """Hit/miss counters for this process"""
+        with cls._lock:
+            counters = dict(cls._counters)
+            counters['local_entries'] = len(cls._local)
+        return counters
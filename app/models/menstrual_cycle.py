@@ -1,37 +1,50 @@
+import bisect
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
+from flask import current_app, g, has_app_context, has_request_context
 from app.extensions import mongo
 import joblib
 import numpy as np
 from app.models.cycle_prediction import CyclePrediction
 from app.models.cycle_prediction import CyclePrediction
+from app.models.cycle_stats import CycleStatsCache
+from app.models.cycle_aggregates import CycleAggregates
+from app.models.cycle_abnormalities import CycleAbnormalities
+from app.models.symptom_matrix import SymptomMatrix
+from app.models.symptom_rollup import SymptomRollup
+from app.models.symptom_bucket import SymptomBucket
+from pymongo.results import InsertOneResult
 from typing import List, Dict, Optional, Tuple
-from transformers import AutoTokenizer, AutoModel
-import torch
-from sklearn.ensemble import RandomForestRegressor
 import numpy as np
 import joblib
+# torch, transformers and scikit-learn load on first use (see app.services.ml)
+from app.services.ml import random_forest_regressor
+from app.models.embedding_cache import EmbeddingCache
+from app.models.cycle_embedding import CycleEmbedding
+from app.models.note_index import NoteIndex
 
-# MedBERT setup (singleton)
-_medbert_tokenizer = None
-_medbert_model = None
+def _count_query():
+    """Count a cycle-model round-trip against the current request (debug aid)"""
+    if has_request_context():
+        g.cycle_queries = g.get('cycle_queries', 0) + 1
 
-def get_medbert():
-    global _medbert_tokenizer, _medbert_model
-    if _medbert_tokenizer is None or _medbert_model is None:
-        _medbert_tokenizer = AutoTokenizer.from_pretrained("Charangan/MedBERT")
-        _medbert_model = AutoModel.from_pretrained("Charangan/MedBERT")
-    return _medbert_tokenizer, _medbert_model
-
-def medbert_infer(text):
-    tokenizer, model = get_medbert()
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=256)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    return outputs
+MS_PER_DAY = 24 * 60 * 60 * 1000
 
 class MenstrualCycle:
     COLLECTION = 'menstrual_cycles'
+    # 'python' computes statistics from fetched cycles, 'pipeline' in
+    # MongoDB, 'online' (opt-in) reads the running aggregates kept on the
+    # user (see CycleAggregates)
+    STATS_BACKEND = 'python'
+    # effective_end of cycles without an end date, so date-range overlap is
+    # start_date <= range end and effective_end >= range start
+    OPEN_END = datetime(9999, 12, 31)
     
     def __init__(self, user_id, start_date, end_date=None, flow_intensity='moderate', 
                  pain_level='none', mood='normal', symptoms=None, notes=''):
@@ -109,6 +122,7 @@ class MenstrualCycle:
                 'user_id': user_id,
                 'start_date': start_date,
                 'end_date': end_date,
+                'effective_end': end_date or self.OPEN_END,
                 'flow_intensity': self.flow_intensity,
                 'pain_level': self.pain_level,
                 'mood': self.mood,
@@ -128,6 +142,20 @@ class MenstrualCycle:
             # Update the instance with the new _id
             self.id = result.inserted_id
             
+            # Keep the running length statistics in step with the stored cycles
+            CycleAggregates.record_cycle(user_id, cycle_data)
+            # Lengths and averages of neighbouring cycles change with it
+            CycleAbnormalities.analyze_user(user_id)
+            
+            # Cached statistics no longer reflect this user's history
+            CycleStatsCache.invalidate(user_id)
+            self._forget_request_cycles(user_id)
+            # A new period start can move the cycle day of logged symptoms
+            SymptomMatrix.mark_stale(user_id)
+            # Embed the notes once here so pages only read the embedding back
+            if EmbeddingCache.normalize(self.notes):
+                self._embed_notes(self.id, user_id, self.notes)
+            
             # Return the result object for further checking if needed
             return result
             
@@ -140,17 +168,93 @@ class MenstrualCycle:
     @classmethod
     def create_indexes(cls):
         mongo.db[cls.COLLECTION].create_index([('user_id', 1)])
-        mongo.db[cls.COLLECTION].create_index([('user_id', 1), ('start_date', -1)])
+        mongo.db[cls.COLLECTION].create_index([('user_id', 1), ('start_date', -1), ('_id', -1)])
+        mongo.db[cls.COLLECTION].create_index([('user_id', 1), ('start_date', 1), ('effective_end', 1)])
+
+    # Cycle lists leave the free-text notes behind; read them per cycle where needed
+    LIST_PROJECTION = {'notes': 0}
+
+    @classmethod
+    def _request_cycles(cls, user_id):
+        """All cycles of a user, newest first, loaded once per request.
+
+        Returns None outside a request so callers fall back to their own query.
+        """
+        if not has_request_context():
+            return None
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        loaded = g.setdefault('user_cycles', {})
+        if user_id not in loaded:
+            _count_query()
+            loaded[user_id] = list(mongo.db[cls.COLLECTION].find(
+                {'user_id': user_id}, cls.LIST_PROJECTION
+            ).sort('start_date', -1))
+        return loaded[user_id]
+
+    @staticmethod
+    def _forget_request_cycles(user_id):
+        """Drop the request's loaded cycles and snapshot after the user's cycles were written"""
+        if has_request_context():
+            user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+            g.get('user_cycles', {}).pop(user_id, None)
+            g.get('cycle_snapshots', {}).pop(user_id, None)
 
     @classmethod
     def get_user_cycles(cls, user_id, limit=12):
+        cycles = cls._request_cycles(user_id)
+        if cycles is not None:
+            # Copies, so callers annotating documents don't leak into the request cache
+            return [dict(c) for c in (cycles[:limit] if limit else cycles)]
+        _count_query()
         return list(mongo.db[cls.COLLECTION].find(
-            {'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id}
+            {'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id},
+            cls.LIST_PROJECTION
         ).sort('start_date', -1).limit(limit))
         
+    # Fields the cycle history page shows (notes and analysis text stay behind)
+    HISTORY_FIELDS = ('start_date', 'end_date', 'pain_level', 'flow_intensity',
+                      'cycle_length', 'period_length', 'abnormality_flags')
+
+    @classmethod
+    def get_history_page(cls, user_id, before=None, limit=20):
+        """One page of cycles, newest first, starting after the ``before`` cursor.
+
+        Keyset pagination on (user_id, start_date, _id), so every page costs
+        the same however long the history is; the _id breaks ties between
+        cycles starting on the same day. ``before`` is the (start_date, _id)
+        of the last row of the previous page, or a bare start date. One extra
+        (older) cycle is read to fill in the cycle length of the last row when
+        it is not stored. Returns (cycles, cursor) where cursor is the
+        ``before`` value of the next page, or None on the last page.
+        """
+        query = {'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id}
+        if isinstance(before, tuple):
+            before_date, before_id = before
+            query['$or'] = [
+                {'start_date': {'$lt': before_date}},
+                {'start_date': before_date, '_id': {'$lt': before_id}}
+            ]
+        elif before is not None:
+            query['start_date'] = {'$lt': before}
+        _count_query()
+        cycles = list(mongo.db[cls.COLLECTION].find(
+            query, {field: 1 for field in cls.HISTORY_FIELDS}
+        ).sort([('start_date', -1), ('_id', -1)]).limit(limit + 1))
+
+        older = cycles[limit] if len(cycles) > limit else None
+        cycles = cycles[:limit]
+        for cycle, previous in zip(cycles, cycles[1:] + [older]):
+            if cycle.get('cycle_length') is None and previous is not None:
+                cycle['cycle_length'] = (cycle['start_date'] - previous['start_date']).days
+        return cycles, ((cycles[-1]['start_date'], cycles[-1]['_id']) if older is not None else None)
+
     @classmethod
     def get_last_completed_cycle(cls, user_id):
         """Get the most recent completed cycle for a user"""
+        cycles = cls._request_cycles(user_id)
+        if cycles is not None:
+            return next((dict(c) for c in cycles if c.get('end_date') is not None), None)
+        _count_query()
         return mongo.db[cls.COLLECTION].find_one({
             'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id,
             'end_date': {'$ne': None}  # Only completed cycles have an end_date
@@ -166,37 +270,218 @@ class MenstrualCycle:
         
     @classmethod
     def get_cycles_in_date_range(cls, user_id, start_date, end_date):
-        """Get all cycles that overlap with the given date range"""
-        return mongo.db[cls.COLLECTION].find({
+        """Get all cycles that overlap with the given date range, oldest first.
+
+        Always an interval-index query (see _date_range_query), also within a
+        request: a calendar range holds a few cycles, not the whole history.
+        """
+        _count_query()
+        return mongo.db[cls.COLLECTION].find(
+            cls._date_range_query(user_id, start_date, end_date), cls.LIST_PROJECTION
+        ).sort('start_date', 1)
+
+    @classmethod
+    def _date_range_query(cls, user_id, start_date, end_date):
+        """Overlap with [start_date, end_date] as two ranges on the interval index"""
+        return {
             'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id,
-            '$or': [
-                # Cycle starts within the date range
-                {'start_date': {'$gte': start_date, '$lte': end_date}},
-                # Cycle ends within the date range
-                {'end_date': {'$gte': start_date, '$lte': end_date}},
-                # Cycle spans the entire date range
-                {
-                    'start_date': {'$lte': start_date},
-                    '$or': [
-                        {'end_date': None},  # Ongoing cycle
-                        {'end_date': {'$gte': end_date}}  # Cycle that spans the range
-                    ]
-                }
-            ]
-        }).sort('start_date', 1)
+            'start_date': {'$lte': end_date},
+            'effective_end': {'$gte': start_date}
+        }
+
+    @classmethod
+    def backfill_effective_end(cls):
+        """Set effective_end on cycles stored before it existed; returns the count updated"""
+        missing = {'effective_end': {'$exists': False}}
+        open_cycles = mongo.db[cls.COLLECTION].update_many(
+            {**missing, 'end_date': None}, {'$set': {'effective_end': cls.OPEN_END}}
+        )
+        closed_cycles = mongo.db[cls.COLLECTION].update_many(
+            missing, [{'$set': {'effective_end': '$end_date'}}]
+        )
+        return open_cycles.modified_count + closed_cycles.modified_count
         
     # Analytics Methods
     @classmethod
     def get_cycle_statistics(cls, user_id, months=12):
-        """Get statistics about the user's menstrual cycles"""
+        """Get statistics about the user's menstrual cycles (cached per user)"""
+        stats = CycleStatsCache.get(user_id, months)
+        if isinstance(stats, CycleStatsCache.Miss):
+            miss = stats
+            stats = cls._compute_cycle_statistics(user_id, months)
+            CycleStatsCache.set(user_id, months, stats, miss)
+        return stats
+
+    @classmethod
+    def _stats_backend(cls):
+        if has_app_context():
+            return current_app.config.get('CYCLE_STATS_BACKEND', cls.STATS_BACKEND)
+        return cls.STATS_BACKEND
+
+    @classmethod
+    def _compute_cycle_statistics(cls, user_id, months=12, backend=None):
+        """Compute cycle statistics with the configured (or given) backend"""
+        backend = backend or cls._stats_backend()
+        if backend == 'online':
+            return cls._compute_cycle_statistics_online(user_id, months)
+        if backend == 'pipeline':
+            return cls._compute_cycle_statistics_pipeline(user_id, months)
+        return cls._compute_cycle_statistics_python(user_id, months)
+
+    @classmethod
+    def _compute_cycle_statistics_online(cls, user_id, months=12):
+        """Statistics from the running aggregates on the user document.
+
+        Length statistics cover the whole history (not just ``months``) and
+        regularity uses the standard deviation instead of the mean absolute
+        deviation. Only the chart history and symptom frequency are queried.
+        Users without stored aggregates get them built on this first read.
+        """
+        _count_query()
+        aggregates = CycleAggregates.get(user_id)
+        if aggregates.get('last_start') is None:
+            return None
+
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=30 * months)
+        cycle_lengths = aggregates['cycle_length']
+        period_lengths = aggregates['period_length']
+        total_cycles = cycle_lengths['count']
+        avg_cycle = round(cycle_lengths['mean'], 1) if total_cycles else 28
+        avg_period = round(period_lengths['mean'], 1) if period_lengths['count'] else 5
+
+        return {
+            'total_cycles': total_cycles,
+            'avg_cycle_length': avg_cycle,
+            'min_cycle_length': cycle_lengths['min'] if total_cycles else avg_cycle,
+            'max_cycle_length': cycle_lengths['max'] if total_cycles else avg_cycle,
+            'avg_period_length': avg_period,
+            'cycle_regularity': cls._regularity_from_aggregates(aggregates),
+            'cycle_history': list(reversed(cls.get_user_cycles(user_id, limit=6))),
+            'symptom_frequency': cls._get_symptom_frequency(user_id, start_date, end_date)
+        }
+
+    @classmethod
+    def _compute_cycle_statistics_pipeline(cls, user_id, months=12):
+        """Compute cycle statistics with a single aggregation (MongoDB 5.0+).
+
+        Mirrors _compute_cycle_statistics_python: only completed cycles
+        contribute lengths, each one measured against the previous completed
+        start date. Cycle documents never leave the server apart from the
+        newest cycle and the six-cycle chart history (without notes).
+        """
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=30 * months)
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+
+        def whole_days(later, earlier):
+            # Same truncation as timedelta.days for the millisecond difference
+            return {'$floor': {'$divide': [{'$subtract': [later, earlier]}, MS_PER_DAY]}}
+
+        def within(field, low, high):
+            return {'$cond': [
+                {'$and': [{'$gte': [field, low]}, {'$lte': [field, high]}]}, field, None
+            ]}
+
+        pipeline = [
+            {'$match': {'user_id': user_id, 'start_date': {'$gte': start_date}}},
+            {'$facet': {
+                'lengths': [
+                    {'$match': {'end_date': {'$ne': None}}},
+                    {'$project': {'start_date': 1, 'end_date': 1}},
+                    {'$setWindowFields': {
+                        'sortBy': {'start_date': 1},
+                        'output': {'prev_start': {'$shift': {'output': '$start_date', 'by': -1}}}
+                    }},
+                    {'$match': {'prev_start': {'$ne': None}}},
+                    {'$project': {
+                        'cycle_length': whole_days('$start_date', '$prev_start'),
+                        'period_length': {'$add': [whole_days('$end_date', '$start_date'), 1]}
+                    }},
+                    {'$project': {
+                        'cycle_length': within('$cycle_length', 15, 60),
+                        'period_length': within('$period_length', 1, 14)
+                    }},
+                    {'$group': {
+                        '_id': None,
+                        'cycle_lengths': {'$push': '$cycle_length'},
+                        'avg_cycle_length': {'$avg': '$cycle_length'},
+                        'min_cycle_length': {'$min': '$cycle_length'},
+                        'max_cycle_length': {'$max': '$cycle_length'},
+                        'period_total': {'$sum': '$period_length'},
+                        'period_count': {'$sum': {'$cond': [{'$eq': ['$period_length', None]}, 0, 1]}}
+                    }},
+                    {'$set': {'cycle_lengths': {'$filter': {
+                        'input': '$cycle_lengths', 'cond': {'$ne': ['$$this', None]}
+                    }}}},
+                    {'$set': {
+                        'total_cycles': {'$size': '$cycle_lengths'},
+                        # Mean absolute deviation, as used by _calculate_regularity
+                        'cycle_length_mad': {'$avg': {'$map': {
+                            'input': '$cycle_lengths',
+                            'in': {'$abs': {'$subtract': ['$$this', '$avg_cycle_length']}}
+                        }}}
+                    }},
+                    {'$project': {'_id': 0, 'cycle_lengths': 0}}
+                ],
+                'count': [{'$count': 'n'}],
+                'history': [
+                    {'$sort': {'start_date': -1}},
+                    {'$limit': 6},
+                    {'$project': {'notes': 0}}
+                ]
+            }}
+        ]
+        _count_query()
+        result = next(mongo.db[cls.COLLECTION].aggregate(pipeline), None)
+        if not result or not result['count']:
+            return None
+
+        lengths = result['lengths'][0] if result['lengths'] else {}
+        total_cycles = lengths.get('total_cycles', 0)
+        period_total = lengths.get('period_total', 0)
+        period_count = lengths.get('period_count', 0)
+
+        # The in-progress cycle counts its days so far as a period length
+        history = list(reversed(result['history']))
+        current_cycle = history[-1]
+        if not current_cycle.get('end_date') and result['count'][0]['n'] > 1:
+            days_since_start = (datetime.utcnow() - current_cycle['start_date']).days
+            if days_since_start > 0:
+                period_total += days_since_start
+                period_count += 1
+
+        avg_cycle = round(lengths['avg_cycle_length'], 1) if total_cycles else 28
+        avg_period = round(period_total / period_count, 1) if period_count else 5
+
+        return {
+            'total_cycles': total_cycles,
+            'avg_cycle_length': avg_cycle,
+            'min_cycle_length': lengths['min_cycle_length'] if total_cycles else avg_cycle,
+            'max_cycle_length': lengths['max_cycle_length'] if total_cycles else avg_cycle,
+            'avg_period_length': avg_period,
+            'cycle_regularity': (cls._regularity_from_deviation(lengths['cycle_length_mad'])
+                                 if total_cycles >= 3 else 0),
+            'cycle_history': history,
+            'symptom_frequency': cls._get_symptom_frequency(user_id, start_date, end_date)
+        }
+
+    @classmethod
+    def _compute_cycle_statistics_python(cls, user_id, months=12):
+        """Compute cycle statistics from the stored cycles and symptoms"""
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=30 * months)  # Approximate months to days
         
         # Get all cycles in the date range, including incomplete ones
-        cycles = list(mongo.db[cls.COLLECTION].find({
-            'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id,
-            'start_date': {'$gte': start_date}
-        }).sort('start_date', 1))
+        loaded = cls._request_cycles(user_id)
+        if loaded is not None:
+            cycles = [c for c in reversed(loaded) if c['start_date'] >= start_date]
+        else:
+            _count_query()
+            cycles = list(mongo.db[cls.COLLECTION].find({
+                'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id,
+                'start_date': {'$gte': start_date}
+            }).sort('start_date', 1))
         
         if not cycles:
             return None
@@ -304,6 +589,19 @@ class MenstrualCycle:
         differences = [abs(length - avg_length) for length in cycle_lengths]
         avg_difference = sum(differences) / len(differences)
         
+        return cls._regularity_from_deviation(avg_difference)
+    
+    @classmethod
+    def _regularity_from_aggregates(cls, aggregates):
+        """Regularity (0-100%) from running aggregates, in O(1)"""
+        cycle_lengths = (aggregates or {}).get('cycle_length')
+        if not cycle_lengths or cycle_lengths['count'] < 3:
+            return 0
+        return cls._regularity_from_deviation(CycleAggregates.std(cycle_lengths))
+    
+    @staticmethod
+    def _regularity_from_deviation(avg_difference):
+        """Map the mean absolute deviation of cycle lengths to 0-100%"""
         # Calculate regularity as a percentage (lower difference = higher regularity)
         # Assuming a max difference of 14 days is the least regular (0%)
         max_expected_difference = 14
@@ -314,29 +612,21 @@ class MenstrualCycle:
     @classmethod
     def _get_symptom_frequency(cls, user_id, start_date, end_date):
         """Get frequency of symptoms in the given date range"""
-        pipeline = [
-            {
-                '$match': {
-                    'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id,
-                    'date': {'$gte': start_date, '$lte': end_date}
-                }
-            },
-            {'$unwind': '$symptoms'},
-            {
-                '$group': {
-                    '_id': '$symptoms',
-                    'count': {'$sum': 1},
-                    'last_occurrence': {'$max': '$date'}
-                }
-            },
-            {'$sort': {'count': -1}},
-            {'$limit': 5}  # Top 5 most frequent symptoms
-        ]
+        _count_query()
+        counts = SymptomRollup.get_counts(user_id, start_date, end_date)
         
-        return list(mongo.db['cycle_symptoms'].aggregate(pipeline))
+        # Top 5 most frequent symptoms
+        return [
+            {'_id': name, 'count': count, 'last_occurrence': counts['last_occurrence'].get(name)}
+            for name, count in counts['symptoms'].most_common(5)
+        ]
     
     @classmethod
     def get_current_cycle(cls, user_id):
+        cycles = cls._request_cycles(user_id)
+        if cycles is not None:
+            return dict(cycles[0]) if cycles else None
+        _count_query()
         return mongo.db[cls.COLLECTION].find_one(
             {'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id},
             sort=[('start_date', -1)]
@@ -345,7 +635,12 @@ class MenstrualCycle:
     @classmethod
     def predict_next_period(cls, user_id):
         """Predict next period based on average cycle length"""
-        cycles = cls.get_user_cycles(user_id, limit=6)
+        return cls._next_period_from(cls.get_user_cycles(user_id, limit=6))
+
+    @staticmethod
+    def _next_period_from(cycles):
+        """Predict the next period from a newest-first list of cycles"""
+        cycles = cycles[:6]
         if len(cycles) < 2:
             return None
             
@@ -374,7 +669,11 @@ class MenstrualCycle:
         Returns:
             tuple: (fertile_start_date, ovulation_date) or (None, None) if not enough data
         """
-        next_period = cls.predict_next_period(user_id)
+        return cls._fertile_window_from(cls.predict_next_period(user_id))
+
+    @staticmethod
+    def _fertile_window_from(next_period):
+        """Fertile window (fertile_start, ovulation_day) for a predicted next period"""
         if not next_period:
             return None, None
             
@@ -395,8 +694,20 @@ class MenstrualCycle:
     @staticmethod
     def get_current_phase(user_id):
         """Determine the current phase of the user's cycle."""
-        today = datetime.utcnow()
-        current_cycle = MenstrualCycle.get_current_cycle(user_id)
+        return MenstrualCycle._phase_from(
+            MenstrualCycle.get_current_cycle(user_id),
+            lambda: MenstrualCycle.get_cycle_statistics(user_id),
+            lambda: MenstrualCycle.get_last_completed_cycle(user_id)
+        )
+
+    @staticmethod
+    def _phase_from(current_cycle, get_stats, get_last_completed, today=None):
+        """Determine (phase, day_of_cycle) from already loaded cycle data.
+
+        Statistics and the last completed cycle are passed as callables since
+        they are only needed when the user is not currently menstruating.
+        """
+        today = today or datetime.utcnow()
 
         # 1. Check if currently in period (Menstrual Phase)
         if current_cycle and current_cycle.get('start_date') and not current_cycle.get('end_date'):
@@ -404,11 +715,11 @@ class MenstrualCycle:
             return 'Menstrual', day_of_cycle
 
         # 2. Use predictions for other phases
-        stats = MenstrualCycle.get_cycle_statistics(user_id)
+        stats = get_stats()
         if not stats or not stats.get('avg_cycle_length') or not stats.get('avg_period_length'):
             return 'Unknown', None # Not enough data
 
-        last_cycle = MenstrualCycle.get_last_completed_cycle(user_id)
+        last_cycle = get_last_completed()
         if not last_cycle or not last_cycle.get('start_date'):
             return 'Unknown', None
 
@@ -457,14 +768,71 @@ class MenstrualCycle:
     @classmethod
     def analyze_notes_with_medbert(cls, notes):
         """Run MedBERT on notes and return embeddings (NER can be added later)"""
-        outputs = medbert_infer(notes)
-        # For now, just return pooled output
-        return outputs.last_hidden_state.mean(dim=1).cpu().numpy().tolist()
+        # For now, just return pooled output; cached per note text and model revision
+        return [EmbeddingCache.get_or_compute(notes)]
+
+    @classmethod
+    def _embed_notes(cls, cycle_id, user_id, notes):
+        """Embed a saved cycle's notes, off the request unless MEDBERT_EMBED_ON_SAVE is 'inline'"""
+        if has_app_context() and current_app.config.get('MEDBERT_EMBED_ON_SAVE', 'background') == 'background':
+            app = current_app._get_current_object()
+            cls._embedding_executor().submit(cls._embed_notes_now, app, cycle_id, user_id, notes)
+        else:
+            cls._embed_notes_now(current_app._get_current_object() if has_app_context() else None,
+                                 cycle_id, user_id, notes)
+
+    _executor = None
+    _executor_lock = threading.Lock()
 
     @classmethod
-    def train_random_forest(cls, user_id):
+    def _embedding_executor(cls):
+        """One background thread per process, so saves never wait for MedBERT"""
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notes-embedding')
+            return cls._executor
+
+    @staticmethod
+    def _embed_notes_now(app, cycle_id, user_id, notes):
+        """Store the embedding of a cycle's notes; a model failure must not fail the save"""
+        with app.app_context() if app is not None else nullcontext():
+            try:
+                if not EmbeddingCache.normalize(notes):
+                    # Cleared notes: nothing to embed, and the old vector must not match searches
+                    CycleEmbedding.delete(cycle_id, user_id)
+                    return
+                embedding = EmbeddingCache.get_or_compute(notes)
+                CycleEmbedding.store(cycle_id, user_id, embedding)
+                NoteIndex.add_cycle(cycle_id, user_id, embedding)
+            except Exception:
+                logger = app.logger if app is not None else logging.getLogger(__name__)
+                logger.exception(f"Error embedding notes of cycle {cycle_id}")
+
+    @classmethod
+    def similar_cycles(cls, user_id, cycle_id, k=3):
+        """The user's past cycles whose notes are most similar to this cycle's.
+
+        Returns cycle documents (start date and notes) with a ``similarity``
+        score, most similar first; empty if the cycle's notes have no embedding.
+        """
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        embedding = CycleEmbedding.get(cycle_id, user_id)
+        if embedding is None:
+            return []
+        index = NoteIndex.for_user(user_id)
+        if not index.exists():
+            index.rebuild({'user_id': user_id})
+        matches = index.search(embedding, k, exclude=[cycle_id])
+        cycles = {c['_id']: c for c in mongo.db[cls.COLLECTION].find(
+            {'_id': {'$in': [match for match, _ in matches]}, 'user_id': user_id},
+            {'start_date': 1, 'end_date': 1, 'notes': 1}
+        )}
+        return [dict(cycles[match], similarity=round(score, 4)) for match, score in matches if match in cycles]
+
+    @classmethod
+    def train_random_forest(cls, user_id, cycles=None):
         """Train a Random Forest model for cycle prediction for a user."""
-        cycles = cls.get_user_cycles(user_id, limit=24)
+        cycles = cycles[:24] if cycles is not None else cls.get_user_cycles(user_id, limit=24)
         if len(cycles) < 6:
             return None
         # Example: Use previous cycle lengths to predict next
@@ -476,15 +844,40 @@ class MenstrualCycle:
             y.append(prev2)
         if not X or not y:
             return None
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
+        model = random_forest_regressor(n_estimators=100, random_state=42)
         model.fit(X, y)
         joblib.dump(model, f"rf_model_{user_id}.joblib")
         return model
 
+    @classmethod
+    def _prediction_fingerprint(cls, user_id, model_path, num_cycles):
+        """Identify the inputs of predict_future_cycles.
+
+        Covers the user's cycles, the model file version and the day (the
+        statistics window moves daily), so stored predictions are reused
+        until one of them changes.
+        """
+        model_version = os.stat(model_path).st_mtime_ns if os.path.exists(model_path) else None
+        digest = hashlib.sha1(repr((model_version, num_cycles, datetime.utcnow().date())).encode())
+        for cycle in cls.get_user_cycles(user_id, limit=0):
+            digest.update(repr((cycle.get('_id'), cycle.get('start_date'), cycle.get('end_date'))).encode())
+        return digest.hexdigest()
+
     @classmethod
     def predict_future_cycles(cls, user_id, num_cycles=3):
-        """Predict future cycles with all four phases using Random Forest."""
+        """Predict future cycles with all four phases using Random Forest.
+
+        Stored calendar predictions are returned as long as they were made
+        from the same cycles and model; otherwise new ones are computed and
+        stored.
+        """
         model_path = f'./models/rf_cycle_model_{user_id}.joblib'
+        fingerprint = cls._prediction_fingerprint(user_id, model_path, num_cycles)
+        cached = CyclePrediction.get_cached_calendar_predictions(user_id, fingerprint)
+        if cached is not None:
+            return cached
+
+        features_used = {'fingerprint': fingerprint}
         try:
             model = joblib.load(model_path)
         except FileNotFoundError:
@@ -510,7 +903,8 @@ class MenstrualCycle:
                     'ovulatory_phase': (ovulation_date, ovulation_date + timedelta(days=1)),
                     'luteal_phase': (ovulation_date + timedelta(days=2), start_date + timedelta(days=stats['avg_cycle_length'] - 1))
                 })
-            CyclePrediction.store_calendar_predictions(user_id, predictions, model_used='average_based')
+            CyclePrediction.store_calendar_predictions(user_id, predictions, model_used='average_based',
+                                                       features_used=features_used)
             return predictions
 
         # Use RF model for prediction
@@ -546,19 +940,23 @@ class MenstrualCycle:
             last_start_date = start_date
             cycles.insert(0, {'start_date': start_date, 'end_date': end_date})
 
-        CyclePrediction.store_calendar_predictions(user_id, predictions, model_used='random_forest')
+        CyclePrediction.store_calendar_predictions(user_id, predictions, model_used='random_forest',
+                                                   features_used=features_used)
         return predictions
 
     @classmethod
-    def predict_next_cycle_rf(cls, user_id):
-        """Predict next cycle length using Random Forest."""
+    def predict_next_cycle_rf(cls, user_id, cycles=None):
+        """Predict next cycle length using Random Forest.
+
+        ``cycles`` may be a preloaded newest-first list of the user's cycles.
+        """
         try:
             model = joblib.load(f'./models/rf_cycle_model_{user_id}.joblib')
         except Exception:
-            model = cls.train_random_forest(user_id)
+            model = cls.train_random_forest(user_id, cycles)
             if model is None:
                 return None
-        cycles = cls.get_user_cycles(user_id, limit=3)
+        cycles = cycles[:3] if cycles is not None else cls.get_user_cycles(user_id, limit=3)
         if len(cycles) < 2:
             return None
         prev1 = (cycles[0]['start_date'] - cycles[1]['start_date']).days
@@ -572,6 +970,9 @@ class CycleSymptom:
         'acne', 'breast_tenderness', 'back_pain', 'food_cravings',
         'insomnia', 'nausea', 'dizziness', 'constipation', 'diarrhea'
     ]
+    # 'documents' keeps one cycle_symptoms document per log, 'buckets' one
+    # symptom_buckets document per user and month (see SymptomBucket)
+    STORAGE = 'documents'
     
     def __init__(self, data=None):
         if data:
@@ -639,7 +1040,7 @@ class CycleSymptom:
             }
             
             # Insert the document
-            result = mongo.db['cycle_symptoms'].insert_one(symptom_data)
+            result = self._insert_log(symptom_data)
             
             # Verify the insert was successful
             if not result.acknowledged:
@@ -648,6 +1049,11 @@ class CycleSymptom:
             # Update the instance with the new _id
             self.id = result.inserted_id
             
+            # Symptom frequency is part of the cached statistics
+            CycleStatsCache.invalidate(user_id)
+            SymptomMatrix.record_log(user_id, symptom_data)
+            SymptomRollup.record_log(user_id, symptom_data)
+            
             return result
             
         except Exception as e:
@@ -662,16 +1068,48 @@ class CycleSymptom:
         mongo.db['cycle_symptoms'].create_index([('cycle_id', 1)])
         mongo.db['cycle_symptoms'].create_index([('user_id', 1), ('date', -1)])
 
+    @classmethod
+    def _storage(cls):
+        if has_app_context():
+            return current_app.config.get('SYMPTOM_STORAGE', cls.STORAGE)
+        return cls.STORAGE
+
+    @classmethod
+    def _insert_log(cls, symptom_data):
+        """Store one log with the configured storage"""
+        if cls._storage() == 'buckets':
+            log = SymptomBucket.append(symptom_data)
+            symptom_data['_id'] = log['_id']
+            return InsertOneResult(log['_id'], acknowledged=True)
+        return mongo.db['cycle_symptoms'].insert_one(symptom_data)
+
+    @classmethod
+    def _find_logs(cls, user_id, start_date=None, end_date=None, fields=None):
+        """Logs of a user within a date range, oldest first, from either storage"""
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        if cls._storage() == 'buckets':
+            return SymptomBucket.find_logs(user_id, start_date, end_date, fields)
+
+        query = {'user_id': user_id}
+        date_range = {}
+        if start_date is not None:
+            date_range['$gte'] = start_date
+        if end_date is not None:
+            date_range['$lte'] = end_date
+        if date_range:
+            query['date'] = date_range
+        projection = {'_id': 0, 'date': 1, **{field: 1 for field in fields}} if fields else None
+        return mongo.db['cycle_symptoms'].find(query, projection).sort('date', 1)
+
     @staticmethod
     def get_symptoms_in_date_range(user_id, start_date, end_date):
         """Get all symptoms logged within a date range"""
-        return mongo.db['cycle_symptoms'].find({
-            'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id,
-            'date': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }).sort('date', 1)
+        return CycleSymptom._find_logs(user_id, start_date, end_date)
+    
+    @staticmethod
+    def get_symptom_days_in_date_range(user_id, start_date, end_date):
+        """Dates and symptom names only, for per-day counts"""
+        return CycleSymptom._find_logs(user_id, start_date, end_date, fields=('symptoms', 'symptom'))
     
     @staticmethod
     def track_symptom(user_id, symptom_name, severity='mild', notes=''):
@@ -686,11 +1124,17 @@ class CycleSymptom:
             'notes': notes,
             'date': datetime.utcnow()
         }
-        return mongo.db['cycle_symptoms'].insert_one(symptom_data)
+        result = CycleSymptom._insert_log(symptom_data)
+        CycleStatsCache.invalidate(symptom_data['user_id'])
+        SymptomMatrix.record_log(symptom_data['user_id'], symptom_data)
+        SymptomRollup.record_log(symptom_data['user_id'], symptom_data)
+        return result
     
     @staticmethod
     def get_symptom_history(user_id, symptom_name=None, limit=30):
         """Get symptom history for a user"""
+        if CycleSymptom._storage() == 'buckets':
+            return SymptomBucket.history(user_id, symptom_name, limit)
         query = {'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id}
         if symptom_name:
             query['symptom'] = symptom_name
@@ -699,14 +1143,32 @@ class CycleSymptom:
                    .sort('date', -1)
                    .limit(limit))
     
+    # Days before a period start that count as the premenstrual window
+    PMS_WINDOW = (1, 7)
+
+    @staticmethod
+    def _symptom_names(doc):
+        """Symptom names of a log, whether saved as a list or by track_symptom"""
+        symptoms = doc.get('symptoms')
+        if isinstance(symptoms, list):
+            return symptoms
+        return [doc['symptom']] if doc.get('symptom') else []
+
     @staticmethod
     def get_symptom_patterns(user_id, days=90):
-        """Analyze symptom patterns for PMS and hormonal insights"""
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        symptoms = mongo.db.cycle_symptoms.find({
-            'user_id': ObjectId(user_id),
-            'date': {'$gte': cutoff_date}
-        }).sort('date', 1)
+        """Analyze symptom patterns for PMS and hormonal insights
+
+        Every log is aligned to the next period start with a binary search
+        over the sorted cycle start dates, so cycles are fetched once.
+        """
+        user_id = ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+        now = datetime.utcnow()
+        cutoff_date = now - timedelta(days=days)
+        symptoms = CycleSymptom._find_logs(user_id, cutoff_date,
+                                           fields=('symptoms', 'symptom', 'mood', 'pain_level'))
+
+        cycles = MenstrualCycle.get_cycles_in_date_range(user_id, cutoff_date, now)
+        period_starts = sorted(c['start_date'] for c in cycles if c.get('start_date'))
         
         patterns = {
             'pms_indicators': [],
@@ -715,35 +1177,66 @@ class CycleSymptom:
             'symptom_correlation': {}
         }
         
+        pms_low, pms_high = CycleSymptom.PMS_WINDOW
+        weekly_moods = {}
+        symptom_totals = {}
+        symptom_pms = {}
+        
         for symptom in symptoms:
+            date = symptom.get('date')
+            if not date:
+                continue
+            names = CycleSymptom._symptom_names(symptom)
+            mood = symptom.get('mood')
+            
+            # Days until the first period starting after this log
+            next_index = bisect.bisect_right(period_starts, date)
+            days_before = (period_starts[next_index] - date).days if next_index < len(period_starts) else None
+            in_pms_window = days_before is not None and pms_low <= days_before <= pms_high
+            
             # Analyze PMS patterns (symptoms 1-7 days before period)
-            cycles = MenstrualCycle.get_user_cycles(user_id)
-            for cycle in cycles:
-                if cycle.start_date:
-                    days_before = (cycle.start_date - symptom['date']).days
-                    if 1 <= days_before <= 7:
-                        patterns['pms_indicators'].append({
-                            'symptoms': symptom['symptoms'],
-                            'mood': symptom['mood'],
-                            'days_before_period': days_before
-                        })
+            if in_pms_window:
+                patterns['pms_indicators'].append({
+                    'symptoms': names,
+                    'mood': mood,
+                    'days_before_period': days_before
+                })
+            
+            if mood:
+                week_start = (date - timedelta(days=date.weekday())).date()
+                moods = weekly_moods.setdefault(week_start, {})
+                moods[mood] = moods.get(mood, 0) + 1
+            
+            pain_level = symptom.get('pain_level')
+            if pain_level:
+                patterns['pain_frequency'][pain_level] = patterns['pain_frequency'].get(pain_level, 0) + 1
+            
+            for name in names:
+                symptom_totals[name] = symptom_totals.get(name, 0) + 1
+                if in_pms_window:
+                    symptom_pms[name] = symptom_pms.get(name, 0) + 1
+        
+        # Mood counts per calendar week, oldest first
+        patterns['mood_trends'] = [
+            {'week_start': week_start, 'moods': moods}
+            for week_start, moods in sorted(weekly_moods.items())
+        ]
+        
+        # How strongly each symptom clusters in the premenstrual window
+        patterns['symptom_correlation'] = {
+            name: {
+                'occurrences': total,
+                'pms_occurrences': symptom_pms.get(name, 0),
+                'pms_ratio': round(symptom_pms.get(name, 0) / total, 2)
+            }
+            for name, total in sorted(symptom_totals.items(), key=lambda item: item[1], reverse=True)
+        }
         
         return patterns
     
     @staticmethod
     def get_emoji_summary(user_id, days=30):
         """Get emoji-based symptom summary"""
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        symptoms = mongo.db.cycle_symptoms.find({
-            'user_id': ObjectId(user_id),
-            'date': {'$gte': cutoff_date},
-            'emoji_rating': {'$exists': True}
-        })
-        
-        emoji_counts = {}
-        for symptom in symptoms:
-            emoji = symptom.get('emoji_rating')
-            if emoji:
-                emoji_counts[emoji] = emoji_counts.get(emoji, 0) + 1
-        
-        return emoji_counts
+        now = datetime.utcnow()
+        counts = SymptomRollup.get_counts(user_id, now - timedelta(days=days), now)
+        return dict(counts['emojis'])
@@ -0,0 +1,222 @@
+import fcntl
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from bson.objectid import ObjectId
+from flask import current_app, has_app_context
+from app.extensions import mongo
+from app.models.cycle_embedding import CycleEmbedding
+from app.models.embedding_cache import decode_embedding
+
+
+def top_k(matrix, query, k):
+    """Indexes and scores of the k rows of matrix most similar to query.
+
+    Rows and query are unit vectors, so the dot product is the cosine
+    similarity. argpartition finds the k best in linear time; only those k
+    are sorted.
+    """
+    scores = matrix @ query
+    if k < len(scores):
+        best = np.argpartition(-scores, k)[:k]
+    else:
+        best = np.arange(len(scores))
+    best = best[np.argsort(-scores[best])]
+    return best, scores[best]
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class NoteIndex:
+    """Similarity search over the note embeddings of one user or cohort.
+
+    The unit-normalised float32 vectors live in ``<name>.npy`` and the cycle
+    ids (hex ObjectIds) in ``<name>.ids.npy`` under NOTE_INDEX_DIR. Both
+    files are preallocated with spare rows, so appending a vector on save
+    writes one row in place; the capacity doubles when full. Queries memory
+    map the files and reload them when another process has appended; the
+    maps of the MAX_OPEN most recently searched indexes stay open per
+    process. ``cycle_embeddings`` stays the source of truth: a missing index
+    is rebuilt from it. Writers take an exclusive ``flock`` on ``<name>.lock``.
+    """
+    DEFAULT_DIR = os.path.join('instance', 'note_index')
+    INITIAL_CAPACITY = 64
+    MAX_OPEN = 64
+
+    _loaded = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f"Invalid note index name: {name}")
+        self.name = name
+        directory = (current_app.config.get('NOTE_INDEX_DIR', self.DEFAULT_DIR)
+                     if has_app_context() else self.DEFAULT_DIR)
+        self.vectors_path = os.path.join(directory, f'{name}.npy')
+        self.ids_path = os.path.join(directory, f'{name}.ids.npy')
+        self.lock_path = os.path.join(directory, f'{name}.lock')
+
+    @classmethod
+    def for_user(cls, user_id):
+        return cls(f'user_{user_id}')
+
+    @classmethod
+    def for_cohort(cls, cohort):
+        """Index across users; only kept up to date on save once it has been built"""
+        return cls(f'cohort_{cohort}')
+
+    def exists(self):
+        return os.path.exists(self.ids_path) and os.path.exists(self.vectors_path)
+
+    @contextmanager
+    def _writing(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, ids, vectors, capacity):
+        """Write both files with room for capacity rows; ids last, as they make rows visible"""
+        dims = vectors.shape[1]
+        for path, dtype, shape, rows in ((self.vectors_path, np.float32, (capacity, dims), vectors),
+                                         (self.ids_path, 'S24', (capacity,), ids)):
+            temporary = f'{path}.tmp'
+            array = np.lib.format.open_memmap(temporary, mode='w+', dtype=dtype, shape=shape)
+            array[:len(rows)] = rows
+            array.flush()
+            del array
+            os.replace(temporary, path)
+        self._forget()
+
+    def _open(self):
+        """(ids, vectors) of the stored rows as read-only memory maps, cached per process"""
+        try:
+            stamp = os.stat(self.ids_path).st_mtime_ns
+        except FileNotFoundError:
+            self._forget()
+            return None
+        with self._lock:
+            cached = self._loaded.get(self.name)
+            if cached is not None and cached[0] == stamp:
+                self._loaded.move_to_end(self.name)
+                return cached[1], cached[2]
+            # Written or replaced since it was mapped; release the old maps now
+            self._loaded.pop(self.name, None)
+        ids = np.load(self.ids_path, mmap_mode='r')
+        count = int(np.count_nonzero(ids))
+        vectors = np.load(self.vectors_path, mmap_mode='r')
+        ids, vectors = ids[:count], vectors[:count]
+        with self._lock:
+            self._loaded[self.name] = (stamp, ids, vectors)
+            while len(self._loaded) > self.MAX_OPEN:
+                self._loaded.popitem(last=False)
+        return ids, vectors
+
+    def _forget(self):
+        """Drop this index's maps from the per-process cache"""
+        with self._lock:
+            self._loaded.pop(self.name, None)
+
+    def rebuild(self, query):
+        """Rewrite the index from the cycle_embeddings documents matching query"""
+        ids, vectors = [], []
+        for doc in mongo.db[CycleEmbedding.COLLECTION].find(query, {'embedding': 1}).sort('_id', 1):
+            ids.append(str(doc['_id']).encode())
+            vectors.append(decode_embedding(doc['embedding']))
+        with self._writing():
+            if vectors:
+                self._write(np.array(ids, dtype='S24'), normalize_rows(vectors),
+                            max(self.INITIAL_CAPACITY, 2 * len(ids)))
+            else:
+                for path in (self.vectors_path, self.ids_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._forget()
+        return len(ids)
+
+    def append(self, cycle_id, embedding):
+        """Add or replace the vector of one cycle"""
+        key = str(cycle_id).encode()
+        vector = normalize_rows(embedding)
+        with self._writing():
+            ids = np.load(self.ids_path, mmap_mode='r+')
+            vectors = np.load(self.vectors_path, mmap_mode='r+')
+            count = int(np.count_nonzero(ids))
+            existing = np.flatnonzero(ids[:count] == key)
+            if len(existing):
+                vectors[existing[0]] = vector
+            elif count < len(ids):
+                vectors[count] = vector
+                vectors.flush()
+                ids[count] = key
+            else:
+                grown_ids = np.append(ids[:count], np.array([key], dtype='S24'))
+                grown = np.vstack([vectors[:count], vector[None, :]])
+                del ids, vectors
+                self._write(grown_ids, grown, 2 * len(grown_ids))
+                return
+            vectors.flush()
+            ids.flush()
+        # The ids file's mtime tells other processes to reload
+        os.utime(self.ids_path)
+
+    def remove(self, cycle_id):
+        """Drop the vector of one cycle; the last row moves into its place"""
+        if not self.exists():
+            return
+        key = str(cycle_id).encode()
+        with self._writing():
+            ids = np.load(self.ids_path, mmap_mode='r+')
+            vectors = np.load(self.vectors_path, mmap_mode='r+')
+            count = int(np.count_nonzero(ids))
+            existing = np.flatnonzero(ids[:count] == key)
+            if not len(existing):
+                return
+            last = count - 1
+            vectors[existing[0]] = vectors[last]
+            vectors.flush()
+            ids[existing[0]] = ids[last]
+            ids[last] = b''
+            ids.flush()
+        os.utime(self.ids_path)
+
+    def search(self, embedding, k=5, exclude=()):
+        """[(cycle id, cosine similarity)] of the k most similar notes"""
+        opened = self._open()
+        if opened is None or not len(opened[0]):
+            return []
+        ids, vectors = opened
+        exclude = {str(c).encode() for c in exclude}
+        best, scores = top_k(vectors, normalize_rows(embedding), k + len(exclude))
+        # A row freed by remove() is blank until this process notices the new mtime
+        results = [(ObjectId(ids[i].decode()), float(score)) for i, score in zip(best, scores)
+                   if ids[i] and ids[i] not in exclude]
+        return results[:k]
+
+    @classmethod
+    def add_cycle(cls, cycle_id, user_id, embedding):
+        """Append a saved cycle's embedding to its user's index and any built cohort index"""
+        user_index = cls.for_user(user_id)
+        if user_index.exists():
+            user_index.append(cycle_id, embedding)
+        else:
+            user_index.rebuild({'user_id': ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id})
+        cohort_index = cls.for_cohort('all')
+        if cohort_index.exists():
+            cohort_index.append(cycle_id, embedding)
+
+    @classmethod
+    def remove_cycle(cls, cycle_id, user_id):
+        """Drop a cycle whose notes were cleared from its user's index and the cohort index"""
+        cls.for_user(user_id).remove(cycle_id)
+        cls.for_cohort('all').remove(cycle_id)
@@ -0,0 +1,152 @@
+from datetime import datetime
+from bson.objectid import ObjectId
+from flask import current_app, has_app_context
+from pymongo import ReplaceOne
+from app.extensions import mongo
+
+
+class SymptomBucket:
+    """Bucket-pattern storage for symptom logs: one document per user per month.
+
+    Each ``symptom_buckets`` document embeds the month's logs in ``logs``
+    (same fields as a ``cycle_symptoms`` document, including its ``_id``),
+    so reading a year of logs touches 12 documents instead of one per log.
+    Logs are appended with a single upsert, which creates the month's
+    bucket on its first log.
+    """
+    COLLECTION = 'symptom_buckets'
+
+    @staticmethod
+    def _user_key(user_id):
+        return ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+
+    @staticmethod
+    def _month_start(date):
+        return datetime(date.year, date.month, 1)
+
+    @classmethod
+    def append(cls, log):
+        """Add a log to its user's bucket for the month; returns the log with its _id.
+
+        Logs without a date go to the user's undated bucket (``month`` None).
+        """
+        log = dict(log)
+        log.setdefault('_id', ObjectId())
+        user_id = cls._user_key(log['user_id'])
+        log['user_id'] = user_id
+        month = cls._month_start(log['date']) if log.get('date') else None
+        mongo.db[cls.COLLECTION].update_one(
+            {'user_id': user_id, 'month': month},
+            {'$push': {'logs': log}, '$inc': {'count': 1}},
+            upsert=True
+        )
+        return log
+
+    @classmethod
+    def find_logs(cls, user_id, start_date=None, end_date=None, fields=None):
+        """Logs dated within [start_date, end_date], oldest first.
+
+        ``fields`` limits each returned log to those keys (plus ``date``).
+        """
+        query = {'user_id': cls._user_key(user_id)}
+        month_range = {}
+        if start_date is not None:
+            month_range['$gte'] = cls._month_start(start_date)
+        if end_date is not None:
+            month_range['$lte'] = cls._month_start(end_date)
+        if month_range:
+            query['month'] = month_range
+
+        projection = {'_id': 0, 'logs': 1}
+        if fields:
+            projection = {'_id': 0, 'logs.date': 1, **{f'logs.{field}': 1 for field in fields}}
+
+        logs = []
+        for bucket in mongo.db[cls.COLLECTION].find(query, projection).sort('month', 1):
+            for log in bucket.get('logs', []):
+                date = log.get('date')
+                if start_date is not None and (date is None or date < start_date):
+                    continue
+                if end_date is not None and (date is None or date > end_date):
+                    continue
+                logs.append(log)
+        logs.sort(key=lambda log: log.get('date') or datetime.min)
+        return logs
+
+    @classmethod
+    def history(cls, user_id, symptom_name=None, limit=30):
+        """Most recent logs first, optionally only those tracking one symptom"""
+        logs = []
+        cursor = mongo.db[cls.COLLECTION].find({'user_id': cls._user_key(user_id)}).sort('month', -1)
+        for bucket in cursor:
+            month_logs = [log for log in bucket.get('logs', [])
+                          if symptom_name is None or log.get('symptom') == symptom_name]
+            month_logs.sort(key=lambda log: log.get('date') or datetime.min, reverse=True)
+            logs.extend(month_logs)
+            # Buckets come newest month first, so the limit can stop the scan early
+            if limit and len(logs) >= limit:
+                break
+        return logs[:limit] if limit else logs
+
+    @classmethod
+    def iter_logs(cls, user_id=None):
+        """Every stored log, for one user or everyone"""
+        query = {'user_id': cls._user_key(user_id)} if user_id else {}
+        for bucket in mongo.db[cls.COLLECTION].find(query, {'logs': 1}):
+            yield from bucket.get('logs', [])
+
+    @classmethod
+    def migrate(cls, user_id=None, batch_size=500):
+        """Copy cycle_symptoms logs into monthly buckets.
+
+        Buckets of the migrated users are replaced by the months rebuilt from
+        ``cycle_symptoms``, which is left untouched. That is only safe while
+        logs are still written to ``cycle_symptoms``, so this raises
+        RuntimeError once SYMPTOM_STORAGE is 'buckets': logs written after
+        the switch exist only in the buckets and would be lost.
+        Returns (logs, buckets) written.
+        """
+        storage = current_app.config.get('SYMPTOM_STORAGE', 'documents') if has_app_context() else 'documents'
+        if storage == 'buckets':
+            raise RuntimeError("SYMPTOM_STORAGE is 'buckets'; migrating again would overwrite "
+                               "logs that only exist in symptom_buckets")
+
+        query = {'user_id': cls._user_key(user_id)} if user_id else {}
+        cursor = mongo.db['cycle_symptoms'].find({**query, 'date': {'$ne': None}}).sort(
+            [('user_id', 1), ('date', 1)]
+        )
+
+        operations = []
+        logs = buckets = 0
+        current_key, current_logs = None, []
+
+        def flush():
+            user, month = current_key
+            operations.append(ReplaceOne(
+                {'user_id': user, 'month': month},
+                {'user_id': user, 'month': month, 'logs': current_logs, 'count': len(current_logs)},
+                upsert=True
+            ))
+
+        for log in cursor:
+            key = (log['user_id'], cls._month_start(log['date']))
+            if key != current_key:
+                if current_key is not None:
+                    flush()
+                    buckets += 1
+                current_key, current_logs = key, []
+            current_logs.append(log)
+            logs += 1
+            if len(operations) >= batch_size:
+                mongo.db[cls.COLLECTION].bulk_write(operations, ordered=False)
+                operations = []
+        if current_key is not None:
+            flush()
+            buckets += 1
+        if operations:
+            mongo.db[cls.COLLECTION].bulk_write(operations, ordered=False)
+        return logs, buckets
+
+    @staticmethod
+    def create_indexes():
+        mongo.db[SymptomBucket.COLLECTION].create_index([('user_id', 1), ('month', -1)], unique=True)
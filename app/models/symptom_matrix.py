@@ -0,0 +1,196 @@
+from datetime import datetime
+from bson.objectid import ObjectId
+import numpy as np
+from app.extensions import mongo
+
+
+class SymptomMatrix:
+    """Per-user symptom co-occurrence matrix and symptom x cycle-day heatmap.
+
+    Both are stored sparsely in one ``symptom_matrices`` document per user:
+
+    * ``cooccurrence[a][b]`` counts logs containing both symptoms, with ``a``
+      not after ``b`` in CycleSymptom.COMMON_SYMPTOMS order; the diagonal
+      holds each symptom's total.
+    * ``heatmap[symptom][day]`` counts logs of the symptom on that day of the
+      cycle (day 1 is the period start, later days fold into MAX_CYCLE_DAY).
+
+    New logs are added with ``$inc`` as they are saved. Logging a cycle can
+    move the cycle day of existing logs, so it only marks the document stale
+    and the next read rebuilds it from the logs in one vectorised pass.
+    """
+    COLLECTION = 'symptom_matrices'
+    MAX_CYCLE_DAY = 45
+
+    @staticmethod
+    def _user_key(user_id):
+        return ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+
+    @staticmethod
+    def _vocabulary():
+        from app.models.menstrual_cycle import CycleSymptom
+        return CycleSymptom.COMMON_SYMPTOMS
+
+    @staticmethod
+    def _symptom_names(doc):
+        from app.models.menstrual_cycle import CycleSymptom
+        return CycleSymptom._symptom_names(doc)
+
+    @classmethod
+    def _cycle_day(cls, start_date, date):
+        return min((date - start_date).days + 1, cls.MAX_CYCLE_DAY)
+
+    @classmethod
+    def record_log(cls, user_id, symptom_doc):
+        """Add one saved symptom log to the stored matrices"""
+        user_id = cls._user_key(user_id)
+        vocabulary = cls._vocabulary()
+        names = sorted({name for name in cls._symptom_names(symptom_doc) if name in vocabulary},
+                       key=vocabulary.index)
+        if not names:
+            return None
+
+        increments = {'log_count': 1}
+        for i, first in enumerate(names):
+            for second in names[i:]:
+                increments[f'cooccurrence.{first}.{second}'] = 1
+
+        date = symptom_doc.get('date')
+        cycle = mongo.db['menstrual_cycles'].find_one(
+            {'user_id': user_id, 'start_date': {'$lte': date}},
+            {'start_date': 1},
+            sort=[('start_date', -1)]
+        ) if date else None
+        if cycle:
+            day = cls._cycle_day(cycle['start_date'], date)
+            for name in names:
+                increments[f'heatmap.{name}.{day}'] = 1
+
+        # Only documents that exist are updated; a missing one is built on first read
+        return mongo.db[cls.COLLECTION].update_one(
+            {'user_id': user_id},
+            {'$inc': increments, '$set': {'updated_at': datetime.utcnow()}}
+        )
+
+    @classmethod
+    def mark_stale(cls, user_id):
+        """Cycle boundaries changed; rebuild the heatmap on next read"""
+        mongo.db[cls.COLLECTION].update_one(
+            {'user_id': cls._user_key(user_id)},
+            {'$set': {'stale': True}}
+        )
+
+    @classmethod
+    def compute(cls, symptom_docs, cycle_starts):
+        """Build dense matrices from symptom logs and cycle start dates.
+
+        Returns (cooccurrence, heatmap, log_count) where cooccurrence is a
+        k x k array over the vocabulary and heatmap is k x (MAX_CYCLE_DAY + 1),
+        indexed by cycle day.
+        """
+        vocabulary = cls._vocabulary()
+        index = {name: i for i, name in enumerate(vocabulary)}
+        k = len(vocabulary)
+
+        rows, cols, dates = [], [], []
+        log_count = 0
+        for doc in symptom_docs:
+            columns = {index[name] for name in cls._symptom_names(doc) if name in index}
+            if not columns:
+                continue
+            for column in columns:
+                rows.append(log_count)
+                cols.append(column)
+            dates.append(doc.get('date'))
+            log_count += 1
+
+        if not log_count:
+            return np.zeros((k, k), dtype=np.int64), np.zeros((k, cls.MAX_CYCLE_DAY + 1), dtype=np.int64), 0
+
+        # One-hot log x symptom matrix; X^T X counts every pair of symptoms
+        one_hot = np.zeros((log_count, k), dtype=np.int64)
+        one_hot[rows, cols] = 1
+        cooccurrence = one_hot.T @ one_hot
+
+        # Cycle day of every log: last period start on or before the log date
+        heatmap = np.zeros((k, cls.MAX_CYCLE_DAY + 1), dtype=np.int64)
+        starts = np.array(sorted(cycle_starts), dtype='datetime64[ms]')
+        if len(starts):
+            log_dates = np.array([d if d is not None else datetime.min for d in dates], dtype='datetime64[ms]')
+            cycle_index = np.searchsorted(starts, log_dates, side='right') - 1
+            has_cycle = cycle_index >= 0
+            days = np.zeros(log_count, dtype=np.int64)
+            days[has_cycle] = (log_dates[has_cycle] - starts[cycle_index[has_cycle]]) // np.timedelta64(1, 'D') + 1
+            days = np.minimum(days, cls.MAX_CYCLE_DAY)
+
+            # Flatten (symptom, day) to one bin per cell and count with bincount
+            rows = np.asarray(rows)
+            cols = np.asarray(cols)
+            valid = has_cycle[rows]
+            cells = cols[valid] * (cls.MAX_CYCLE_DAY + 1) + days[rows[valid]]
+            heatmap = np.bincount(cells, minlength=k * (cls.MAX_CYCLE_DAY + 1)).reshape(k, -1)
+
+        return cooccurrence, heatmap, log_count
+
+    @classmethod
+    def _to_sparse(cls, cooccurrence, heatmap):
+        vocabulary = cls._vocabulary()
+        sparse_cooccurrence = {}
+        for i, j in zip(*np.nonzero(np.triu(cooccurrence))):
+            sparse_cooccurrence.setdefault(vocabulary[i], {})[vocabulary[j]] = int(cooccurrence[i, j])
+        sparse_heatmap = {}
+        for i, day in zip(*np.nonzero(heatmap)):
+            sparse_heatmap.setdefault(vocabulary[i], {})[str(day)] = int(heatmap[i, day])
+        return sparse_cooccurrence, sparse_heatmap
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """Recompute and store the matrices from all of a user's logs"""
+        user_id = cls._user_key(user_id)
+        from app.models.menstrual_cycle import CycleSymptom
+        symptom_docs = CycleSymptom._find_logs(user_id, fields=('symptoms', 'symptom'))
+        cycle_starts = [c['start_date'] for c in mongo.db['menstrual_cycles'].find(
+            {'user_id': user_id}, {'_id': 0, 'start_date': 1}
+        ) if c.get('start_date')]
+
+        cooccurrence, heatmap, log_count = cls.compute(symptom_docs, cycle_starts)
+        sparse_cooccurrence, sparse_heatmap = cls._to_sparse(cooccurrence, heatmap)
+        document = {
+            'user_id': user_id,
+            'cooccurrence': sparse_cooccurrence,
+            'heatmap': sparse_heatmap,
+            'log_count': log_count,
+            'stale': False,
+            'updated_at': datetime.utcnow()
+        }
+        mongo.db[cls.COLLECTION].replace_one({'user_id': user_id}, document, upsert=True)
+        return document
+
+    @classmethod
+    def get(cls, user_id):
+        """Stored matrices for a user, rebuilding them if missing or stale"""
+        document = mongo.db[cls.COLLECTION].find_one({'user_id': cls._user_key(user_id)})
+        if document is None or document.get('stale'):
+            document = cls.rebuild(user_id)
+        return document
+
+    @classmethod
+    def to_arrays(cls, document):
+        """Dense (cooccurrence, heatmap) arrays from a stored document"""
+        vocabulary = cls._vocabulary()
+        index = {name: i for i, name in enumerate(vocabulary)}
+        k = len(vocabulary)
+        cooccurrence = np.zeros((k, k), dtype=np.int64)
+        for first, row in document.get('cooccurrence', {}).items():
+            for second, count in row.items():
+                cooccurrence[index[first], index[second]] = count
+                cooccurrence[index[second], index[first]] = count
+        heatmap = np.zeros((k, cls.MAX_CYCLE_DAY + 1), dtype=np.int64)
+        for name, days in document.get('heatmap', {}).items():
+            for day, count in days.items():
+                heatmap[index[name], int(day)] = count
+        return cooccurrence, heatmap
+
+    @staticmethod
+    def create_indexes():
+        mongo.db[SymptomMatrix.COLLECTION].create_index([('user_id', 1)], unique=True)
@@ -0,0 +1,158 @@
+from collections import Counter
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from app.extensions import mongo
+
+
+class SymptomRollup:
+    """Monthly per-user counts of logged symptoms, emojis, moods and pain levels.
+
+    One ``symptom_rollups`` document per user and calendar month keeps the
+    month's totals plus the same counts per day of the month, so a date
+    range is answered from at most one document per month: whole months use
+    the totals, the months at either end add up the days inside the range.
+    Counts are applied with ``$inc`` whenever a symptom log is written.
+    Users whose logs predate the rollups are backfilled on their first read;
+    ``users.symptomRollupsBuiltAt`` records that a user's rollups are complete.
+    """
+    COLLECTION = 'symptom_rollups'
+    FIELDS = ('symptoms', 'emojis', 'moods', 'pain_levels')
+    BUILT_FIELD = 'symptomRollupsBuiltAt'
+
+    @staticmethod
+    def _user_key(user_id):
+        return ObjectId(user_id) if not isinstance(user_id, ObjectId) else user_id
+
+    @staticmethod
+    def _month_start(date):
+        return datetime(date.year, date.month, 1)
+
+    @staticmethod
+    def _key(value):
+        """Use a logged value as a field name ('.' and a leading '$' are not allowed)"""
+        key = str(value).replace('.', '_')
+        return '_' + key[1:] if key.startswith('$') else key
+
+    @classmethod
+    def _log_counts(cls, symptom_doc):
+        """Counts contributed by one symptom log, per rollup field"""
+        from app.models.menstrual_cycle import CycleSymptom
+        counts = {
+            'symptoms': Counter(cls._key(name) for name in CycleSymptom._symptom_names(symptom_doc)),
+            'emojis': Counter(),
+            'moods': Counter(),
+            'pain_levels': Counter()
+        }
+        for field, source in (('emojis', 'emoji_rating'), ('moods', 'mood'), ('pain_levels', 'pain_level')):
+            if symptom_doc.get(source):
+                counts[field][cls._key(symptom_doc[source])] += 1
+        return counts
+
+    @classmethod
+    def _update_for(cls, user_id, date, counts, log_count=1):
+        """Upsert operation adding counts to the month and day of ``date``"""
+        increments = {'log_count': log_count, f'days.{date.day}.log_count': log_count}
+        for field, counter in counts.items():
+            for key, count in counter.items():
+                increments[f'totals.{field}.{key}'] = count
+                increments[f'days.{date.day}.{field}.{key}'] = count
+
+        last_occurrence = {f'last_occurrence.{key}': date for key in counts['symptoms']}
+        update = {'$inc': increments, '$set': {'updated_at': datetime.utcnow()}}
+        if last_occurrence:
+            update['$max'] = last_occurrence
+        return UpdateOne({'user_id': user_id, 'month': cls._month_start(date)}, update, upsert=True)
+
+    @classmethod
+    def record_log(cls, user_id, symptom_doc):
+        """Add one saved symptom log to its month's rollup"""
+        date = symptom_doc.get('date')
+        if not date:
+            return None
+        operation = cls._update_for(cls._user_key(user_id), date, cls._log_counts(symptom_doc))
+        return mongo.db[cls.COLLECTION].bulk_write([operation])
+
+    @classmethod
+    def get_counts(cls, user_id, start_date, end_date):
+        """Merged counts for logs dated within [start_date, end_date].
+
+        Ranges are resolved to whole days: logs from the day of
+        ``start_date`` up to the day of ``end_date`` are included.
+        """
+        user_id = cls._user_key(user_id)
+        cls._ensure_built(user_id)
+        merged = {field: Counter() for field in cls.FIELDS}
+        merged['last_occurrence'] = {}
+        merged['log_count'] = 0
+
+        rollups = mongo.db[cls.COLLECTION].find({
+            'user_id': user_id,
+            'month': {'$gte': cls._month_start(start_date), '$lte': cls._month_start(end_date)}
+        })
+        for rollup in rollups:
+            month = rollup['month']
+            first_day = start_date.day if (month.year, month.month) == (start_date.year, start_date.month) else 1
+            last_day = end_date.day if (month.year, month.month) == (end_date.year, end_date.month) else 31
+
+            if first_day == 1 and last_day == 31:
+                parts = [rollup.get('totals', {})]
+                merged['log_count'] += rollup.get('log_count', 0)
+            else:
+                parts = [counts for day, counts in rollup.get('days', {}).items()
+                         if first_day <= int(day) <= last_day]
+                merged['log_count'] += sum(part.get('log_count', 0) for part in parts)
+
+            for part in parts:
+                for field in cls.FIELDS:
+                    merged[field].update(part.get(field, {}))
+            for key, date in rollup.get('last_occurrence', {}).items():
+                if merged['symptoms'].get(key) and date > merged['last_occurrence'].get(key, datetime.min):
+                    merged['last_occurrence'][key] = date
+
+        return merged
+
+    @classmethod
+    def _ensure_built(cls, user_id):
+        """Rebuild a user's rollups from their logs if they were never built"""
+        user = mongo.db['users'].find_one({'_id': user_id}, {cls.BUILT_FIELD: 1})
+        if user is not None and not user.get(cls.BUILT_FIELD):
+            cls.rebuild(user_id)
+
+    @classmethod
+    def rebuild(cls, user_id=None, batch_size=1000):
+        """Recompute rollups from the stored symptom logs, for one user or everyone.
+
+        Returns the number of logs counted.
+        """
+        from app.models.menstrual_cycle import CycleSymptom
+        from app.models.symptom_bucket import SymptomBucket
+        query = {'user_id': cls._user_key(user_id)} if user_id else {}
+        mongo.db[cls.COLLECTION].delete_many(query)
+
+        operations = []
+        logs = 0
+        if CycleSymptom._storage() == 'buckets':
+            cursor = (log for log in SymptomBucket.iter_logs(user_id) if log.get('date'))
+        else:
+            cursor = mongo.db['cycle_symptoms'].find(
+                {**query, 'date': {'$ne': None}},
+                {'user_id': 1, 'date': 1, 'symptoms': 1, 'symptom': 1,
+                 'emoji_rating': 1, 'mood': 1, 'pain_level': 1}
+            )
+        for symptom_doc in cursor:
+            operations.append(cls._update_for(symptom_doc['user_id'], symptom_doc['date'],
+                                              cls._log_counts(symptom_doc)))
+            logs += 1
+            if len(operations) >= batch_size:
+                mongo.db[cls.COLLECTION].bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            mongo.db[cls.COLLECTION].bulk_write(operations, ordered=False)
+        users = {'_id': cls._user_key(user_id)} if user_id else {}
+        mongo.db['users'].update_many(users, {'$set': {cls.BUILT_FIELD: datetime.utcnow()}})
+        return logs
+
+    @staticmethod
+    def create_indexes():
+        mongo.db[SymptomRollup.COLLECTION].create_index([('user_id', 1), ('month', 1)], unique=True)
@@ -1,7 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, jsonify
+import os
+from flask import Blueprint, render_template, redirect, url_for, jsonify, current_app
 from flask_login import login_required, current_user
 from app.models.menstrual_profile import MenstrualProfile
-from app.models.menstrual_cycle import MenstrualCycle
+from app.models.cycle_snapshot import CycleSnapshot
+from app.services import ml
 
 # Create a Blueprint for main routes
 main_bp = Blueprint('main', __name__)
@@ -11,6 +13,17 @@ main_bp = Blueprint('main', __name__)
 def index():
     return render_template('index.html', title='Home')
 
+@main_bp.route('/ready')
+def ready():
+    """Readiness probe: 503 until MedBERT is warm when MEDBERT_WARMUP is on"""
+    medbert = ml.warm_status()
+    if current_app.config.get('MEDBERT_WARMUP') and ml.MEDBERT_WORKER_SOCKET and medbert['status'] != 'warm':
+        # The shared inference worker may come up after the web processes; ping it again
+        medbert = ml.warm_up()
+    medbert['worker_pid'] = os.getpid()
+    is_ready = not current_app.config.get('MEDBERT_WARMUP') or medbert['status'] == 'warm'
+    return jsonify({'status': 'ready' if is_ready else 'warming', 'medbert': medbert}), 200 if is_ready else 503
+
 @main_bp.route('/dashboard')
 @login_required
 def dashboard():
@@ -18,7 +31,8 @@ def dashboard():
     profile = MenstrualProfile.get_primary_profile(user_id)
     
     # Check if user has any cycle data
-    has_cycle_data = MenstrualCycle.get_user_cycles(user_id, limit=1)
+    snapshot = CycleSnapshot.for_user(user_id)
+    has_cycle_data = snapshot.has_cycles
     
     dashboard_data = {
         'has_cycle_data': bool(has_cycle_data),
@@ -31,10 +45,10 @@ def dashboard():
     # Only fetch cycle data if user has started tracking
     if has_cycle_data:
         dashboard_data.update({
-            'next_period': MenstrualCycle.predict_next_period(user_id),
-            'fertile_window': MenstrualCycle.get_fertile_window(user_id),
-            'cycle_stats': MenstrualCycle.get_cycle_statistics(user_id),
-            'current_phase': MenstrualCycle.get_current_phase(user_id)[0] if MenstrualCycle.get_current_cycle(user_id) else 'Not Tracking'
+            'next_period': snapshot.next_period,
+            'fertile_window': snapshot.fertile_window,
+            'cycle_stats': snapshot.stats,
+            'current_phase': snapshot.current_phase if snapshot.current_cycle else 'Not Tracking'
         })
 
     return render_template('dashboard.html', title='Dashboard', data=dashboard_data)
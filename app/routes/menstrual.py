@@ -6,7 +6,6 @@ from flask import Blueprint, render_template, request, jsonify, flash, redirect,
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
 from bson import ObjectId
-from calendar import monthrange, month_name
 import matplotlib
 matplotlib.use('Agg')  # Set the backend to non-interactive
 import matplotlib.pyplot as plt
@@ -54,9 +53,14 @@ def create_line_chart(dates, values, title, xlabel, ylabel, color='tab:blue'):
 import pandas as pd
 import numpy as np
 from ..models.menstrual_cycle import MenstrualCycle, CycleSymptom
+from ..models.cycle_snapshot import CycleSnapshot
+from ..models.cycle_aggregates import CycleAggregates
+from ..models.symptom_matrix import SymptomMatrix
+from ..models.cycle_abnormalities import CycleAbnormalities
 from app.forms.wellness_forms import WellnessQuizForm
 from app.models.user import User
 from app.services.ai_service import generate_wellness_recommendations
+from app.services.calendar_builder import CalendarBuilder
 
 # Define the Blueprint at the top level
 menstrual_bp = Blueprint('menstrual', __name__)
@@ -127,6 +131,21 @@ def analytics_enhanced():
                          ovulation_day=ovulation_day)
 
 # Calendar helper functions
+def build_calendar(user_id, year, month, count=1):
+    """Load cycles, predictions and symptoms for ``count`` months into a CalendarBuilder."""
+    builder = CalendarBuilder.for_months(year, month, count)
+    first_day, last_day = builder.range_bounds()
+
+    # Get historical data
+    cycles = list(MenstrualCycle.get_cycles_in_date_range(user_id, first_day, last_day + timedelta(days=1)))
+    symptoms = list(CycleSymptom.get_symptoms_in_date_range(user_id, first_day, last_day + timedelta(days=1)))
+
+    # Get predictions for both past and future months
+    predicted_cycles = MenstrualCycle.predict_future_cycles(user_id, num_cycles=6)
+
+    # Logged periods take precedence over predicted phases
+    return builder.add_cycles(cycles).add_predictions(predicted_cycles).add_symptoms(symptoms)
+
 def get_calendar_data(user_id, year=None, month=None):
     """Generate calendar data for a given month, including predictions."""
     import datetime as dt
@@ -136,90 +155,35 @@ def get_calendar_data(user_id, year=None, month=None):
     if not month:
         month = today.month
 
-    _, num_days = monthrange(year, month)
-    first_day = dt.datetime(year, month, 1)
-    last_day = dt.datetime(year, month, num_days)
-    first_weekday = first_day.weekday()
-
-    # Get historical data
-    cycles = list(MenstrualCycle.get_cycles_in_date_range(user_id, first_day, last_day + timedelta(days=1)))
-    symptoms = list(CycleSymptom.get_symptoms_in_date_range(user_id, first_day, last_day + timedelta(days=1)))
-
-    # Get predictions for both past and future months
-    predicted_cycles = MenstrualCycle.predict_future_cycles(user_id, num_cycles=6)
-
-    calendar_days = []
-    for _ in range(first_weekday):
-        calendar_days.append({'day': '', 'date': None, 'is_today': False, 'cycle': None, 'symptoms': []})
+    return build_calendar(user_id, year, month).month(year, month, today)
 
-    for day in range(1, num_days + 1):
-        current_date = dt.datetime(year, month, day)
-        is_today = (current_date.date() == today.date())
-        cycle_data = None
+def get_year_calendar_data(user_id, year=None):
+    """Generate calendar data for all twelve months of a year from a single build."""
+    import datetime as dt
+    today = dt.datetime.combine(date.today(), dt.time())
+    year = year or today.year
 
-        # Check for historical cycle data first
-        for cycle in cycles:
-            if cycle['start_date'].date() <= current_date.date() and (cycle.get('end_date') is None or cycle['end_date'].date() >= current_date.date()):
-                cycle_data = {'is_period': True, 'flow': cycle.get('flow_intensity', 'moderate')}
-                break
-        
-        # If no historical data, check for predicted phases
-        if not cycle_data:
-            for prediction in predicted_cycles:
-                for phase_name, (start, end) in prediction.items():
-                    if start.date() <= current_date.date() <= end.date():
-                        cycle_data = {'predicted_phase': phase_name.split('_')[0].capitalize(), 'is_predicted': True}
-                        break
-                if cycle_data:
-                    break
-
-        day_symptoms = [s for s in symptoms if s['date'].date() == current_date.date()]
-        
-        calendar_days.append({
-            'day': day,
-            'date': current_date,
-            'is_today': is_today,
-            'cycle': cycle_data,
-            'symptoms': day_symptoms
-        })
-
-    prev_month = month - 1 if month > 1 else 12
-    prev_year = year if month > 1 else year - 1
-    next_month = month + 1 if month < 12 else 1
-    next_year = year if month < 12 else year + 1
-
-    return {
-        'year': year,
-        'month': month,
-        'month_name': month_name[month],
-        'days': calendar_days,
-        'prev_month': {'month': prev_month, 'year': prev_year},
-        'next_month': {'month': next_month, 'year': next_year},
-        'today': today
-    }
+    builder = build_calendar(user_id, year, 1, count=12)
+    return [builder.month(year, month, today) for month in range(1, 13)]
 
 @menstrual_bp.route('/')
 @menstrual_bp.route('/tracker')
 @login_required
 def tracker():
     """Main menstrual tracking dashboard"""
-    cycles = MenstrualCycle.get_user_cycles(current_user.id)
-    current_cycle = MenstrualCycle.get_current_cycle(current_user.id)
-    next_period = MenstrualCycle.predict_next_period(current_user.id)
-    fertile_start, ovulation_day = MenstrualCycle.get_fertile_window(current_user.id)
-    current_phase, day_of_cycle = MenstrualCycle.get_current_phase(current_user.id)
-    cycle_stats = MenstrualCycle.get_cycle_statistics(current_user.id)
+    snapshot = CycleSnapshot.for_user(current_user.id)
+    fertile_start, ovulation_day = snapshot.fertile_window
     
     return render_template('menstrual/tracker.html',
-                         cycles=cycles,
-                         current_cycle=current_cycle,
-                         next_period=next_period,
+                         cycles=snapshot.recent_cycles(),
+                         current_cycle=snapshot.current_cycle,
+                         next_period=snapshot.next_period,
                          fertile_start=fertile_start,
                          ovulation_day=ovulation_day,
-                         current_phase=current_phase,
-                         day_of_cycle=day_of_cycle,
-                         cycle_stats=cycle_stats,
-                         now=datetime.utcnow())
+                         current_phase=snapshot.current_phase,
+                         day_of_cycle=snapshot.day_of_cycle,
+                         cycle_stats=snapshot.stats,
+                         now=snapshot.now)
 
 @menstrual_bp.route('/tracker/log', methods=['GET', 'POST'])
 @login_required
@@ -287,36 +251,83 @@ def log_symptom():
         current_app.logger.error(f"Error logging symptom: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
+HISTORY_PAGE_SIZE = 20
+
+def _history_cursor(value):
+    """Parse the ``before`` cursor of the history pages.
+
+    The cursor is ``<ISO start date>_<cycle id>``; a bare ISO start date
+    (from links made before the id was added) is still accepted.
+    """
+    if not value:
+        return None
+    start, _, cycle_id = value.partition('_')
+    try:
+        start = datetime.fromisoformat(start)
+    except ValueError:
+        return None
+    if not cycle_id:
+        return start
+    if not ObjectId.is_valid(cycle_id):
+        return None
+    return start, ObjectId(cycle_id)
+
+def _format_history_cursor(cursor):
+    """The next page's ``before`` value, or None on the last page"""
+    if cursor is None:
+        return None
+    start, cycle_id = cursor
+    return f"{start.isoformat()}_{cycle_id}"
+
+def get_cycle_history_page(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """A page of cycle history with abnormality entries, and the next cursor"""
+    cycles, cursor = MenstrualCycle.get_history_page(user_id, before, limit)
+
+    # Flags are stored by CycleAbnormalities on save; analyse older histories once
+    if any('abnormality_flags' not in cycle for cycle in cycles):
+        CycleAbnormalities.analyze_user(user_id)
+        cycles, cursor = MenstrualCycle.get_history_page(user_id, before, limit)
+
+    # Only the running mean is needed; the snapshot would load the whole history
+    cycle_lengths = (CycleAggregates.get(user_id) or {}).get('cycle_length') or {}
+    avg_cycle_length = round(cycle_lengths['mean'], 1) if cycle_lengths.get('count') else None
+    for cycle in cycles:
+        cycle['abnormalities'] = CycleAbnormalities.describe(cycle, avg_cycle_length)
+    return cycles, cursor
+
 @menstrual_bp.route('/tracker/cycles')
 @login_required
 def cycle_history():
-    """View cycle history with abnormality analysis."""
-    all_cycles = MenstrualCycle.get_user_cycles(current_user.id, limit=0)
-
-    if not all_cycles:
-        return render_template('menstrual/cycle_history.html', cycles=[])
+    """View cycle history with abnormality analysis, one page at a time."""
+    before = _history_cursor(request.args.get('before'))
+    cycles, cursor = get_cycle_history_page(current_user.id, before)
+    return render_template('menstrual/cycle_history.html', cycles=cycles,
+                           next_cursor=_format_history_cursor(cursor))
 
-    user_stats = MenstrualCycle.get_cycle_statistics(current_user.id)
-    
-    cycles_with_analysis = []
-    for i in range(len(all_cycles)):
-        cycle = all_cycles[i]
-        
-        if cycle.get('start_date') and cycle.get('end_date'):
-            cycle['period_length'] = (cycle['end_date'] - cycle['start_date']).days + 1
-        else:
-            cycle['period_length'] = None
-            
-        if i + 1 < len(all_cycles):
-            prev_cycle_start = all_cycles[i+1]['start_date']
-            cycle['cycle_length'] = (cycle['start_date'] - prev_cycle_start).days
-        else:
-            cycle['cycle_length'] = None
-            
-        cycle['abnormalities'] = MenstrualCycle.analyze_cycle_abnormalities(cycle, user_stats)
-        cycles_with_analysis.append(cycle)
-
-    return render_template('menstrual/cycle_history.html', cycles=cycles_with_analysis)
+@menstrual_bp.route('/tracker/cycles.json')
+@login_required
+def cycle_history_json():
+    """Cycle history page as JSON, for infinite scroll"""
+    before = request.args.get('before')
+    cursor_value = _history_cursor(before)
+    if before and cursor_value is None:
+        return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), 100)
+
+    cycles, cursor = get_cycle_history_page(current_user.id, cursor_value, limit)
+    return jsonify({
+        'cycles': [{
+            'id': str(cycle['_id']),
+            'start_date': cycle['start_date'].isoformat(),
+            'end_date': cycle['end_date'].isoformat() if cycle.get('end_date') else None,
+            'period_length': cycle.get('period_length'),
+            'cycle_length': cycle.get('cycle_length'),
+            'pain_level': cycle.get('pain_level'),
+            'flow_intensity': cycle.get('flow_intensity'),
+            'abnormalities': cycle['abnormalities']
+        } for cycle in cycles],
+        'next_cursor': _format_history_cursor(cursor)
+    })
 
 @menstrual_bp.route('/tracker/calendar')
 @menstrual_bp.route('/tracker/calendar/<int:year>/<int:month>')
@@ -337,6 +348,45 @@ def cycle_calendar(year=None, month=None):
                          CycleSymptom=CycleSymptom,
                          form=form)
 
+@menstrual_bp.route('/tracker/calendar/<int:year>/bitmap')
+@menstrual_bp.route('/tracker/calendar/<int:year>/<int:month>/bitmap')
+@login_required
+def calendar_bitmap(year, month=None):
+    """Month or whole-year calendar as per-phase day bitmaps (JSON)"""
+    if not 1 <= year <= 9999:
+        return jsonify({'status': 'error', 'message': 'Invalid year'}), 400
+    if month is not None and not 1 <= month <= 12:
+        return jsonify({'status': 'error', 'message': 'Invalid month'}), 400
+
+    builder = CalendarBuilder.for_months(year, month or 1, 1 if month else 12)
+    first_day, _ = builder.range_bounds()
+    # End of the last day; the next midnight would overflow in December 9999
+    range_end = datetime.combine(builder.last_day, datetime.max.time())
+
+    # Same read-through cache as the HTML calendar: stored predictions are reused
+    # until the user's cycles or model change (see _prediction_fingerprint)
+    predicted_phases = MenstrualCycle.predict_future_cycles(current_user.id, num_cycles=6)
+
+    builder.add_cycles(MenstrualCycle.get_cycles_in_date_range(current_user.id, first_day, range_end))
+    builder.add_predictions(predicted_phases)
+    builder.add_symptoms(CycleSymptom.get_symptom_days_in_date_range(current_user.id, first_day, range_end))
+
+    return jsonify(builder.to_bitmaps())
+
+@menstrual_bp.route('/tracker/analytics/symptom-matrix')
+@login_required
+def symptom_matrix():
+    """Stored symptom co-occurrence matrix and symptom x cycle-day heatmap (JSON)"""
+    document = SymptomMatrix.get(current_user.id)
+    return jsonify({
+        'symptoms': CycleSymptom.COMMON_SYMPTOMS,
+        'max_cycle_day': SymptomMatrix.MAX_CYCLE_DAY,
+        'log_count': document.get('log_count', 0),
+        'cooccurrence': document.get('cooccurrence', {}),
+        'heatmap': document.get('heatmap', {}),
+        'updated_at': document['updated_at'].isoformat() if document.get('updated_at') else None
+    })
+
 @menstrual_bp.route('/tracker/analytics')
 @login_required
 def analytics():
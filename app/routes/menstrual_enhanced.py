@@ -5,6 +5,9 @@ import os
 from bson.objectid import ObjectId
 
 from app.models.menstrual_cycle import MenstrualCycle, CycleSymptom
+from app.models.cycle_snapshot import CycleSnapshot
+from app.models.cycle_aggregates import CycleAggregates
+from app.models.cycle_embedding import CycleEmbedding
 from app.models.menstrual_reminder import MenstrualReminder
 
 from app.models.menstrual_profile import MenstrualProfile, VoiceLog, DataExport
@@ -19,24 +22,17 @@ menstrual_enhanced_bp = Blueprint('menstrual_enhanced', __name__)
 @login_required
 def dashboard():
     """Enhanced menstrual tracking dashboard with AI/ML analytics and real-time stats"""
-    cycles = MenstrualCycle.get_user_cycles(current_user.id)
-    current_cycle = MenstrualCycle.get_current_cycle(current_user.id)
-    now = datetime.utcnow()
+    snapshot = CycleSnapshot.for_user(current_user.id)
+    cycles = snapshot.recent_cycles()
+    current_cycle = snapshot.current_cycle
+    now = snapshot.now
     # Current cycle day
-    if current_cycle and current_cycle.get('start_date'):
-        current_cycle_day = (now.date() - current_cycle['start_date'].date()).days + 1
-    else:
-        current_cycle_day = None
-    # Next period prediction (Random Forest)
-    rf_pred = MenstrualCycle.predict_next_cycle_rf(current_user.id)
-    if current_cycle and rf_pred:
-        next_period = current_cycle['start_date'] + timedelta(days=rf_pred)
-        next_period_days = (next_period.date() - now.date()).days
-    else:
-        next_period = MenstrualCycle.predict_next_period(current_user.id)
-        next_period_days = (next_period.date() - now.date()).days if next_period else None
+    current_cycle_day = snapshot.current_cycle_day
+    # Next period prediction (Random Forest, falling back to averages)
+    next_period = snapshot.predicted_next_period
+    next_period_days = (next_period.date() - now.date()).days if next_period else None
     # Fertile window status
-    fertile_start, ovulation_day = MenstrualCycle.get_fertile_window(current_user.id)
+    fertile_start, ovulation_day = snapshot.fertile_window
     if fertile_start and ovulation_day:
         if fertile_start.date() <= now.date() <= ovulation_day.date():
             fertile_window_status = 'In Window'
@@ -44,20 +40,24 @@ def dashboard():
             fertile_window_status = f"{fertile_start.strftime('%b %d')} - {ovulation_day.strftime('%b %d')}"
     else:
         fertile_window_status = None
-    # Cycle regularity (std dev of last 6 cycles)
-    if cycles and len(cycles) > 5:
-        cycle_lengths = [(cycles[i]['start_date'] - cycles[i+1]['start_date']).days for i in range(len(cycles)-1)]
-        avg = sum(cycle_lengths) / len(cycle_lengths)
-        std = (sum((x-avg)**2 for x in cycle_lengths) / len(cycle_lengths))**0.5
-        cycle_regularity = int(100 - min(std/avg*100, 100))
+    # Cycle regularity (coefficient of variation of cycle lengths, from the running aggregates)
+    cycle_lengths = (snapshot.aggregates or {}).get('cycle_length')
+    if cycle_lengths and cycle_lengths['count'] >= 5 and cycle_lengths['mean'] > 0:
+        std = CycleAggregates.std(cycle_lengths)
+        cycle_regularity = int(100 - min(std/cycle_lengths['mean']*100, 100))
     else:
         cycle_regularity = None
-    # AI Insights (MedBERT on notes)
+    # AI Insights (MedBERT on notes, embedded when the cycle was saved)
     ai_insights = []
+    # Cycles come without notes; only cycles whose notes were embedded have an entry
+    embeddings = CycleEmbedding.get_many([c['_id'] for c in cycles[:3]], current_user.id)
     for c in cycles[:3]:
-        if c.get('notes'):
-            emb = MenstrualCycle.analyze_notes_with_medbert(c['notes'])
-            ai_insights.append({'title': 'MedBERT Embedding', 'description': str(emb)})
+        if c['_id'] in embeddings:
+            ai_insights.append({
+                'title': 'MedBERT Embedding',
+                'description': f"Notes from {c['start_date'].strftime('%b %d')} analysed "
+                               f"({len(embeddings[c['_id']])}-dimensional embedding)"
+            })
     # Recent symptoms
     recent_symptoms = CycleSymptom.get_symptom_history(current_user.id, limit=5)
     # Get upcoming reminders for the next 3 days
@@ -337,22 +337,18 @@ def log_cycle():
     ]
     if request.method == 'POST':
         data = request.form
-        notes = data.get('notes', '')
-        medbert_analytics = None
-        if notes:
-            medbert_analytics = MenstrualCycle.analyze_notes_with_medbert(notes)
-        # Save cycle with medbert_analytics in DB (as an example, add to notes field)
-            cycle = MenstrualCycle(
-                user_id=current_user.id,
+        # MedBERT embeds the notes when the cycle is saved (stored in cycle_embeddings)
+        cycle = MenstrualCycle(
+            user_id=current_user.id,
             start_date=datetime.strptime(data['start_date'], '%Y-%m-%d'),
             end_date=datetime.strptime(data['end_date'], '%Y-%m-%d') if data.get('end_date') else None,
             flow_intensity=data.get('flow_intensity', 'moderate'),
             pain_level=data.get('pain_level', 'none'),
             mood=data.get('mood', 'normal'),
             symptoms=data.getlist('symptoms'),
-            notes=notes + f"\nMedBERT: {medbert_analytics}" if medbert_analytics else notes
-            )
-            cycle.save()
+            notes=data.get('notes', '')
+        )
+        cycle.save()
         # Optionally retrain RF model
         MenstrualCycle.train_random_forest(current_user.id)
         flash('Cycle logged with AI analytics!', 'success')
@@ -519,21 +515,36 @@ def api_quick_log():
     return jsonify({'status': 'success', 'message': 'Log received', 'data': data})
 
 
+@menstrual_enhanced_bp.route('/api/cycles/<cycle_id>/similar')
+@login_required
+def api_similar_cycles(cycle_id):
+    """Past cycles whose notes are most similar to this cycle's notes"""
+    if not ObjectId.is_valid(cycle_id):
+        return jsonify({'status': 'error', 'message': 'Invalid cycle id'}), 400
+    k = min(max(request.args.get('k', 3, type=int), 1), 20)
+    similar = MenstrualCycle.similar_cycles(current_user.id, cycle_id, k)
+    return jsonify({
+        'similar': [{
+            'id': str(cycle['_id']),
+            'start_date': cycle['start_date'].isoformat(),
+            'end_date': cycle['end_date'].isoformat() if cycle.get('end_date') else None,
+            'notes': cycle.get('notes'),
+            'similarity': cycle['similarity']
+        } for cycle in similar]
+    })
+
+
 @menstrual_enhanced_bp.route('/api/predictions')
 @login_required
 def api_predictions():
     """API endpoint for cycle predictions using Random Forest"""
-    rf_pred = MenstrualCycle.predict_next_cycle_rf(current_user.id)
-    current_cycle = MenstrualCycle.get_current_cycle(current_user.id)
-    if current_cycle and rf_pred:
-        next_period = current_cycle['start_date'] + timedelta(days=rf_pred)
-    else:
-        next_period = MenstrualCycle.predict_next_period(current_user.id)
-    fertile_start, ovulation_day = MenstrualCycle.get_fertile_window(current_user.id)
+    snapshot = CycleSnapshot.for_user(current_user.id)
+    next_period = snapshot.predicted_next_period
+    fertile_start, ovulation_day = snapshot.fertile_window
     return jsonify({
         'next_period': next_period.isoformat() if next_period else None,
         'fertile_start': fertile_start.isoformat() if fertile_start else None,
         'ovulation_day': ovulation_day.isoformat() if ovulation_day else None,
-        'rf_pred_days': rf_pred
+        'rf_pred_days': snapshot.rf_prediction
     })
 
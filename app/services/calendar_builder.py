@@ -0,0 +1,160 @@
+import base64
+from calendar import monthrange, month_name
+from datetime import date, datetime
+import numpy as np
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+class CalendarBuilder:
+    """Day-indexed calendar for an arbitrary date range.
+
+    Cycles, predicted phases and symptoms are projected onto arrays indexed
+    by the day's offset from the first day of the range, so each input is
+    visited once instead of once per calendar day. Months (or a whole year)
+    can then be cut from the same arrays without querying again.
+    """
+
+    BITMAP_PHASES = ('period', 'menstrual', 'follicular', 'ovulatory', 'luteal')
+
+    def __init__(self, first_day, last_day):
+        self.first_day = _as_date(first_day)
+        self.last_day = _as_date(last_day)
+        self._first_ordinal = self.first_day.toordinal()
+        self.num_days = self.last_day.toordinal() - self._first_ordinal + 1
+        self.cycle_data = [None] * self.num_days
+        self.symptoms = [None] * self.num_days
+
+    def _index(self, day):
+        return _as_date(day).toordinal() - self._first_ordinal
+
+    def _span(self, start, end):
+        """Clamp an inclusive [start, end] date span to array indices"""
+        low = max(self._index(start), 0)
+        high = min(self._index(end) if end is not None else self.num_days - 1, self.num_days - 1)
+        return low, high
+
+    def _fill(self, start, end, value):
+        """Set value on every day of the span that is not already marked"""
+        low, high = self._span(start, end)
+        cycle_data = self.cycle_data
+        for index in range(low, high + 1):
+            if cycle_data[index] is None:
+                cycle_data[index] = value
+
+    def add_cycles(self, cycles):
+        """Mark logged periods; earlier cycles in the list take precedence"""
+        for cycle in cycles:
+            self._fill(cycle['start_date'], cycle.get('end_date'),
+                       {'is_period': True, 'flow': cycle.get('flow_intensity', 'moderate')})
+        return self
+
+    def add_predictions(self, predicted_cycles):
+        """Mark predicted phases on days without a logged period"""
+        for prediction in predicted_cycles:
+            for phase_name, (start, end) in prediction.items():
+                self._fill(start, end, {
+                    'predicted_phase': phase_name.split('_')[0].capitalize(),
+                    'is_predicted': True
+                })
+        return self
+
+    def add_symptoms(self, symptoms):
+        """Attach symptom logs to their day, keeping their input order"""
+        for symptom in symptoms:
+            index = self._index(symptom['date'])
+            if 0 <= index < self.num_days:
+                if self.symptoms[index] is None:
+                    self.symptoms[index] = []
+                self.symptoms[index].append(symptom)
+        return self
+
+    def symptom_count(self, index):
+        """Number of symptoms logged on a day (a log may hold several)"""
+        count = 0
+        for log in self.symptoms[index] or []:
+            symptoms = log.get('symptoms')
+            count += len(symptoms) if isinstance(symptoms, list) else 1
+        return count
+
+    def to_bitmaps(self):
+        """Compact encoding of the range for JSON clients.
+
+        Every phase ('period' for logged periods, otherwise the predicted
+        phase) becomes a base64 bitmap with one bit per day, bit ``i`` being
+        day ``start + i`` in little-endian bit order. Symptoms are a sparse
+        map of day offset to symptom count.
+        """
+        bits = {phase: np.zeros(self.num_days, dtype=bool) for phase in self.BITMAP_PHASES}
+        for index, entry in enumerate(self.cycle_data):
+            if entry is not None:
+                phase = 'period' if entry.get('is_period') else entry['predicted_phase'].lower()
+                bits[phase][index] = True
+
+        return {
+            'start': self.first_day.isoformat(),
+            'days': self.num_days,
+            'bit_order': 'little',
+            'phases': {
+                phase: base64.b64encode(np.packbits(day_bits, bitorder='little').tobytes()).decode('ascii')
+                for phase, day_bits in bits.items()
+            },
+            'symptoms': {
+                str(index): self.symptom_count(index)
+                for index in range(self.num_days) if self.symptoms[index]
+            }
+        }
+
+    def day(self, current_date, today=None):
+        """Calendar cell for one day of the range"""
+        index = self._index(current_date)
+        if not 0 <= index < self.num_days:
+            raise ValueError(f"{_as_date(current_date)} is outside {self.first_day} to {self.last_day}")
+        return {
+            'day': current_date.day,
+            'date': current_date,
+            'is_today': today is not None and _as_date(current_date) == _as_date(today),
+            'cycle': self.cycle_data[index],
+            'symptoms': self.symptoms[index] or []
+        }
+
+    def month(self, year, month, today=None):
+        """Month view in the shape used by the calendar template"""
+        _, num_days = monthrange(year, month)
+        first_day = datetime(year, month, 1)
+
+        calendar_days = [{'day': '', 'date': None, 'is_today': False, 'cycle': None, 'symptoms': []}
+                         for _ in range(first_day.weekday())]
+        for day in range(1, num_days + 1):
+            calendar_days.append(self.day(datetime(year, month, day), today))
+
+        prev_month = month - 1 if month > 1 else 12
+        prev_year = year if month > 1 else year - 1
+        next_month = month + 1 if month < 12 else 1
+        next_year = year if month < 12 else year + 1
+
+        return {
+            'year': year,
+            'month': month,
+            'month_name': month_name[month],
+            'days': calendar_days,
+            'prev_month': {'month': prev_month, 'year': prev_year},
+            'next_month': {'month': next_month, 'year': next_year},
+            'today': today
+        }
+
+    @classmethod
+    def for_months(cls, year, month, count=1):
+        """Builder covering ``count`` consecutive months starting at year/month"""
+        end_month_index = year * 12 + (month - 1) + (count - 1)
+        end_year, end_month = divmod(end_month_index, 12)
+        end_month += 1
+        return cls(date(year, month, 1), date(end_year, end_month, monthrange(end_year, end_month)[1]))
+
+    def range_bounds(self):
+        """First and last day as datetimes, for querying the inputs"""
+        return (datetime.combine(self.first_day, datetime.min.time()),
+                datetime.combine(self.last_day, datetime.min.time()))
+
@@ -0,0 +1,176 @@
+"""Population-wide cycle statistics computed with grouped NumPy operations.
+
+Cycles are streamed from MongoDB sorted by (user_id, start_date) and cut into
+chunks of whole users. Each chunk is a handful of flat arrays (a user code,
+start and end day numbers and a severe-pain flag per cycle), so it is cheap
+to send to a worker process; statistics for every user in the chunk are then
+computed with segment reductions instead of a Python loop per user.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from pymongo import UpdateOne
+from app.models.cycle_abnormalities import CycleAbnormalities
+
+CYCLE_RANGE = CycleAbnormalities.CYCLE_RANGE
+PERIOD_RANGE = (1, 14)
+MAX_LENGTH_VARIATION = CycleAbnormalities.MAX_LENGTH_VARIATION
+# Deviation (days) at which regularity reaches 0%, as in MenstrualCycle._regularity_from_deviation
+MAX_EXPECTED_DEVIATION = 14
+
+ANALYSIS_TYPE = 'cycle_statistics'
+
+
+def _segment_sum(values, starts):
+    return np.add.reduceat(values, starts) if len(values) else np.zeros(0)
+
+
+def compute_chunk(user_ids, codes, start_days, end_days, severe_pain, today):
+    """Statistics for every user of a chunk.
+
+    ``codes`` numbers the users 0..n-1 in order (rows sorted by user, then
+    start), ``start_days``/``end_days`` are day numbers (``end_days`` is NaN
+    for an open cycle) and ``today`` is today's day number. Returns a list of
+    result dicts in ``user_ids`` order.
+    """
+    num_users = len(user_ids)
+    rows = len(codes)
+    group_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if rows else np.zeros(0, dtype=np.int64)
+
+    cycle_lengths, period_lengths, cycle_mean, flag_columns = CycleAbnormalities.flag_arrays(
+        codes, start_days, end_days, severe_pain
+    )
+    valid_cycle = (cycle_lengths >= CYCLE_RANGE[0]) & (cycle_lengths <= CYCLE_RANGE[1])
+    valid_period = (period_lengths >= PERIOD_RANGE[0]) & (period_lengths <= PERIOD_RANGE[1])
+
+    # Per-user sums via bincount over the user code
+    cycle_count = np.bincount(codes, weights=valid_cycle, minlength=num_users)
+    cycle_values = np.where(valid_cycle, cycle_lengths, 0.0)
+    cycle_sq_sum = np.bincount(codes, weights=cycle_values ** 2, minlength=num_users)
+    period_count = np.bincount(codes, weights=valid_period, minlength=num_users)
+    period_sum = np.bincount(codes, weights=np.where(valid_period, period_lengths, 0.0), minlength=num_users)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cycle_std = np.sqrt(np.maximum(cycle_sq_sum / cycle_count - cycle_mean ** 2, 0.0))
+        period_mean = period_sum / period_count
+
+    cycle_min = np.minimum.reduceat(np.where(valid_cycle, cycle_lengths, np.inf), group_starts) if rows else np.zeros(0)
+    cycle_max = np.maximum.reduceat(np.where(valid_cycle, cycle_lengths, -np.inf), group_starts) if rows else np.zeros(0)
+    regularity = np.where(
+        cycle_count >= 3,
+        np.round(np.clip(100 - cycle_std / MAX_EXPECTED_DEVIATION * 100, 0, 100), 1),
+        0.0
+    )
+
+    # Abnormality flags per cycle (see CycleAbnormalities), counted per user
+    flag_counts = {name: _segment_sum(flags.astype(np.int64), group_starts) for name, flags in flag_columns.items()}
+
+    last_rows = np.r_[group_starts[1:], rows] - 1 if rows else np.zeros(0, dtype=np.int64)
+    last_start = start_days[last_rows] if rows else np.zeros(0)
+    days_since_start = today - last_start
+    overdue = (cycle_count > 0) & (days_since_start > np.nan_to_num(cycle_mean) + MAX_LENGTH_VARIATION)
+
+    results = []
+    for i, user_id in enumerate(user_ids):
+        has_lengths = cycle_count[i] > 0
+        avg_cycle = round(float(cycle_mean[i]), 1) if has_lengths else 28
+        results.append({
+            'user_id': user_id,
+            'total_cycles': int(cycle_count[i]),
+            'logged_cycles': int(last_rows[i] - group_starts[i] + 1),
+            'avg_cycle_length': avg_cycle,
+            'cycle_length_std': round(float(cycle_std[i]), 2) if has_lengths else 0.0,
+            'min_cycle_length': int(cycle_min[i]) if has_lengths else avg_cycle,
+            'max_cycle_length': int(cycle_max[i]) if has_lengths else avg_cycle,
+            'avg_period_length': round(float(period_mean[i]), 1) if period_count[i] else 5,
+            'cycle_regularity': float(regularity[i]),
+            'days_since_last_start': int(days_since_start[i]),
+            'abnormality_counts': {name: int(counts[i]) for name, counts in flag_counts.items()},
+            'latest_flags': [name for name, flags in flag_columns.items() if flags[last_rows[i]]]
+                            + (['overdue'] if overdue[i] else [])
+        })
+    return results
+
+
+def _to_arrays(user_ids, rows):
+    """Pack the streamed rows of a chunk into compute_chunk arguments"""
+    codes = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    start_days = np.array([row[1] for row in rows], dtype='datetime64[D]').astype(np.int64)
+    ends = np.array([row[2] for row in rows], dtype='datetime64[D]')
+    end_days = np.where(np.isnat(ends), np.nan, ends.astype(np.int64).astype(float))
+    severe_pain = np.fromiter((row[3] for row in rows), dtype=bool, count=len(rows))
+    return user_ids, codes, start_days, end_days, severe_pain
+
+
+def stream_chunks(collection, chunk_rows=50000, batch_size=10000):
+    """Yield chunk arrays of whole users, each with about chunk_rows cycles"""
+    cursor = collection.find(
+        {'start_date': {'$ne': None}},
+        {'_id': 0, 'user_id': 1, 'start_date': 1, 'end_date': 1, 'pain_level': 1}
+    ).sort([('user_id', 1), ('start_date', 1)]).batch_size(batch_size)
+
+    user_ids, rows = [], []
+    for cycle in cursor:
+        user_id = cycle['user_id']
+        if not user_ids or user_ids[-1] != user_id:
+            if len(rows) >= chunk_rows:
+                yield _to_arrays(user_ids, rows)
+                user_ids, rows = [], []
+            user_ids.append(user_id)
+        rows.append((len(user_ids) - 1, cycle['start_date'], cycle.get('end_date'),
+                     cycle.get('pain_level') == 'severe'))
+    if rows:
+        yield _to_arrays(user_ids, rows)
+
+
+def _analytics_updates(results, run_at):
+    for result in results:
+        user_id = result.pop('user_id')
+        yield UpdateOne(
+            {'user_id': user_id, 'analysis_type': ANALYSIS_TYPE},
+            {'$set': {
+                'analysis_date': run_at,
+                'results': result,
+                'model_used': 'batch_numpy',
+                'confidence_score': 1.0 if result['total_cycles'] >= 3 else 0.5
+            }, '$setOnInsert': {'created_at': run_at}},
+            upsert=True
+        )
+
+
+def run(db, workers=None, chunk_rows=50000, batch_size=10000):
+    """Compute statistics for every user and upsert them into cycle_analytics.
+
+    ``workers=0`` computes in this process. Returns (users, cycles).
+    """
+    run_at = datetime.utcnow()
+    today = np.datetime64(run_at.date(), 'D').astype(np.int64)
+    chunks = stream_chunks(db['menstrual_cycles'], chunk_rows, batch_size)
+    users = cycles = 0
+
+    def write(results):
+        if results:
+            db['cycle_analytics'].bulk_write(list(_analytics_updates(results, run_at)), ordered=False)
+
+    if workers == 0:
+        for chunk in chunks:
+            users += len(chunk[0])
+            cycles += len(chunk[1])
+            write(compute_chunk(*chunk, today))
+        return users, cycles
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        max_pending = 2 * workers
+        pending = []
+        for chunk in chunks:
+            users += len(chunk[0])
+            cycles += len(chunk[1])
+            pending.append(pool.submit(compute_chunk, *chunk, today))
+            # Bound memory: write finished chunks before reading further ahead
+            while len(pending) >= max_pending:
+                write(pending.pop(0).result())
+        for future in pending:
+            write(future.result())
+    return users, cycles
@@ -0,0 +1,312 @@
+"""Entry point for the heavy ML dependencies (torch, transformers, scikit-learn).
+
+None of them is imported when this module is, only on first use, so web
+workers and CLI commands that never run MedBERT or train a model do not pay
+their import time and memory.
+"""
+import gc
+import importlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+MEDBERT_MODEL = "Charangan/MedBERT"
+# Pinned so cached embeddings (see EmbeddingCache) stay tied to the weights that produced them.
+# Set it to a commit SHA; a branch or tag is resolved to its commit once per process
+# (see medbert_revision), so keys and loaded weights never follow a moving ref.
+MEDBERT_REVISION = os.getenv('MEDBERT_REVISION', 'main')
+MEDBERT_MAX_TOKENS = 256
+
+# CPU inference: 'fp32', or 'int8' for dynamic quantization of the Linear layers
+MEDBERT_PRECISION = os.getenv('MEDBERT_PRECISION', 'fp32')
+# torch intra-op threads per process; 0 keeps torch's default (all cores)
+MEDBERT_THREADS = int(os.getenv('MEDBERT_THREADS', '0'))
+
+# Micro-batching of concurrent embedding requests (see embedding_batcher)
+MEDBERT_MAX_BATCH = int(os.getenv('MEDBERT_MAX_BATCH', '16'))
+MEDBERT_MAX_WAIT_MS = float(os.getenv('MEDBERT_MAX_WAIT_MS', '10'))
+
+# Unix socket of a shared inference worker (app/services/ml_worker.py); unset runs MedBERT in-process
+MEDBERT_WORKER_SOCKET = os.getenv('MEDBERT_WORKER_SOCKET') or None
+
+# Modules that must not be imported by create_app (see `flask ml import-check`)
+HEAVY_MODULES = ('torch', 'transformers', 'sklearn')
+
+_medbert_tokenizer = None
+_medbert_model = None
+_medbert_lock = threading.Lock()
+_resolved_revision = None
+
+# Set by warm_up; forked workers inherit it along with the loaded model
+_warm_state = {'status': 'cold', 'seconds': None, 'pid': None, 'error': None}
+
+
+def _module(name):
+    return importlib.import_module(name)
+
+
+def torch():
+    return _module('torch')
+
+
+def quantize_int8(model):
+    """Copy of model with its Linear layers dynamically quantized to int8"""
+    torch_module = torch()
+    return torch_module.quantization.quantize_dynamic(model, {torch_module.nn.Linear}, dtype=torch_module.qint8)
+
+
+def medbert_revision():
+    """Commit SHA of the MedBERT weights used by this process.
+
+    MEDBERT_REVISION as is when it is already a commit, otherwise the commit
+    the ref points to on the Hub, looked up once. If the Hub cannot be
+    reached the ref itself is used and a warning logged.
+    """
+    global _resolved_revision
+    if _resolved_revision is None:
+        if re.fullmatch(r'[0-9a-f]{40}', MEDBERT_REVISION):
+            _resolved_revision = MEDBERT_REVISION
+        else:
+            try:
+                hub = _module('huggingface_hub')
+                _resolved_revision = hub.model_info(MEDBERT_MODEL, revision=MEDBERT_REVISION).sha
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    "Could not resolve MedBERT revision %r to a commit: %s", MEDBERT_REVISION, e)
+                _resolved_revision = MEDBERT_REVISION
+    return _resolved_revision
+
+
+def load_medbert(precision=None):
+    """A fresh tokenizer and eval-mode model at the given precision"""
+    precision = precision or MEDBERT_PRECISION
+    if precision not in ('fp32', 'int8'):
+        raise ValueError(f"Unknown MedBERT precision: {precision}")
+    transformers = _module('transformers')
+    revision = medbert_revision()
+    tokenizer = transformers.AutoTokenizer.from_pretrained(MEDBERT_MODEL, revision=revision)
+    model = transformers.AutoModel.from_pretrained(MEDBERT_MODEL, revision=revision).eval()
+    if precision == 'int8':
+        model = quantize_int8(model)
+    return tokenizer, model
+
+
+def get_medbert():
+    """Tokenizer and model, loaded once per process"""
+    global _medbert_tokenizer, _medbert_model
+    if _medbert_tokenizer is None or _medbert_model is None:
+        with _medbert_lock:
+            if _medbert_tokenizer is None or _medbert_model is None:
+                if MEDBERT_THREADS:
+                    torch().set_num_threads(MEDBERT_THREADS)
+                _medbert_tokenizer, _medbert_model = load_medbert()
+    return _medbert_tokenizer, _medbert_model
+
+
+def medbert_infer(text, medbert=None):
+    tokenizer, model = medbert or get_medbert()
+    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=MEDBERT_MAX_TOKENS)
+    with torch().inference_mode():
+        outputs = model(**inputs)
+    return outputs
+
+
+def medbert_embedding(text, medbert=None):
+    """Mean-pooled last hidden state of ``text`` as a list of floats"""
+    outputs = medbert_infer(text, medbert)
+    return outputs.last_hidden_state.mean(dim=1)[0].cpu().numpy().tolist()
+
+
+def medbert_embeddings(texts, max_batch_size=None, medbert=None):
+    """Embeddings of several texts, in order, with one forward pass per batch.
+
+    Texts are sorted by token count and cut into batches of similar length,
+    so padding stays short. Pooling is masked, which gives the same result as
+    medbert_embedding on each text alone. ``medbert`` is a (tokenizer,
+    model) pair to use instead of the process-wide one.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    max_batch_size = max_batch_size or MEDBERT_MAX_BATCH
+    tokenizer, model = medbert or get_medbert()
+    encoded = tokenizer(texts, truncation=True, max_length=MEDBERT_MAX_TOKENS)
+    features = [{name: encoded[name][i] for name in encoded.keys()} for i in range(len(texts))]
+    order = sorted(range(len(texts)), key=lambda i: len(features[i]['input_ids']))
+
+    torch_module = torch()
+    embeddings = [None] * len(texts)
+    with torch_module.inference_mode():
+        for start in range(0, len(order), max_batch_size):
+            indexes = order[start:start + max_batch_size]
+            batch = tokenizer.pad([features[i] for i in indexes], return_tensors="pt")
+            hidden = model(**batch).last_hidden_state
+            mask = batch['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            for i, vector in zip(indexes, pooled.cpu().numpy().tolist()):
+                embeddings[i] = vector
+    return embeddings
+
+
+class MicroBatcher:
+    """Collects concurrent single-item calls into batched calls of ``func``.
+
+    ``func`` takes a list of items and returns a list of results in the same
+    order. The first queued item waits at most ``max_wait_ms`` for others to
+    join before its batch runs. The worker thread is started on first use in
+    each process, so a batcher created before a fork keeps working after it.
+    """
+
+    def __init__(self, func, max_batch_size=None, max_wait_ms=None):
+        self.func = func
+        self.max_batch_size = max_batch_size or MEDBERT_MAX_BATCH
+        self.max_wait = (MEDBERT_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue an item; returns a Future for its result"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='medbert-batcher', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        pending = self._queue
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.func([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            self.batches += 1
+            self.items += len(batch)
+
+
+_embedding_batcher = None
+
+
+def embedding_batcher():
+    """Process-wide MicroBatcher over medbert_embeddings"""
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        with _medbert_lock:
+            if _embedding_batcher is None:
+                _embedding_batcher = MicroBatcher(medbert_embeddings)
+    return _embedding_batcher
+
+
+def embed(text):
+    """Embedding of one text from the shared worker, or the in-process batcher"""
+    if MEDBERT_WORKER_SOCKET:
+        from app.services import ml_worker
+        return ml_worker.client().embed(text)
+    return embedding_batcher()(text)
+
+
+def embed_many(texts):
+    """Embeddings of several texts from the shared worker, or in-process batches"""
+    if MEDBERT_WORKER_SOCKET:
+        from app.services import ml_worker
+        return ml_worker.client().embed_many(texts)
+    return medbert_embeddings(texts)
+
+
+def embedding_labels():
+    """(revision, precision) of the model behind embed and embed_many.
+
+    With a shared worker these are the worker's, which may differ from this
+    process's settings; its local ones are used only while it is unreachable.
+    """
+    if MEDBERT_WORKER_SOCKET:
+        from app.services import ml_worker
+        labels = ml_worker.client().labels()
+        if labels is not None:
+            return labels
+    return medbert_revision(), MEDBERT_PRECISION
+
+
+def warm_up():
+    """Load MedBERT and run dummy forward passes, before gunicorn forks its workers.
+
+    Meant for create_app under ``gunicorn --preload``. The first real
+    request then pays neither ``from_pretrained`` nor lazy kernel set-up,
+    and the weights are shared copy-on-write by the workers. The objects
+    created so far are frozen out of the garbage collector so its passes in
+    the workers do not touch (and copy) their pages, and every forked child
+    resets torch's thread count (see _after_fork).
+
+    With MEDBERT_WORKER_SOCKET set the model lives in the shared worker, so
+    only a ping is sent to it. A failure is recorded as status 'failed' with
+    its error rather than raised, so the app still starts and /ready reports
+    it. Returns the new warm_status().
+    """
+    _warm_state.update(status='loading', error=None)
+    started = time.perf_counter()
+    try:
+        if MEDBERT_WORKER_SOCKET:
+            from app.services import ml_worker
+            ml_worker.client().ping()
+        else:
+            get_medbert()
+            medbert_embedding('warm up')
+            medbert_embeddings(['warm up', 'a longer warm up note to exercise a padded batch'])
+    except Exception as e:
+        _warm_state.update(status='failed', error=f"{type(e).__name__}: {e}")
+        return warm_status()
+    if not MEDBERT_WORKER_SOCKET:
+        if _warm_state['pid'] is None:
+            os.register_at_fork(after_in_child=_after_fork)
+        gc.freeze()
+    _warm_state.update(status='warm', seconds=round(time.perf_counter() - started, 2), pid=os.getpid())
+    return warm_status()
+
+
+def _after_fork():
+    """Per-worker torch threads: N workers each using every core oversubscribe the CPU"""
+    torch().set_num_threads(MEDBERT_THREADS or 1)
+
+
+def warm_status():
+    """Warm-up state of this process: status ('cold', 'loading', 'warm' or 'failed'), seconds, pid, error"""
+    return dict(_warm_state)
+
+
+def random_forest_regressor(**kwargs):
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(**kwargs)
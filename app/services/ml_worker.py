@@ -0,0 +1,215 @@
+"""Standalone MedBERT inference worker and its client.
+
+Each gunicorn worker that calls MedBERT loads its own copy of the model.
+Running one worker process (``python -m app.services.ml_worker``) and
+setting MEDBERT_WORKER_SOCKET makes every web process send its texts to that
+single copy over a Unix socket instead. Requests from all connections go
+through one MicroBatcher, so concurrent callers share forward passes.
+
+Messages are JSON, each preceded by its length as a 4-byte big-endian
+integer. Requests are ``{"texts": [...]}`` or ``{"op": "ping"}``; replies
+are ``{"embeddings": [...]}``, ``{"pid": ..., "max_rss_kb": ...}`` or
+``{"error": "..."}``. Embedding and ping replies also carry the worker's
+``revision`` (MedBERT commit) and ``precision``, which the web processes
+label and key cached embeddings with.
+"""
+import argparse
+import json
+import os
+import resource
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from app.services import ml
+
+_HEADER = struct.Struct('>I')
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def max_rss_kb():
+    """Peak resident set size of this process in KiB (Linux units)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _send(sock, message):
+    payload = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _receive(sock):
+    """Next message on sock, or None once the peer has closed it"""
+    header = _read_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    payload = _read_exactly(sock, _HEADER.unpack(header)[0])
+    if payload is None:
+        raise ConnectionError('connection closed mid-message')
+    return json.loads(payload)
+
+
+def _read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            request = _receive(self.request)
+            if request is None:
+                return
+            try:
+                if request.get('op') == 'ping':
+                    reply = {'pid': os.getpid(), 'max_rss_kb': max_rss_kb()}
+                else:
+                    batcher = ml.embedding_batcher()
+                    futures = [batcher.submit(text) for text in request['texts']]
+                    reply = {'embeddings': [future.result() for future in futures]}
+                reply.update(revision=ml.medbert_revision(), precision=ml.MEDBERT_PRECISION)
+            except Exception as e:
+                reply = {'error': f"{type(e).__name__}: {e}"}
+            _send(self.request, reply)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, preload=True):
+    """Serve embeddings on socket_path until interrupted"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    if preload:
+        ml.medbert_embedding('warm up')
+    with _Server(socket_path, _Handler) as server:
+        print(f"MedBERT worker {os.getpid()} listening on {socket_path}", flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def start_worker(socket_path, timeout=300, preload=True):
+    """Run the worker as a subprocess and wait until it answers a ping.
+
+    Returns the Popen; the caller terminates it.
+    """
+    command = [sys.executable, '-m', 'app.services.ml_worker', '--socket', socket_path]
+    if not preload:
+        command.append('--no-preload')
+    process = subprocess.Popen(command, cwd=_PROJECT_ROOT)
+    deadline = time.monotonic() + timeout
+    client = EmbeddingClient(socket_path)
+    while True:
+        try:
+            client.ping()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"MedBERT worker exited with code {process.returncode}")
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise TimeoutError(f"MedBERT worker did not start within {timeout}s")
+            time.sleep(0.2)
+
+
+class EmbeddingClient:
+    """Client of the inference worker; one connection per thread"""
+
+    def __init__(self, socket_path, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        # (revision, precision) of the worker, from its latest reply
+        self._labels = None
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock, self._local.pid = sock, os.getpid()
+        return sock
+
+    def _request(self, message):
+        # A connection left over from a restarted worker fails once; retry on a fresh one
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send(sock, message)
+                reply = _receive(sock)
+                if reply is None:
+                    raise ConnectionError('worker closed the connection')
+                break
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        if 'error' in reply:
+            raise RuntimeError(f"MedBERT worker: {reply['error']}")
+        if 'revision' in reply:
+            self._labels = (reply['revision'], reply['precision'])
+        return reply
+
+    def embed_many(self, texts):
+        return self._request({'texts': list(texts)})['embeddings']
+
+    def embed(self, text):
+        return self.embed_many([text])[0]
+
+    def ping(self):
+        return self._request({'op': 'ping'})
+
+    def labels(self):
+        """(revision, precision) the worker embeds with, or None if it cannot be reached"""
+        if self._labels is None:
+            try:
+                self.ping()
+            except OSError:
+                return None
+        return self._labels
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+
+_client = None
+
+
+def client():
+    """Process-wide client for MEDBERT_WORKER_SOCKET"""
+    global _client
+    if _client is None:
+        _client = EmbeddingClient(ml.MEDBERT_WORKER_SOCKET)
+    return _client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=ml.MEDBERT_WORKER_SOCKET or '/tmp/hercure-medbert.sock')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='Load the model on the first request instead of at startup.')
+    args = parser.parse_args()
+    # Exit through serve's cleanup on terminate so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    serve(args.socket, preload=args.preload)
+
+
+if __name__ == '__main__':
+    main()
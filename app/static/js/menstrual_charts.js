@@ -200,3 +200,16 @@ window.addEventListener('resize', function() {
         }
     }, 250);
 });
+
+// Decode one phase bitmap from /tracker/calendar/<year>[/<month>]/bitmap
+// into the list of day offsets (from payload.start) that are set.
+function decodeDayBitmap(encoded, days) {
+    const bytes = atob(encoded);
+    const setDays = [];
+    for (let day = 0; day < days; day++) {
+        if (bytes.charCodeAt(day >> 3) & (1 << (day & 7))) {
+            setDays.push(day);
+        }
+    }
+    return setDays;
+}
@@ -0,0 +1,27 @@
+"""Shared fixtures: model code runs against an in-memory mongomock database."""
+import mongomock
+import pytest
+from flask import Flask
+
+from app.extensions import mongo
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(mongo, 'db', database, raising=False)
+    return database
+
+
+@pytest.fixture
+def app(db, tmp_path):
+    """Bare Flask app with the config the models read; no blueprints or extensions"""
+    app = Flask('hercure-tests')
+    app.config.update(
+        TESTING=True,
+        CYCLE_STATS_BACKEND='python',
+        SYMPTOM_STORAGE='documents',
+        MEDBERT_EMBED_ON_SAVE='inline',
+        NOTE_INDEX_DIR=str(tmp_path / 'note_index'),
+    )
+    return app
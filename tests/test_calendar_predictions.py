@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from app.models.menstrual_cycle import MenstrualCycle
+
+
+def test_stored_predictions_follow_a_newly_logged_cycle(db, app, tmp_path, monkeypatch):
+    # No trained model for this user: the average-based predictions are used
+    monkeypatch.chdir(tmp_path)
+    user_id = db.users.insert_one({'username': 'calendar'}).inserted_id
+
+    with app.test_request_context():
+        MenstrualCycle(user_id=user_id, start_date=datetime(2026, 1, 1), end_date=datetime(2026, 1, 5)).save()
+    with app.test_request_context():
+        first = MenstrualCycle.predict_future_cycles(user_id, num_cycles=6)
+    with app.test_request_context():
+        # Read back from the stored predictions
+        assert MenstrualCycle.predict_future_cycles(user_id, num_cycles=6) == first
+
+    with app.test_request_context():
+        MenstrualCycle(user_id=user_id, start_date=datetime(2026, 2, 2), end_date=datetime(2026, 2, 6)).save()
+    with app.test_request_context():
+        after = MenstrualCycle.predict_future_cycles(user_id, num_cycles=6)
+
+    assert after[0]['menstrual_phase'][0] > first[0]['menstrual_phase'][0]
+    assert after[0]['menstrual_phase'][0] > datetime(2026, 2, 2)
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from app.models.cycle_aggregates import CycleAggregates
+from app.models.cycle_snapshot import CycleSnapshot
+from app.models.menstrual_cycle import MenstrualCycle
+
+
+def _legacy_user(db, starts):
+    """A user whose cycles were stored before the running aggregates existed"""
+    user_id = db.users.insert_one({'username': 'legacy'}).inserted_id
+    db.menstrual_cycles.insert_many([
+        {'user_id': user_id, 'start_date': start, 'end_date': start + timedelta(days=4)}
+        for start in starts
+    ])
+    return user_id
+
+
+def test_get_builds_missing_aggregates(db):
+    user_id = _legacy_user(db, [datetime(2026, 1, 1), datetime(2026, 1, 29), datetime(2026, 2, 28)])
+
+    aggregates = CycleAggregates.get(user_id)
+
+    assert aggregates['cycle_length']['count'] == 2
+    assert aggregates['cycle_length']['mean'] == 29
+    assert aggregates['period_length']['count'] == 3
+    assert aggregates['last_start'] == datetime(2026, 2, 28)
+    # Stored, so the next read does not rebuild
+    stored = db.users.find_one({'_id': user_id})[CycleAggregates.FIELD]
+    assert stored['cycle_length'] == aggregates['cycle_length']
+
+
+def test_get_for_a_user_without_cycles(db):
+    user_id = db.users.insert_one({'username': 'new'}).inserted_id
+
+    aggregates = CycleAggregates.get(user_id)
+
+    assert aggregates['cycle_length']['count'] == 0
+    assert aggregates['last_start'] is None
+
+
+def test_record_after_lazy_build_counts_the_cycle_once(db, app):
+    user_id = _legacy_user(db, [datetime(2026, 1, 1), datetime(2026, 1, 29)])
+    CycleAggregates.get(user_id)
+
+    with app.app_context():
+        MenstrualCycle(user_id=user_id, start_date=datetime(2026, 2, 28),
+                       end_date=datetime(2026, 3, 3)).save()
+
+    aggregates = CycleAggregates.get(user_id)
+    expected = CycleAggregates._from_cycles(db.menstrual_cycles.find().sort('start_date', 1))
+    assert aggregates['cycle_length'] == expected['cycle_length']
+    assert aggregates['period_length'] == expected['period_length']
+    assert aggregates['cycle_length']['count'] == 2
+
+
+def test_snapshot_aggregates_of_a_legacy_user(db, app):
+    user_id = _legacy_user(db, [datetime(2026, 1, 1) + timedelta(days=28 * i) for i in range(6)])
+
+    with app.test_request_context():
+        cycle_lengths = CycleSnapshot.for_user(user_id).aggregates['cycle_length']
+
+    assert cycle_lengths['count'] == 5
+    assert cycle_lengths['mean'] == 28
+    assert CycleAggregates.std(cycle_lengths) == 0
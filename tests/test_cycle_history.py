@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from app.models.cycle_abnormalities import CycleAbnormalities
+from app.models.menstrual_cycle import MenstrualCycle
+from app.routes.menstrual import get_cycle_history_page, _format_history_cursor, _history_cursor
+
+
+def _store_cycles(db, user_id, starts):
+    db.menstrual_cycles.insert_many([
+        {'user_id': user_id, 'start_date': start, 'end_date': start + timedelta(days=4)}
+        for start in starts
+    ])
+
+
+def test_length_variation_of_a_user_without_aggregates(db, app):
+    user_id = db.users.insert_one({'username': 'legacy'}).inserted_id
+    # Lengths 22, 22 and 35 days: the last is more than a week off the average
+    _store_cycles(db, user_id, [datetime(2026, 1, 1), datetime(2026, 1, 23),
+                                datetime(2026, 2, 14), datetime(2026, 3, 21)])
+
+    with app.test_request_context():
+        cycles, _ = get_cycle_history_page(user_id)
+
+    descriptions = [entry['description'] for cycle in cycles for entry in cycle['abnormalities']]
+    assert any('average of 26.3 days' in text for text in descriptions)
+    assert not any('None' in text for text in descriptions)
+
+
+def test_length_variation_without_an_average():
+    cycle = {'cycle_length': 40, 'abnormality_flags': ['length_variation']}
+
+    [entry] = CycleAbnormalities.describe(cycle, None)
+
+    assert entry['description'] == 'Cycle length deviates significantly from your average.'
+
+
+def test_pages_do_not_skip_cycles_starting_on_the_same_day(db, app):
+    user_id = db.users.insert_one({'username': 'ties'}).inserted_id
+    _store_cycles(db, user_id, [datetime(2026, 1, 1 + i // 3) for i in range(9)])
+
+    seen, before = [], None
+    while True:
+        cycles, cursor = MenstrualCycle.get_history_page(user_id, before, limit=2)
+        seen.extend(cycle['_id'] for cycle in cycles)
+        if cursor is None:
+            break
+        before = _history_cursor(_format_history_cursor(cursor))
+
+    assert len(seen) == len(set(seen)) == 9
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from app.models.cycle_prediction import CyclePrediction
+
+
+def _phase(user_id, prediction_date):
+    return {
+        'user_id': user_id,
+        'prediction_type': 'calendar',
+        'phase': 'menstrual',
+        'predicted_for_date': datetime(2026, 3, 1),
+        'prediction_date': prediction_date,
+        'is_active': True
+    }
+
+
+def test_duplicates_are_left_to_the_migration(db):
+    user_id = db.users.insert_one({'username': 'dupes'}).inserted_id
+    db.cycle_predictions.insert_many([_phase(user_id, datetime(2026, 2, 1)),
+                                      _phase(user_id, datetime(2026, 2, 2))])
+
+    # Startup only creates indexes; it does not fail or delete anything
+    CyclePrediction.create_indexes()
+    assert db.cycle_predictions.count_documents({}) == 2
+
+    assert CyclePrediction.remove_duplicate_calendar_phases() == 1
+    [kept] = db.cycle_predictions.find()
+    assert kept['prediction_date'] == datetime(2026, 2, 2)
+    assert CyclePrediction.create_calendar_key_index()
+
+
+def test_unchanged_phases_only_get_the_new_fingerprint(db):
+    user_id = db.users.insert_one({'username': 'stable'}).inserted_id
+    predictions = [{'menstrual_phase': (datetime(2026, 3, 1), datetime(2026, 3, 5))}]
+    CyclePrediction.create_indexes()
+
+    CyclePrediction.store_calendar_predictions(user_id, predictions, features_used={'fingerprint': 'a'})
+    [before] = db.cycle_predictions.find()
+    CyclePrediction.store_calendar_predictions(user_id, predictions, features_used={'fingerprint': 'b'})
+    [after] = db.cycle_predictions.find()
+
+    assert after['_id'] == before['_id']
+    assert after['updated_at'] == before['updated_at']
+    assert after['features_used'] == {'fingerprint': 'b', 'cycle_index': 0}
+    assert CyclePrediction.get_cached_calendar_predictions(user_id, 'b') == predictions
@@ -0,0 +1,42 @@
+from bson.objectid import ObjectId
+
+from app.models.cycle_stats import CycleStatsCache
+
+
+def test_set_then_get_hits(db):
+    user_id = ObjectId()
+    miss = CycleStatsCache.get(user_id)
+    assert isinstance(miss, CycleStatsCache.Miss)
+
+    CycleStatsCache.set(user_id, 12, {'average_cycle_length': 28}, miss)
+
+    assert CycleStatsCache.get(user_id) == {'average_cycle_length': 28}
+
+
+def test_stats_computed_before_an_invalidation_are_not_served(db):
+    user_id = ObjectId()
+    miss = CycleStatsCache.get(user_id)
+    # A cycle is saved while the stats are being computed from the old history
+    CycleStatsCache.invalidate(user_id)
+    CycleStatsCache.set(user_id, 12, {'average_cycle_length': 28}, miss)
+
+    assert isinstance(CycleStatsCache.get(user_id), CycleStatsCache.Miss)
+    # Not from the local tier of another process either
+    with CycleStatsCache._lock:
+        CycleStatsCache._local.clear()
+    retry = CycleStatsCache.get(user_id)
+    assert isinstance(retry, CycleStatsCache.Miss)
+
+    CycleStatsCache.set(user_id, 12, {'average_cycle_length': 30}, retry)
+    assert CycleStatsCache.get(user_id) == {'average_cycle_length': 30}
+
+
+def test_invalidate_drops_stored_stats(db):
+    user_id = ObjectId()
+    CycleStatsCache.set(user_id, 12, None, CycleStatsCache.get(user_id))
+    assert CycleStatsCache.get(user_id) is None
+
+    CycleStatsCache.invalidate(user_id)
+
+    assert isinstance(CycleStatsCache.get(user_id), CycleStatsCache.Miss)
+    assert db[CycleStatsCache.COLLECTION].count_documents({'user_id': user_id, 'months': 12}) == 0
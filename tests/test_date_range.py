@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from flask import g
+
+from app.models.menstrual_cycle import MenstrualCycle
+
+
+def test_date_range_overlap_within_a_request(db, app):
+    user_id = db.users.insert_one({'username': 'range'}).inserted_id
+    with app.test_request_context():
+        for start, end in ((datetime(2026, 1, 1), datetime(2026, 1, 5)),
+                           (datetime(2026, 1, 29), datetime(2026, 2, 3)),
+                           (datetime(2026, 2, 26), None)):
+            MenstrualCycle(user_id=user_id, start_date=start, end_date=end, notes='private').save()
+
+    with app.test_request_context():
+        # The whole history already loaded in this request is not reused
+        MenstrualCycle.get_user_cycles(user_id)
+        queries = g.get('cycle_queries', 0)
+        cycles = list(MenstrualCycle.get_cycles_in_date_range(
+            user_id, datetime(2026, 2, 1), datetime(2026, 3, 31)))
+        assert g.cycle_queries == queries + 1
+
+    assert [cycle['start_date'] for cycle in cycles] == [datetime(2026, 1, 29), datetime(2026, 2, 26)]
+    assert all('notes' not in cycle for cycle in cycles)
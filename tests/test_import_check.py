@@ -0,0 +1,43 @@
+"""Importing the app must not load the ML stack (the check behind ``flask ml import-check``).
+
+Empty stand-in ``torch``, ``transformers`` and ``sklearn`` packages are put
+first on the subprocess's PYTHONPATH, so an eager import would succeed
+and show up in ``sys.modules`` even where the real packages are missing.
+"""
+import os
+import subprocess
+import sys
+
+from app.services.ml import HEAVY_MODULES
+
+IMPORT_APP = '''
+import importlib, pkgutil, sys
+import app
+from app import create_app
+for module in pkgutil.walk_packages(app.__path__, 'app.'):
+    importlib.import_module(module.name)
+print(','.join(name for name in {heavy!r} if name in sys.modules))
+'''
+
+
+def _run(tmp_path, source):
+    packages = tmp_path / 'stand_in'
+    for name in HEAVY_MODULES:
+        (packages / name).mkdir(parents=True, exist_ok=True)
+        (packages / name / '__init__.py').write_text('')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(packages), os.getcwd(),
+                                                                    os.getenv('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-c', source], capture_output=True, text=True,
+                            env=env, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return result.stdout.strip()
+
+
+def test_app_modules_do_not_import_the_ml_stack(tmp_path):
+    assert _run(tmp_path, IMPORT_APP.format(heavy=HEAVY_MODULES)) == ''
+
+
+def test_stand_ins_are_detected(tmp_path):
+    # The check above is only meaningful if an eager import would be seen
+    source = IMPORT_APP.format(heavy=HEAVY_MODULES).replace('import app\n', 'import app, torch\n', 1)
+    assert _run(tmp_path, source) == 'torch'
@@ -0,0 +1,193 @@
+"""Round trips through the MedBERT inference worker, with a stand-in model.
+
+The worker runs as a real subprocess (ml_worker.start_worker). Small
+numpy-backed ``torch`` and ``transformers`` packages are put first on its
+PYTHONPATH, so no weights are downloaded and torch need not be installed.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.services import ml_worker
+
+STAND_IN_TORCH = '''
+import numpy as np
+
+
+class Tensor:
+    dtype = None
+
+    def __init__(self, array):
+        self.array = np.asarray(array, dtype=float)
+
+    def unsqueeze(self, dim):
+        return Tensor(np.expand_dims(self.array, dim))
+
+    def to(self, dtype):
+        return self
+
+    def __mul__(self, other):
+        return Tensor(self.array * other.array)
+
+    def __truediv__(self, other):
+        return Tensor(self.array / other.array)
+
+    def __getitem__(self, index):
+        return Tensor(self.array[index])
+
+    def sum(self, dim):
+        return Tensor(self.array.sum(axis=dim))
+
+    def mean(self, dim):
+        return Tensor(self.array.mean(axis=dim))
+
+    def clamp(self, min):
+        return Tensor(np.maximum(self.array, min))
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class inference_mode:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def set_num_threads(count):
+    pass
+'''
+
+STAND_IN_TRANSFORMERS = '''
+import numpy as np
+from torch import Tensor
+
+DIMS = 8
+
+
+class _Tokenizer:
+    """Word ids from character codes, so they are the same in every process"""
+
+    def __call__(self, texts, truncation=True, max_length=256, return_tensors=None):
+        single = isinstance(texts, str)
+        ids = [[sum(map(ord, word)) % 997 + 1 for word in text.split()][:max_length] or [1]
+               for text in ([texts] if single else texts)]
+        encoded = {'input_ids': ids, 'attention_mask': [[1] * len(row) for row in ids]}
+        return {name: Tensor(rows) for name, rows in encoded.items()} if return_tensors else encoded
+
+    def pad(self, features, return_tensors=None):
+        width = max(len(feature['input_ids']) for feature in features)
+        return {name: Tensor([feature[name] + [0] * (width - len(feature[name])) for feature in features])
+                for name in features[0]}
+
+
+class _Output:
+    def __init__(self, last_hidden_state):
+        self.last_hidden_state = last_hidden_state
+
+
+class _Model:
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        return _Output(Tensor(np.sin(input_ids.array[..., None] * np.arange(1, DIMS + 1))))
+
+
+class AutoTokenizer:
+    @staticmethod
+    def from_pretrained(name, revision=None):
+        return _Tokenizer()
+
+
+class AutoModel:
+    @staticmethod
+    def from_pretrained(name, revision=None):
+        return _Model()
+'''
+
+REVISION = '0' * 40
+
+
+@pytest.fixture
+def stand_in_model(tmp_path, monkeypatch):
+    """Make worker subprocesses import the stand-in torch and transformers"""
+    packages = tmp_path / 'stand_in'
+    for name, source in (('torch', STAND_IN_TORCH), ('transformers', STAND_IN_TRANSFORMERS)):
+        (packages / name).mkdir(parents=True)
+        (packages / name / '__init__.py').write_text(source)
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(filter(None, [str(packages), os.getenv('PYTHONPATH')])))
+    monkeypatch.setenv('MEDBERT_REVISION', REVISION)
+    monkeypatch.setenv('MEDBERT_PRECISION', 'fp32')
+    monkeypatch.setenv('MEDBERT_THREADS', '0')
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'medbert.sock')
+
+
+def _stop(process):
+    process.terminate()
+    process.wait(timeout=30)
+
+
+def test_embed_and_ping_round_trip(stand_in_model, socket_path):
+    process = ml_worker.start_worker(socket_path, timeout=60)
+    client = ml_worker.EmbeddingClient(socket_path)
+    try:
+        reply = client.ping()
+        assert reply['pid'] == process.pid
+        assert reply['max_rss_kb'] > 0
+        assert (reply['revision'], reply['precision']) == (REVISION, 'fp32')
+        assert client.labels() == (REVISION, 'fp32')
+
+        embeddings = client.embed_many(['mild cramps', 'headache and fatigue all day', 'mild cramps'])
+        assert len(embeddings) == 3
+        assert all(len(embedding) == 8 for embedding in embeddings)
+        assert np.allclose(embeddings[0], embeddings[2])
+        assert not np.allclose(embeddings[0], embeddings[1])
+        # A single text is pooled the same whether or not it was batched with longer ones
+        assert np.allclose(client.embed('mild cramps'), embeddings[0])
+        assert client.embed_many([]) == []
+    finally:
+        client.close()
+        _stop(process)
+    assert not os.path.exists(socket_path)
+
+
+def test_worker_errors_are_raised(stand_in_model, socket_path):
+    process = ml_worker.start_worker(socket_path, timeout=60, preload=False)
+    client = ml_worker.EmbeddingClient(socket_path)
+    try:
+        with pytest.raises(RuntimeError, match='MedBERT worker'):
+            client.embed_many([None])
+        # The connection stays usable after an error reply
+        assert len(client.embed('still answering')) == 8
+    finally:
+        client.close()
+        _stop(process)
+
+
+def test_client_reconnects_after_worker_restart(stand_in_model, socket_path):
+    process = ml_worker.start_worker(socket_path, timeout=60)
+    client = ml_worker.EmbeddingClient(socket_path)
+    try:
+        before = client.embed('night sweats')
+        first_pid = client.ping()['pid']
+
+        _stop(process)
+        process = ml_worker.start_worker(socket_path, timeout=60)
+
+        # The client's open connection belongs to the stopped worker
+        assert np.allclose(client.embed('night sweats'), before)
+        assert client.ping()['pid'] == process.pid != first_pid
+    finally:
+        client.close()
+        _stop(process)
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from app.models.cycle_embedding import CycleEmbedding
+from app.models.note_index import NoteIndex
+
+
+def _unit(i, dims=8):
+    vector = np.zeros(dims)
+    vector[i] = 1
+    return vector.tolist()
+
+
+@pytest.fixture
+def clean_cache():
+    NoteIndex._loaded.clear()
+    yield
+    NoteIndex._loaded.clear()
+
+
+def _user_with_notes(count):
+    user_id, cycle_ids = ObjectId(), []
+    for i in range(count):
+        cycle_id = ObjectId()
+        CycleEmbedding.store(cycle_id, user_id, _unit(i))
+        NoteIndex.add_cycle(cycle_id, user_id, _unit(i))
+        cycle_ids.append(cycle_id)
+    return user_id, cycle_ids
+
+
+def test_open_maps_are_bounded(db, app, clean_cache, monkeypatch):
+    monkeypatch.setattr(NoteIndex, 'MAX_OPEN', 2)
+    with app.app_context():
+        users = [_user_with_notes(2)[0] for _ in range(3)]
+        for user_id in users:
+            assert NoteIndex.for_user(user_id).search(_unit(0), k=1)
+
+    assert list(NoteIndex._loaded) == [f'user_{users[1]}', f'user_{users[2]}']
+
+
+def test_replaced_index_is_remapped(db, app, clean_cache):
+    with app.app_context():
+        user_id, cycle_ids = _user_with_notes(2)
+        index = NoteIndex.for_user(user_id)
+        index.search(_unit(0), k=1)
+        mapped = NoteIndex._loaded[index.name]
+
+        index.rebuild({'user_id': user_id})
+
+        assert index.name not in NoteIndex._loaded
+        assert [cycle for cycle, _ in index.search(_unit(1), k=1)] == [cycle_ids[1]]
+        assert NoteIndex._loaded[index.name] is not mapped
+
+
+def test_search_skips_a_row_freed_under_a_cached_map(db, app, clean_cache):
+    with app.app_context():
+        user_id, cycle_ids = _user_with_notes(3)
+        index = NoteIndex.for_user(user_id)
+        index.search(_unit(0), k=3)
+        stamp = os.stat(index.ids_path).st_mtime_ns
+
+        index.remove(cycle_ids[2])
+        # As seen by a process that has not noticed the new mtime yet
+        os.utime(index.ids_path, ns=(stamp, stamp))
+
+        results = index.search(_unit(2), k=3)
+
+    assert cycle_ids[2] not in [cycle for cycle, _ in results]
+    assert len(results) == 2
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from app.models.menstrual_cycle import CycleSymptom, MenstrualCycle
+from app.models.symptom_bucket import SymptomBucket
+from app.models.symptom_rollup import SymptomRollup
+
+
+def _legacy_logs(db):
+    """A user whose symptom logs were stored before the rollups existed"""
+    user_id = db.users.insert_one({'username': 'legacy'}).inserted_id
+    now = datetime.utcnow()
+    db.cycle_symptoms.insert_many([
+        {'user_id': user_id, 'date': now - timedelta(days=2), 'symptoms': ['cramps', 'fatigue'],
+         'emoji_rating': '😣'},
+        {'user_id': user_id, 'date': now - timedelta(days=1), 'symptoms': ['cramps'], 'emoji_rating': '😣'},
+        {'user_id': user_id, 'date': now - timedelta(days=1), 'symptom': 'headache', 'emoji_rating': '🙂'},
+        {'user_id': user_id, 'date': None, 'symptoms': ['cramps'], 'emoji_rating': '🙂'},
+    ])
+    return user_id, now
+
+
+def test_legacy_logs_are_rolled_up_on_first_read(db):
+    user_id, now = _legacy_logs(db)
+
+    assert CycleSymptom.get_emoji_summary(user_id) == {'😣': 2, '🙂': 1}
+    frequency = MenstrualCycle._get_symptom_frequency(user_id, now - timedelta(days=30), now)
+    assert [(item['_id'], item['count']) for item in frequency][:1] == [('cramps', 2)]
+    assert db.users.find_one({'_id': user_id})[SymptomRollup.BUILT_FIELD]
+
+
+def test_logs_recorded_after_the_backfill_are_counted_once(db):
+    user_id, now = _legacy_logs(db)
+    CycleSymptom.get_emoji_summary(user_id)
+
+    log = {'user_id': user_id, 'date': now, 'symptoms': ['cramps'], 'emoji_rating': '😣'}
+    db.cycle_symptoms.insert_one(log)
+    SymptomRollup.record_log(user_id, log)
+
+    assert CycleSymptom.get_emoji_summary(user_id) == {'😣': 3, '🙂': 1}
+
+
+def test_undated_log_goes_to_the_undated_bucket(db):
+    user_id = db.users.insert_one({'username': 'undated'}).inserted_id
+
+    log = SymptomBucket.append({'user_id': user_id, 'date': None, 'symptoms': ['bloating']})
+
+    bucket = db[SymptomBucket.COLLECTION].find_one({'user_id': user_id})
+    assert bucket['month'] is None
+    assert [entry['_id'] for entry in SymptomBucket.history(user_id)] == [log['_id']]